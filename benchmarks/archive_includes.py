@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# Benchmarks preprocessing headers straight out of a zip archive, through a
+# search path of the form sdk.zip!/include, against first extracting the
+# archive to disk as build services have tended to do. The archive holds
+# many more headers than are included, as an SDK does. Each run uses a new
+# Preprocessor.
+
+import sys, os, time, tempfile, shutil, zipfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.perf_counter
+
+def write_archive(tmpdir, count, included):
+    archive = os.path.join(tmpdir, 'sdk.zip')
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for n in range(count):
+            lines = ['#pragma once\n']
+            for m in range(50):
+                lines.append('extern int sdk%d_%d(const char *s, unsigned long n);\n' % (n, m))
+            zf.writestr('include/sdk/header%d.h' % n, ''.join(lines))
+    return archive, ''.join(['#include <sdk/header%d.h>\n' % (n * count // included) for n in range(included)])
+
+def run(path, source):
+    p = Preprocessor()
+    p.line_directive = None
+    p.add_path(path)
+    p.parse(source)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue()
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [1000, 5000]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            archive, source = write_archive(tmpdir, count, 100)
+            start = clock()
+            with zipfile.ZipFile(archive) as zf:
+                zf.extractall(os.path.join(tmpdir, 'extracted'))
+            output1 = run(os.path.join(tmpdir, 'extracted', 'include'), source)
+            elapsed = clock() - start
+            print("%5d headers in archive, extracted then preprocessed   %7.3f secs" % (count, elapsed))
+            start = clock()
+            output2 = run(archive + '!/include', source)
+            elapsed = clock() - start
+            print("%5d headers in archive, preprocessed from the archive %7.3f secs" % (count, elapsed))
+            assert output1 == output2
+        finally:
+            shutil.rmtree(tmpdir)
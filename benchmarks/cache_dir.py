@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# Benchmarks the directory of lexed files kept between runs by --cache-dir, on
+# a synthetic set of headers of declarations and comments. Compares a run
+# without it, a cold run which fills the directory, and a warm run which
+# loads every header from it. The in process cache of lexed files is turned
+# off, so as to time what a fresh run of the pcpp command would do.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+def write_headers(tmpdir, count, lines):
+    for n in range(count):
+        with open(os.path.join(tmpdir, 'header%d.h' % n), 'wt') as oh:
+            oh.write('#ifndef HEADER%d_H\n#define HEADER%d_H\n' % (n, n))
+            for m in range(lines):
+                oh.write('/* Returns the %dth thing of header %d */\nextern const char *function%d_%d(const char *s, unsigned long n, double d);\n' % (m, n, n, m))
+            oh.write('#endif\n')
+    return ''.join(['#include "header%d.h"\n' % n for n in range(count)])
+
+def run(tmpdir, source, cache_dir):
+    p = Preprocessor()
+    p.lexed_file_cache = None
+    p.cache_dir = cache_dir
+    p.add_path(tmpdir)
+    p.parse(source)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue(), p.stats
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [20, 100]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache_dir = os.path.join(tmpdir, 'cache')
+        for count in counts:
+            source = write_headers(tmpdir, count, 500)
+            shutil.rmtree(cache_dir, ignore_errors = True)
+            outputs = []
+            for name, path in (('none', None), ('cold', cache_dir), ('warm', cache_dir)):
+                start = clock()
+                output, stats = run(tmpdir, source, path)
+                elapsed = clock() - start
+                outputs.append(output)
+                print("%4d headers, cache dir %-4s %7.3f secs, %4d hits" % (count, name, elapsed, stats['cache_dir_hits']))
+            assert outputs[0] == outputs[1] == outputs[2]
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# Benchmarks finding the files a translation unit includes with
+# dependencies_only, on synthetic headers of macros, declarations, function
+# bodies and conditional groups, totalling some thirty thousand lines.
+# Compares preprocessing everything against only executing directives, each
+# the first time the headers are seen and again once their lexed text, or
+# the minimised text of their directives, is cached.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcpp import Preprocessor
+from pcpp.lexer import LexedFileCache
+
+clock = time.process_time
+
+def write_headers(tmpdir, count, lines):
+    with open(os.path.join(tmpdir, 'main.c'), 'wt') as main:
+        for n in range(count):
+            main.write('#include "config%d.h"\n' % n)
+            with open(os.path.join(tmpdir, 'config%d.h' % n), 'wt') as oh:
+                oh.write('#ifndef CONFIG%d_H\n#define CONFIG%d_H\n' % (n, n))
+                if n > 0:
+                    oh.write('#include "config%d.h"\n' % (n - 1))
+                for m in range(0, lines, 10):
+                    oh.write('#define CONFIG%d_FEATURE%d %d\n' % (n, m, m))
+                    oh.write('#define CONFIG%d_CALL%d(a, b) ((a) * CONFIG%d_FEATURE%d + (b))\n' % (n, m, n, m))
+                    oh.write('#if CONFIG%d_FEATURE%d > 100\n' % (n, m))
+                    oh.write('extern int config%d_function%d(const char *s, unsigned long n);\n' % (n, m))
+                    oh.write('#endif\n')
+                    oh.write('static inline int config%d_inline%d(int x)\n{\n' % (n, m))
+                    oh.write('    /* Scaled by the feature */\n')
+                    oh.write('    return CONFIG%d_CALL%d(x, CONFIG%d_FEATURE%d) + sizeof("config%d");\n' % (n, m, n, m, n))
+                    oh.write('}\n')
+                oh.write('#endif\n')
+    return os.path.join(tmpdir, 'main.c')
+
+def preprocess(main, dependencies_only, cache):
+    p = Preprocessor()
+    p.lexed_file_cache = cache
+    p.dependencies_only = dependencies_only
+    with open(main, 'rt') as ih:
+        p.parse(ih)
+        while p.token() is not None:
+            pass
+    return [x.included_abspath for x in p.include_times]
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [10, 30]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            main = write_headers(tmpdir, count, 1000)
+            included = []
+            cache = LexedFileCache()
+            for dependencies_only in (False, True):
+                for title in ('first', 'cached'):
+                    start = clock()
+                    included.append(preprocess(main, dependencies_only, cache))
+                    elapsed = clock() - start
+                    print("%6d lines of headers, %s %-6s %7.3f secs" % (count * 1000, 'dependencies only' if dependencies_only else 'preprocessed     ', title, elapsed))
+            assert all([x == included[0] for x in included])
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# Benchmarks skipping disabled #if groups, on a synthetic header shaped like the
+# platform headers which keep a block of declarations per platform, compiler
+# and language standard, of which all but one are disabled. Compares runs with
+# and without skipping over the disabled groups without lexing them.
+
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+platforms = ('_WIN32', '__APPLE__', '__linux__', '__FreeBSD__', '__sun')
+
+def platform_h(count):
+    lines = ['#define __linux__ 1']
+    for n in range(count):
+        for idx, platform in enumerate(platforms):
+            lines.append(('#if defined(%s)' if idx == 0 else '#elif defined(%s)') % platform)
+            lines.append('/* Declarations for %s */' % platform)
+            lines.append('#  ifdef __cplusplus')
+            lines.append('extern "C" int function%d_%d(const char *s, unsigned long n); // C++' % (n, idx))
+            lines.append('#  else')
+            lines.append('extern int function%d_%d(const char *s, unsigned long n);' % (n, idx))
+            lines.append('#  endif')
+            lines.append('#define CONSTANT%d_%d (0x%04x + %d)' % (n, idx, n, idx))
+        lines.append('#endif')
+    return "\n".join(lines) + "\n"
+
+def run(input, skip):
+    p = Preprocessor()
+    p.skip_disabled_regions = skip
+    p.parse(input)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue(), p.stats
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [1000, 5000]
+    for count in counts:
+        input = platform_h(count)
+        outputs = []
+        for skip in (False, True):
+            start = clock()
+            output, stats = run(input, skip)
+            elapsed = clock() - start
+            outputs.append(output)
+            print("%6d blocks, skipping %-5s %7.3f secs, %7d disabled lines skipped" % (count, skip, elapsed, stats['disabled_lines_skipped']))
+        assert outputs[0] == outputs[1]
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# Benchmarks how macro expansion scales with the number of macro invocations
+# on a single line, as found in generated tables and X-macro lists. Time per
+# invocation ought to stay roughly constant as the line gets longer.
+
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+def function_calls(count):
+    return "#define F(x, y) { x, y },\n" + " ".join(["F(%d, B)" % n for n in range(count)]) + "\n"
+
+def object_likes(count):
+    return "#define A 1\n#define B A + A\n" + " ".join(["B"] * count) + "\n"
+
+def token_pastes(count):
+    return "#define CAT(a, b) a ## b\n#define NAME(n) CAT(prefix_, n) ## _suffix\n" + " ".join(["NAME(%d)" % n for n in range(count)]) + "\n"
+
+def plain_lines(count):
+    # Ordinary code naming no macros, split into chunks by directives
+    return "#define A 1\n" + "".join(["int f%d(int x) { return x + %d; }\n#if A\n" % (n, n) + "#endif\n" for n in range(count)])
+
+def xmacro_list(count):
+    # An X-macro list all on one line, expanded by a function like macro
+    return ("#define ENTRY(name, value) name = value,\n#define LIST(X) "
+        + " ".join(["X(e%d, %d)" % (n, n) for n in range(count)]) + "\nenum { LIST(ENTRY) };\n")
+
+def run(input):
+    p = Preprocessor()
+    p.parse(input)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return len(oh.getvalue())
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [1000, 10000, 100000]
+    for name, workload in (('function like invocations', function_calls), ('object like invocations', object_likes), ('token pastes', token_pastes), ('X-macro list entries', xmacro_list), ('lines naming no macros', plain_lines)):
+        for count in counts:
+            input = workload(count)
+            start = clock()
+            size = run(input)
+            elapsed = clock() - start
+            print("%7d %-26s %9d bytes output in %7.3f secs = %6.1f usecs per invocation" % (count, name, size, elapsed, elapsed * 1000000 / count))
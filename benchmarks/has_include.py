@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# Benchmarks remembering what __has_include() evaluated to, on a source file
+# including many headers which each include a feature detection header,
+# much like <version> or Boost.Config, testing for the same forty headers
+# with __has_include(<...>) every time. Compares runs where every
+# __has_include() looks for its header again against runs where answers
+# are remembered, each with a new Preprocessor.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+class Forgetful(dict):
+    # Stands in for the remembered answers, remembering nothing
+    def __setitem__(self, key, value):
+        pass
+
+def write_headers(tmpdir, count, dirs):
+    paths = [os.path.join(tmpdir, 'include%d' % n) for n in range(dirs)]
+    for path in paths:
+        os.mkdir(path)
+        os.mkdir(os.path.join(path, 'sys'))
+    with open(os.path.join(paths[-1], 'sys', 'feature0.h'), 'wt') as oh:
+        oh.write('\n')
+    with open(os.path.join(paths[-1], 'features.h'), 'wt') as oh:
+        for n in range(40):
+            oh.write('#if __has_include(<sys/feature%d.h>)\n#define HAVE_FEATURE%d 1\n#endif\n' % (n, n))
+    for n in range(count):
+        with open(os.path.join(paths[-1], 'header%d.h' % n), 'wt') as oh:
+            oh.write('#include <features.h>\nint header%d = HAVE_FEATURE0;\n' % n)
+    return paths, ''.join(['#include <header%d.h>\n' % n for n in range(count)])
+
+def run(paths, source, remember):
+    p = Preprocessor()
+    if not remember:
+        p._Preprocessor__has_includes = Forgetful()
+    for path in paths:
+        p.add_path(path)
+    p.parse(source)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue(), p.stats
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [50, 200]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            paths, source = write_headers(tmpdir, count, 20)
+            outputs = []
+            for name, remember in (('off', False), ('on', True)):
+                start = clock()
+                output, stats = run(paths, source, remember)
+                elapsed = clock() - start
+                outputs.append(output)
+                print("%4d headers, __has_include() answers remembered %-3s %7.3f secs, %6d hits" % (count, name, elapsed, stats['has_include_cache_hits']))
+            assert outputs[0] == outputs[1]
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# Benchmarks macro expansion where the hide-sets of tokens get large, as with
+# deeply nested and recursive macro expansions. Also runs the C11 standard
+# examples from tests/cstd.py, which are small but torturous.
+
+import sys, os, time, tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+import tests.cstd
+
+clock = time.process_time
+REPEATS = 3
+
+def nested_calls(depth):
+    # Each level calls the level below twice, so there are 2^depth expansions at
+    # the bottom, each of which has a hide-set with depth names in it.
+    out = "#define A0(x) [x]\n"
+    for n in range(1, depth + 1):
+        out += "#define A%d(x) A%d(A%d(x))\n" % (n, n - 1, n - 1)
+    return out + "A%d(y)\n" % depth
+
+def chained_objects(depth, width):
+    # A long chain of object like macros, each expanding into width tokens
+    out = "#define M0 0\n"
+    for n in range(1, depth + 1):
+        out += "#define M%d %s\n" % (n, ' + '.join(['M%d' % (n - 1)] + ['x'] * (width - 1)))
+    return out + "M%d\n" % depth
+
+def self_referential(count, depth):
+    # Many macros which refer to themselves and each other, which is where
+    # hide-set membership tests matter most
+    out = ""
+    for n in range(count):
+        out += "#define S%d S%d S%d\n" % (n, n, (n + 1) % count)
+    return out + " ".join(["S%d" % n for n in range(depth)]) + "\n"
+
+def run(input):
+    p = Preprocessor()
+    p.parse(input)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return len(oh.getvalue())
+
+if __name__ == "__main__":
+    cstd = "\n".join([cls.input for cls in vars(tests.cstd).values() if isinstance(cls, type) and hasattr(cls, 'input')])
+    workloads = [
+        ('tests/cstd.py C11 examples', cstd),
+        ('nested function calls, depth 8', nested_calls(8)),
+        ('chained object macros, depth 300', chained_objects(300, 3)),
+        ('self referential macros, 60', self_referential(60, 60)),
+    ]
+    for name, input in workloads:
+        best = None
+        for n in range(REPEATS):
+            start = clock()
+            size = run(input)
+            elapsed = clock() - start
+            best = elapsed if best is None else min(best, elapsed)
+        tracemalloc.start()
+        run(input)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("%-36s %8d bytes output in %.3f secs, peak memory %.1f Mb" % (name, size, best, peak / 1048576.0))
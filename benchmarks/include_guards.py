@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# Benchmarks skipping #include of files whose include guard macro is still
+# defined, on a source file including many headers which each include the
+# same twenty common headers. The common headers are guarded by
+# #define MACRO 1, which the heuristics auto applying #pragma once don't
+# recognise, so without skipping each is opened, read and its lines skipped
+# every time it is included. Compares runs with and without skipping, each
+# with a new Preprocessor.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+def write_headers(tmpdir, count, common):
+    for n in range(common):
+        with open(os.path.join(tmpdir, 'common%d.h' % n), 'wt') as oh:
+            oh.write('/* Common header %d */\n#ifndef COMMON%d_H\n#define COMMON%d_H 1\n' % (n, n, n))
+            for m in range(50):
+                oh.write('extern int common%d_%d(int a, int b);\n' % (n, m))
+            oh.write('#endif\n')
+    for n in range(count):
+        with open(os.path.join(tmpdir, 'header%d.h' % n), 'wt') as oh:
+            for m in range(common):
+                oh.write('#include "common%d.h"\n' % m)
+            oh.write('int header%d;\n' % n)
+    return ''.join(['#include "header%d.h"\n' % n for n in range(count)])
+
+def run(tmpdir, source, skip):
+    p = Preprocessor()
+    p.skip_guarded_includes = skip
+    p.add_path(tmpdir)
+    p.parse(source)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue(), p.stats
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [100, 400]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            source = write_headers(tmpdir, count, 20)
+            outputs = []
+            for name, skip in (('off', False), ('on', True)):
+                start = clock()
+                output, stats = run(tmpdir, source, skip)
+                elapsed = clock() - start
+                outputs.append(output)
+                print("%4d headers, skipping guarded includes %-3s %7.3f secs, %6d opens avoided" % (count, name, elapsed, stats['guarded_include_opens_avoided']))
+            assert outputs[0].split() == outputs[1].split()
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# Benchmarks the include resolution cache, on a source file including many
+# small headers spread over forty search directories, most of them in the
+# last few. Without the cache, every directory before the one holding a
+# header is tried by opening the file there, which fails. Compares runs with
+# and without the cache, each with a new Preprocessor.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+from pcpp.preprocessor import IncludeCache
+
+clock = time.process_time
+
+def write_headers(tmpdir, count, dirs):
+    paths = [os.path.join(tmpdir, 'include%d' % n) for n in range(dirs)]
+    for path in paths:
+        os.mkdir(path)
+    lines = []
+    for n in range(count):
+        path = paths[dirs - 1 - n % 4]
+        with open(os.path.join(path, 'header%d.h' % n), 'wt') as oh:
+            oh.write('int header%d;\n' % n)
+        lines.append('#include <header%d.h>\n' % n)
+        lines.append('#if __has_include("missing%d.h")\n#error\n#endif\n' % n)
+    return paths, ''.join(lines)
+
+def run(paths, source, cache):
+    p = Preprocessor()
+    p.include_cache = cache
+    for path in paths:
+        p.add_path(path)
+    p.parse(source)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue(), p.stats
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [500, 2000]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            paths, source = write_headers(tmpdir, count, 40)
+            outputs = []
+            cache = IncludeCache()
+            for name, include_cache in (('none', None), ('cold', cache), ('warm', cache)):
+                start = clock()
+                output, stats = run(paths, source, include_cache)
+                elapsed = clock() - start
+                outputs.append(output)
+                print("%5d includes, include cache %-4s %7.3f secs, %6d opens avoided" % (count, name, elapsed, stats['include_probes_avoided']))
+            assert outputs[0] == outputs[1] == outputs[2]
+        finally:
+            shutil.rmtree(tmpdir)
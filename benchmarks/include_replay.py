@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# Benchmarks replaying included files recorded into a replay directory, on a
+# synthetic translation unit including headers of macros, declarations and
+# conditional groups, totalling some thirty thousand lines. Compares
+# preprocessing it without replays, recording replays and then with a new
+# Preprocessor replaying them as another translation unit would.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcpp import Preprocessor
+from pcpp.preprocessor import IncludeReplayCache
+
+clock = time.process_time
+
+def write_headers(tmpdir, count, lines):
+    with open(os.path.join(tmpdir, 'main.c'), 'wt') as main:
+        for n in range(count):
+            main.write('#include "config%d.h"\n' % n)
+            with open(os.path.join(tmpdir, 'config%d.h' % n), 'wt') as oh:
+                oh.write('#ifndef CONFIG%d_H\n#define CONFIG%d_H\n' % (n, n))
+                for m in range(0, lines, 6):
+                    oh.write('#define CONFIG%d_FEATURE%d %d\n' % (n, m, m))
+                    oh.write('#define CONFIG%d_CALL%d(a, b) ((a) * CONFIG%d_FEATURE%d + (b))\n' % (n, m, n, m))
+                    oh.write('#if CONFIG%d_FEATURE%d > 100\n' % (n, m))
+                    oh.write('#define CONFIG%d_BIG%d 1\n' % (n, m))
+                    oh.write('#endif\n')
+                    oh.write('extern int config%d_function%d(const char *s, unsigned long n);\n' % (n, m))
+                oh.write('#endif\n')
+        main.write('int main(void) { return CONFIG0_CALL6(1, 2); }\n')
+    return os.path.join(tmpdir, 'main.c')
+
+def preprocess(main, cache):
+    p = Preprocessor()
+    p.include_replay_cache = cache
+    p.add_path(os.path.dirname(main))
+    with open(main, 'rt') as ih:
+        p.parse(ih)
+        while p.token() is not None:
+            pass
+    return p
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [10, 30]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            main = write_headers(tmpdir, count, 1000)
+            replays = os.path.join(tmpdir, 'replays')
+            for title, cache in (('without replays', None), ('recording replays', IncludeReplayCache(replays)), ('replaying', IncludeReplayCache(replays))):
+                start = clock()
+                p = preprocess(main, cache)
+                elapsed = clock() - start
+                print("%6d lines of headers, %18s %7.3f secs (%d replayed)" % (count * 1000, title, elapsed, p.stats['include_replay_hits']))
+            assert p.stats['include_replay_hits'] == count
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,40 @@
+#!/usr/bin/python
+# Benchmarks the cache of function like macro invocations, which saves
+# repeating argument pre-expansion, stringification and token pasting when a
+# macro is invoked again with identical arguments, as in generated code.
+# Compares a range of cache sizes, including disabled.
+
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+def repeated_invocations(count):
+    return ("#define MAX(a, b) ((a) > (b) ? (a) : (b))\n#define MIN(a, b) ((a) < (b) ? (a) : (b))\n"
+        "#define CLAMP(x, lo, hi) MAX(lo, MIN(x, hi))\n#define FIELD(type, name) type name; enum { name##_size = sizeof(type) };\n"
+        + "".join(["int v%d = CLAMP(value, 0, 255) + MAX(a, MAX(b, c)); FIELD(int, f%d)\n" % (n, n % 100) for n in range(count)]))
+
+def run(input, size):
+    p = Preprocessor()
+    p.macro_invocation_cache_size = size
+    p.parse(input)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue(), p.stats
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [1000, 10000]
+    for count in counts:
+        input = repeated_invocations(count)
+        outputs = []
+        for size in (0, 16, 4096):
+            start = clock()
+            output, stats = run(input, size)
+            elapsed = clock() - start
+            outputs.append(output)
+            print("%6d lines, cache size %4d %7.3f secs, %7d hits %6d misses %6d evictions" % (count, size, elapsed,
+                stats['macro_invocation_cache_hits'], stats['macro_invocation_cache_misses'], stats['macro_invocation_cache_evictions']))
+        assert all(output == outputs[0] for output in outputs)
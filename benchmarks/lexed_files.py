@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# Benchmarks a cache of lexed files shared between preprocessors, on a service
+# which creates a new Preprocessor per request, every one of which includes the same header
+# of declarations, and an X-macro .def file without an include guard several
+# times over. Compares runs with and without the cache.
+
+import sys, os, time, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+from pcpp.lexer import LexedFileCache
+
+clock = time.process_time
+
+def write_headers(tmpdir, count):
+    with open(os.path.join(tmpdir, 'decls.h'), 'wt') as oh:
+        oh.write('#ifndef DECLS_H\n#define DECLS_H\n')
+        for n in range(count):
+            oh.write('extern int function%d(const char *s, unsigned long n); /* function %d */\n' % (n, n))
+        oh.write('#endif\n')
+    with open(os.path.join(tmpdir, 'colours.def'), 'wt') as oh:
+        for n in range(count // 10):
+            oh.write('COLOUR(colour%d, 0x%06x)\n' % (n, n))
+
+source = """#include "decls.h"
+#define COLOUR(name, value) name,
+enum colours {
+#include "colours.def"
+};
+#undef COLOUR
+#define COLOUR(name, value) value,
+static const int colour_values[] = {
+#include "colours.def"
+};
+"""
+
+def run(tmpdir, requests, cache):
+    for n in range(requests):
+        p = Preprocessor()
+        p.lexed_file_cache = cache
+        p.add_path(tmpdir)
+        p.parse(source)
+        oh = StringIO()
+        p.write(oh)
+        assert p.return_code == 0
+    return oh.getvalue()
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [1000, 5000]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for count in counts:
+            write_headers(tmpdir, count)
+            outputs = []
+            for cache in (None, LexedFileCache()):
+                start = clock()
+                outputs.append(run(tmpdir, 10, cache))
+                elapsed = clock() - start
+                print("%6d declarations, 10 requests, cache %-5s %7.3f secs" % (count, cache is not None, elapsed))
+            assert outputs[0] == outputs[1]
+    finally:
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# Benchmarks the tokens per second of each lexer engine over the mcpp test corpus
+# in tests/test-c, both by pulling tokens one at a time with token() and by
+# iterating the whole buffer as Preprocessor.group_lines() does.
+
+import sys, os, glob, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcpp.parser import default_lexer, lexer_engines
+
+clock = time.process_time
+REPEATS = 5
+
+def load_corpus():
+    corpus = []
+    here = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(here, '..', 'tests', 'test-c', '*.[ch]'))):
+        with open(path, 'rt', encoding = 'latin-1') as ih:
+            # The same normalisation which Preprocessor.group_lines() does
+            corpus.append("\n".join([x.rstrip() for x in ih.read().splitlines()]))
+    return corpus
+
+def by_token(lex, corpus):
+    count = 0
+    for data in corpus:
+        lex.input(data)
+        while True:
+            tok = lex.token()
+            if not tok:
+                break
+            count += 1
+    return count
+
+def by_iteration(lex, corpus):
+    count = 0
+    for data in corpus:
+        lex.input(data)
+        for tok in lex:
+            count += 1
+    return count
+
+if __name__ == "__main__":
+    corpus = load_corpus()
+    print("Lexing %d files (%d bytes) %d times each" % (len(corpus), sum([len(x) for x in corpus]), REPEATS))
+    for engine in lexer_engines:
+        lex = default_lexer(engine)
+        for name, method in (('token()', by_token), ('iteration', by_iteration)):
+            best = None
+            for n in range(REPEATS):
+                start = clock()
+                count = method(lex, corpus)
+                elapsed = clock() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print("  %-5s %-10s %8d tokens in %.3f secs = %10.0f tokens/sec" % (engine, name, count, best, count / best))
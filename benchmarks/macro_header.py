@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# Benchmarks #including a large header which only defines function like
+# macros, as system and SDK headers mostly do, from a translation unit which
+# uses just a few of them. Compares eager and lazy macro definition.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+def macro_header(count):
+    lines = ["#ifndef MACROS_H", "#define MACROS_H"]
+    for n in range(count):
+        lines.append("#define MAKE_HANDLE_%d(type, name, ...) typedef struct type##_%d { int unused; } *name; enum { name##_id = %d }; static const char *name##_str = #name; __VA_ARGS__" % (n, n, n))
+        lines.append("#define CHECK_%d(x, y) ((x) > (y) ? CALL_%d(x) : CALL_%d(y))" % (n, n, n))
+        lines.append("#define CALL_%d(x) call_%d(x, __FILE__, __LINE__)" % (n, n))
+    lines.append("#endif")
+    return "\n".join(lines) + "\n"
+
+def run(path, lazy):
+    p = Preprocessor()
+    p.lazy_macro_definitions = lazy
+    p.line_directive = None
+    p.parse('#include "macros.h"\n#include "macros.h"\nMAKE_HANDLE_1(h, HWND) int y = CHECK_2(a, b);\n', os.path.join(path, 'main.c'))
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue()
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [1000, 10000]
+    path = tempfile.mkdtemp()
+    try:
+        for count in counts:
+            with open(os.path.join(path, 'macros.h'), 'wt') as oh:
+                oh.write(macro_header(count))
+            outputs = []
+            for lazy in (False, True):
+                start = clock()
+                outputs.append(run(path, lazy))
+                elapsed = clock() - start
+                print("%6d function like macros, lazy %-5s %7.3f secs" % (count * 3, lazy, elapsed))
+            assert outputs[0] == outputs[1]
+    finally:
+        shutil.rmtree(path)
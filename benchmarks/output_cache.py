@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# Benchmarks running pcpp with --output-cache, on a synthetic translation unit
+# including headers of macros, declarations and conditional groups, totalling
+# some thirty thousand lines. Compares running without the cache, the first
+# run saving its output and a later run writing the output saved, as repeated
+# builds of unchanged sources would.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcpp import CmdPreprocessor
+
+clock = time.process_time
+
+def write_headers(tmpdir, count, lines):
+    with open(os.path.join(tmpdir, 'main.c'), 'wt') as main:
+        for n in range(count):
+            main.write('#include "config%d.h"\n' % n)
+            with open(os.path.join(tmpdir, 'config%d.h' % n), 'wt') as oh:
+                oh.write('#ifndef CONFIG%d_H\n#define CONFIG%d_H\n' % (n, n))
+                for m in range(0, lines, 6):
+                    oh.write('#define CONFIG%d_FEATURE%d %d\n' % (n, m, m))
+                    oh.write('#define CONFIG%d_CALL%d(a, b) ((a) * CONFIG%d_FEATURE%d + (b))\n' % (n, m, n, m))
+                    oh.write('#if CONFIG%d_FEATURE%d > 100\n' % (n, m))
+                    oh.write('#define CONFIG%d_BIG%d 1\n' % (n, m))
+                    oh.write('#endif\n')
+                    oh.write('extern int config%d_function%d(const char *s, unsigned long n);\n' % (n, m))
+                oh.write('#endif\n')
+        main.write('int main(void) { return CONFIG0_CALL6(1, 2); }\n')
+    return os.path.join(tmpdir, 'main.c')
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [10, 30]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            main = write_headers(tmpdir, count, 1000)
+            output = os.path.join(tmpdir, 'main.i')
+            cache = ['--output-cache', os.path.join(tmpdir, 'cache')]
+            outputs = []
+            for title, options in (('without the cache', []), ('saving output', cache), ('writing output saved', cache)):
+                start = clock()
+                p = CmdPreprocessor(['pcpp', '-o', output, main] + options)
+                elapsed = clock() - start
+                print("%6d lines of headers, %20s %7.3f secs" % (count * 1000, title, elapsed))
+                with open(output, 'rt') as ih:
+                    outputs.append(ih.read())
+            assert outputs[0] == outputs[1] == outputs[2]
+        finally:
+            shutil.rmtree(tmpdir)
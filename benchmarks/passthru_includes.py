@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# Benchmarks including headers matched by passthru_includes, on synthetic
+# headers of a thousand lines each of macros, declarations, function bodies
+# and conditional groups. Compares including them normally
+# against passing them through, which only executes their directives, each
+# the first time the headers are seen and again once they are cached.
+
+import sys, os, re, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcpp import Preprocessor
+from pcpp.lexer import LexedFileCache
+
+clock = time.process_time
+
+def write_headers(tmpdir, count, lines):
+    with open(os.path.join(tmpdir, 'main.c'), 'wt') as main:
+        for n in range(count):
+            main.write('#include <config%d.h>\n' % n)
+            with open(os.path.join(tmpdir, 'config%d.h' % n), 'wt') as oh:
+                oh.write('#ifndef CONFIG%d_H\n#define CONFIG%d_H\n' % (n, n))
+                for m in range(0, lines, 10):
+                    oh.write('#define CONFIG%d_FEATURE%d %d\n' % (n, m, m))
+                    oh.write('#define CONFIG%d_CALL%d(a, b) ((a) * CONFIG%d_FEATURE%d + (b))\n' % (n, m, n, m))
+                    oh.write('#if CONFIG%d_FEATURE%d > 100\n' % (n, m))
+                    oh.write('extern int config%d_function%d(const char *s, unsigned long n);\n' % (n, m))
+                    oh.write('#endif\n')
+                    oh.write('static inline int config%d_inline%d(int x)\n{\n' % (n, m))
+                    oh.write('    /* Scaled by the feature */\n')
+                    oh.write('    return CONFIG%d_CALL%d(x, CONFIG%d_FEATURE%d) + sizeof("config%d");\n' % (n, m, n, m, n))
+                    oh.write('}\n')
+                oh.write('#endif\n')
+        main.write('int main(void) { return CONFIG0_CALL10(1, 2); }\n')
+    return os.path.join(tmpdir, 'main.c')
+
+def preprocess(main, passthru_includes, cache):
+    p = Preprocessor()
+    p.lexed_file_cache = cache
+    p.passthru_includes = passthru_includes
+    p.add_path(os.path.dirname(main))
+    with open(main, 'rt') as ih:
+        p.parse(ih)
+        while p.token() is not None:
+            pass
+    return sorted([(k, ''.join([tok.value for tok in v.value])) for k, v in p.macros.items() if k not in ('__FILE__', '__TIME__')])
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [10, 30]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            main = write_headers(tmpdir, count, 1000)
+            macros = []
+            cache = LexedFileCache()
+            for title, passthru_includes in (('included', None), ('passed through', re.compile('<config'))):
+                for when in ('first', 'cached'):
+                    start = clock()
+                    macros.append(preprocess(main, passthru_includes, cache))
+                    elapsed = clock() - start
+                    print("%6d lines of headers, %-14s %-6s %7.3f secs" % (count * 1000, title, when, elapsed))
+            assert all([x == macros[0] for x in macros])
+        finally:
+            shutil.rmtree(tmpdir)
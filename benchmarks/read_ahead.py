@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# Benchmarks reading files about to be #included in background threads, on
+# a tree of headers each including several more. A network file system or
+# cold page cache is stood in for by on_file_open() sleeping before opening
+# each file, whether or not it is there. Compares runs without read ahead
+# against runs with read_ahead_threads set, each with a new Preprocessor.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+# Time spent waiting is what is saved, so wall clock time is what counts
+clock = time.perf_counter
+
+class SlowPreprocessor(Preprocessor):
+    delay = 0.002
+
+    def on_file_open(self, is_system_include, includepath):
+        time.sleep(self.delay)
+        return super(SlowPreprocessor, self).on_file_open(is_system_include, includepath)
+
+def write_headers(tmpdir, count, fanout):
+    for n in range(count):
+        with open(os.path.join(tmpdir, 'header%d.h' % n), 'wt') as oh:
+            for m in range(n * fanout + 1, min(count, (n + 1) * fanout + 1)):
+                oh.write('#include "header%d.h"\n' % m)
+            for m in range(20):
+                oh.write('extern int header%d_%d(int a, int b);\n' % (n, m))
+    return '#include "header0.h"\n'
+
+def run(tmpdir, source, threads):
+    p = SlowPreprocessor()
+    p.read_ahead_threads = threads
+    p.add_path(tmpdir)
+    p.parse(source)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue(), p.stats
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [100, 400]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            source = write_headers(tmpdir, count, 4)
+            outputs = []
+            for threads in (0, 4, 16):
+                start = clock()
+                output, stats = run(tmpdir, source, threads)
+                elapsed = clock() - start
+                outputs.append(output)
+                print("%4d headers, %2d read ahead threads %7.3f secs, %4d files read ahead" % (count, threads, elapsed, stats['read_ahead_hits']))
+            assert outputs[0] == outputs[1] == outputs[2]
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# Benchmarks starting from the state saved by save_state(), on a synthetic
+# prefix header including config headers of macros, declarations and
+# conditional groups, totalling some thirty thousand lines. Compares
+# preprocessing the prefix header against loading the state saved after
+# preprocessing it, each with a new Preprocessor.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+def write_headers(tmpdir, count, lines):
+    with open(os.path.join(tmpdir, 'prefix.h'), 'wt') as prefix:
+        for n in range(count):
+            prefix.write('#include "config%d.h"\n' % n)
+            with open(os.path.join(tmpdir, 'config%d.h' % n), 'wt') as oh:
+                oh.write('#ifndef CONFIG%d_H\n#define CONFIG%d_H\n' % (n, n))
+                for m in range(0, lines, 6):
+                    oh.write('#define CONFIG%d_FEATURE%d %d\n' % (n, m, m))
+                    oh.write('#define CONFIG%d_CALL%d(a, b) ((a) * CONFIG%d_FEATURE%d + (b))\n' % (n, m, n, m))
+                    oh.write('#if CONFIG%d_FEATURE%d > 100\n' % (n, m))
+                    oh.write('#define CONFIG%d_BIG%d 1\n' % (n, m))
+                    oh.write('#endif\n')
+                    oh.write('extern int config%d_function%d(const char *s, unsigned long n);\n' % (n, m))
+                oh.write('#endif\n')
+    return os.path.join(tmpdir, 'prefix.h')
+
+def preprocess(prefix):
+    p = Preprocessor()
+    with open(prefix, 'rt') as ih:
+        p.parse(ih)
+        while p.token() is not None:
+            pass
+    return p
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [10, 30]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            prefix = write_headers(tmpdir, count, 1000)
+            state = os.path.join(tmpdir, 'prefix.pcpps')
+            start = clock()
+            p1 = preprocess(prefix)
+            elapsed = clock() - start
+            print("%6d lines of prefix headers, preprocessed %7.3f secs" % (count * 1000, elapsed))
+            p1.save_state(state)
+            start = clock()
+            p2 = Preprocessor()
+            assert p2.load_state(state)
+            elapsed = clock() - start
+            print("%6d lines of prefix headers, state loaded %7.3f secs (%d bytes)" % (count * 1000, elapsed, os.path.getsize(state)))
+            assert set(p1.macros) - set(p2.macros) <= set(Preprocessor._unsaved_macros)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# Benchmarks peak memory use when preprocessing a large generated source file.
+# Compares it read whole in one block with it read and lexed a block at a
+# time, both when #included and when given to the pcpp command line. The
+# peak for the latter ought to stay roughly constant however large the file
+# gets, as measured by tracemalloc. This slows the runs down several times
+# over.
+
+import sys, os, time, tempfile, tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcpp import Preprocessor, CmdPreprocessor
+
+clock = time.process_time
+
+def generated_source(path, count):
+    with open(path, 'wt') as oh:
+        oh.write("#define ENTRY(name, value) { #name, value },\n#define SCALE 1000\n")
+        for n in range(count):
+            if n % 100 == 0:
+                oh.write("/* Table %d, which has a comment\n   spanning several lines */\n#if 0\nstatic int unused%d;\n#endif\n" % (n // 100, n))
+            oh.write("ENTRY(item%d, %d * SCALE) \\\n    ENTRY(other%d, \"value %d\")\n" % (n, n, n, n))
+
+class Sink(object):
+    # Counts what is written to it, without keeping it
+    def __init__(self):
+        self.size = 0
+    def write(self, text):
+        self.size += len(text)
+
+class CmdRun(CmdPreprocessor):
+    # The command line, reading its input whole unless streaming
+    stream = True
+    def parse(self, input, source = None, ignore = {}):
+        if not self.stream:
+            self.stream_block_size = os.path.getsize(input.name) + 1
+        return super(CmdRun, self).parse(input, source, ignore)
+
+def run_cmd(path, stream):
+    output = path + '.i'
+    CmdRun.stream = stream
+    tracemalloc.start()
+    start = clock()
+    p = CmdRun(['pcpp', '--line-directive', '-o', output, path])
+    elapsed = clock() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert p.return_code == 0
+    size = os.path.getsize(output)
+    os.remove(output)
+    return size, elapsed, peak / 1048576.0
+
+def run(path, stream):
+    p = Preprocessor()
+    p.line_directive = None
+    p.lexed_file_cache = None
+    if not stream:
+        p.stream_block_size = os.path.getsize(path) + 1
+    p.add_path(os.path.dirname(path))
+    tracemalloc.start()
+    start = clock()
+    p.parse('#include "%s"\n' % os.path.basename(path))
+    oh = Sink()
+    p.write(oh)
+    elapsed = clock() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert p.return_code == 0
+    return oh.size, elapsed, peak / 1048576.0
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [20000, 60000]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'generated.c')
+        for count in counts:
+            generated_source(path, count)
+            for how, runner in (('#included', run), ('pcpp input', run_cmd)):
+                sizes = []
+                for stream in (False, True):
+                    size, elapsed, peak = runner(path, stream)
+                    sizes.append(size)
+                    print("%7d entries, %6.1f Mb, %-10s streaming %-5s %7.3f secs, %7.1f Mb peak" % (count, os.path.getsize(path) / 1048576.0, how, stream, elapsed, peak))
+                assert sizes[0] == sizes[1]
+    finally:
+        os.remove(path)
+        os.rmdir(tmpdir)
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+# Benchmarks the memory used per token, and the cost of copying a token, for
+# pcpp's Token class versus the PLY LexToken pcpp used to use, over the mcpp
+# test corpus in tests/test-c.
+
+import sys, os, glob, time, copy, tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcpp.parser import default_lexer
+
+clock = time.process_time
+REPEATS = 5
+
+def load_corpus():
+    corpus = []
+    here = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(here, '..', 'tests', 'test-c', '*.[ch]'))):
+        with open(path, 'rt', encoding = 'latin-1') as ih:
+            corpus.append("\n".join([x.rstrip() for x in ih.read().splitlines()]))
+    return corpus
+
+def lex_all(engine, corpus):
+    # PLY tokens get the same extra attributes which the preprocessor used to give them
+    lex = default_lexer(engine)
+    tokens = []
+    for data in corpus:
+        lex.input(data)
+        for tok in lex:
+            tok.source = 'somefile.h'
+            if engine == 'ply':
+                tok.expanded_from = []
+            tokens.append(tok)
+    return tokens
+
+if __name__ == "__main__":
+    corpus = load_corpus()
+    for engine, name in (('ply', 'PLY LexToken'), ('fast', 'pcpp Token')):
+        tracemalloc.start()
+        tokens = lex_all(engine, corpus)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("%-13s %d tokens and their values use %d bytes = %.1f bytes per token" % (name, len(tokens), size, size / len(tokens)))
+        copier = copy.copy if engine == 'ply' else type(tokens[0]).clone
+        best = None
+        for n in range(REPEATS):
+            start = clock()
+            copies = [copier(tok) for tok in tokens]
+            elapsed = clock() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("%-13s copied with %s in %.3f secs = %.0f copies/sec" % ('', 'copy.copy()' if engine == 'ply' else 'clone()', best, len(tokens) / best))
+        del tokens, copies
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+# Benchmarks treating #pragma once files identical to one already seen as
+# the same file, on a source file including the same twenty headers as
+# vendored into many directories of a source tree, much as third party
+# libraries are copied about a monorepo. Compares runs where every copy is
+# processed against runs with include_once_by_content set, each with a new
+# Preprocessor.
+
+import sys, os, time, tempfile, shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+def write_headers(tmpdir, count, headers):
+    lines = []
+    for n in range(count):
+        os.mkdir(os.path.join(tmpdir, 'vendored%d' % n))
+        for m in range(headers):
+            with open(os.path.join(tmpdir, 'vendored%d' % n, 'third_party%d.h' % m), 'wt') as oh:
+                oh.write('#pragma once\n')
+                for l in range(100):
+                    oh.write('extern int third_party%d_%d(const char *s, unsigned long n);\n' % (m, l))
+            lines.append('#include "vendored%d/third_party%d.h"\n' % (n, m))
+    return ''.join(lines)
+
+def run(tmpdir, source, by_content):
+    p = Preprocessor()
+    p.include_once_by_content = by_content
+    p.add_path(tmpdir)
+    p.parse(source)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue(), p.stats
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [5, 20]
+    for count in counts:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            source = write_headers(tmpdir, count, 20)
+            for name, by_content in (('off', False), ('on', True)):
+                start = clock()
+                output, stats = run(tmpdir, source, by_content)
+                elapsed = clock() - start
+                print("%3d vendored copies, include once by content %-3s %7.3f secs, %5d copies skipped" % (count, name, elapsed, stats['include_once_aliases_skipped']))
+        finally:
+            shutil.rmtree(tmpdir)
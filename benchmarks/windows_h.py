@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# Benchmarks object like macro expansion on a synthetic header shaped like the
+# Windows SDK headers, where nearly every declaration is wrapped in the same
+# handful of object like macros (WINBASEAPI, WINAPI, SAL annotations) which
+# themselves expand to further object like macros. Compares runs with and
+# without the object like macro expansion cache.
+
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io import StringIO
+from pcpp import Preprocessor
+
+clock = time.process_time
+
+prologue = r"""#define WINVER 0x0A00
+#define _WIN32_WINNT WINVER
+#define NTDDI_VERSION 0x0A000000
+#define DECLSPEC_IMPORT __declspec(dllimport)
+#define WINBASEAPI DECLSPEC_IMPORT
+#define WINUSERAPI DECLSPEC_IMPORT
+#define EXTERN_C extern "C"
+#define STDAPI EXTERN_C HRESULT STDAPICALLTYPE
+#define STDAPICALLTYPE __stdcall
+#define WINAPI __stdcall
+#define APIENTRY WINAPI
+#define NULL ((void *)0)
+#define CONST const
+#define VOID void
+#define FAR
+#define NEAR
+#define _In_ _SAL2_Source_(_In_, (), _Pre1_impl_(__notnull_impl_notref) _Deref_pre_readonly_)
+#define _In_opt_ _SAL2_Source_(_In_opt_, (), _Pre_opt_valid_ _Deref_pre_readonly_)
+#define _Out_ _SAL2_Source_(_Out_, (), _Out_impl_)
+#define _Out_opt_ _SAL2_Source_(_Out_opt_, (), _Out_opt_impl_)
+#define _Inout_ _SAL2_Source_(_Inout_, (), _Prepost_valid_)
+#define _Success_(expr)
+#define _SAL2_Source_(Name, args, annotes) annotes
+#define _Pre1_impl_(p1)
+#define _Deref_pre_readonly_
+#define _Pre_opt_valid_
+#define _Out_impl_
+#define _Out_opt_impl_
+#define _Prepost_valid_
+#define __notnull_impl_notref
+#define LPVOID VOID FAR *
+#define LPCVOID CONST VOID FAR *
+#define HANDLE LPVOID
+#define BOOL int
+#define DWORD unsigned long
+#define INVALID_HANDLE_VALUE ((HANDLE)(long)-1)
+"""
+
+def windows_h(count):
+    lines = [prologue]
+    for n in range(count):
+        lines.append("#define ERROR_CODE_%d %dL" % (n, n))
+        lines.append("#if _WIN32_WINNT >= 0x0600")
+        lines.append("WINBASEAPI BOOL WINAPI Function%d(_In_ HANDLE hObject, _In_opt_ LPCVOID lpBuffer, _Out_ DWORD FAR *lpResult, _Inout_ LPVOID lpContext);" % n)
+        lines.append("STDAPI Interface%d(_Out_opt_ LPVOID *ppv, _In_ HANDLE h = INVALID_HANDLE_VALUE, _In_opt_ LPVOID p = NULL);" % n)
+        lines.append("#endif")
+        lines.append("static CONST DWORD value%d = ERROR_CODE_%d;" % (n, n))
+    return "\n".join(lines) + "\n"
+
+def run(input, cache):
+    p = Preprocessor()
+    p.cache_object_macros = cache
+    p.parse(input)
+    oh = StringIO()
+    p.write(oh)
+    assert p.return_code == 0
+    return oh.getvalue(), p.stats
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [1000, 5000]
+    for count in counts:
+        input = windows_h(count)
+        outputs = []
+        for cache in (False, True):
+            start = clock()
+            output, stats = run(input, cache)
+            elapsed = clock() - start
+            outputs.append(output)
+            print("%6d declarations, cache %-5s %7.3f secs, %7d hits %6d misses" % (count, cache, elapsed, stats['object_macro_cache_hits'], stats['object_macro_cache_misses']))
+        assert outputs[0] == outputs[1]
@@ -6,7 +6,7 @@
 import sys, os, re, codecs, copy
 if __name__ == '__main__' and __package__ is None:
     sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
-from pcpp.parser import STRING_TYPES, yacc, default_lexer, in_production
+from pcpp.parser import STRING_TYPES, yacc, default_lexer, in_production, as_token
 
 # The width of signed integer which this evaluator will use
 INTMAXBITS = 64
@@ -726,7 +726,7 @@ class Evaluator(object):
                 tok = self.lexer.token()
                 if not tok:
                     break
-                input.append(tok)
+                input.append(as_token(tok))
         return self.parser.parse(input, lexer = self.__lexer(functions, identifiers))
 
 
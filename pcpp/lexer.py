@@ -0,0 +1,878 @@
+#!/usr/bin/python
+# Python C99 conforming preprocessor hand written lexer
+# (C) 2026 Niall Douglas http://www.nedproductions.biz/
+# Started: Oct 2026
+#
+# A drop in replacement for the PLY lexer generated from the token
+# definitions in parser.py. It produces exactly the same token stream
+# for the default CPP_* token set, but scans a whole buffer with a single
+# master regular expression and classifies each match by table lookup
+# rather than by calling a Python rule function per token.
+
+import re, os, sys, collections, functools, threading, struct, hashlib, tempfile
+from array import array
+
+# -----------------------------------------------------------------------------
+# Token classification tables
+#
+# The punctuators are listed in the same order in which PLY tries them (which
+# is by decreasing length of their regular expression), so the same input
+# produces the same tokens. Note that PLY always lexes '^=' as '^' followed by
+# '=', as the pattern for '^' is tried first.
+# -----------------------------------------------------------------------------
+
+_punctuators = (
+    ('##', 'CPP_DPOUND'), ('||', 'CPP_LOGICALOR'), ('++', 'CPP_PLUSPLUS'), ('|=', 'CPP_OREQUAL'),
+    ('*=', 'CPP_MULTIPLYEQUAL'), ('+=', 'CPP_PLUSEQUAL'), ('<<=', 'CPP_LSHIFTEQUAL'), ('>>=', 'CPP_RSHIFTEQUAL'),
+    ('#', 'CPP_POUND'), ('+', 'CPP_PLUS'), ('*', 'CPP_STAR'), ('|', 'CPP_BAR'), ('^', 'CPP_HAT'),
+    ('?', 'CPP_QUESTION'), ('(', 'CPP_LPAREN'), (')', 'CPP_RPAREN'), ('[', 'CPP_LBRACKET'), (']', 'CPP_RBRACKET'),
+    ('.', 'CPP_DOT'), ('\\', 'CPP_BSLASH'), ('->', 'CPP_DEREFERENCE'), ('-=', 'CPP_MINUSEQUAL'),
+    ('--', 'CPP_MINUSMINUS'), ('<<', 'CPP_LSHIFT'), ('<=', 'CPP_LESSEQUAL'), ('>>', 'CPP_RSHIFT'),
+    ('>=', 'CPP_GREATEREQUAL'), ('&&', 'CPP_LOGICALAND'), ('&=', 'CPP_ANDEQUAL'), ('==', 'CPP_EQUALITY'),
+    ('!=', 'CPP_INEQUALITY'), ('/=', 'CPP_DIVIDEEQUAL'), ('%=', 'CPP_PERCENTEQUAL'), ('-', 'CPP_MINUS'),
+    ('/', 'CPP_FSLASH'), ('%', 'CPP_PERCENT'), ('&', 'CPP_AMPERSAND'), ('~', 'CPP_TILDE'), ('<', 'CPP_LESS'),
+    ('>', 'CPP_GREATER'), ('=', 'CPP_EQUAL'), ('!', 'CPP_EXCLAMATION'), ('{', 'CPP_LCURLY'), ('}', 'CPP_RCURLY'),
+    (',', 'CPP_COMMA'), (';', 'CPP_SEMICOLON'), (':', 'CPP_COLON'), ("'", 'CPP_SQUOTE'), ('"', 'CPP_DQUOTE')
+)
+_punctuator_types = dict(_punctuators)
+
+# The master regular expression. Each alternative is a single named group without
+# any inner capturing groups so the matching rule is simply m.lastgroup. Anything
+# not matched by a rule becomes a single character token whose type is that
+# character, just as t_error() in parser.py does.
+_master_pat = re.compile('|'.join([
+    r'(?P<CPP_WS>[ \t]+|\n)',
+    r'(?P<CPP_LINECONT>\\[ \t]*\n)',
+    r"(?P<PP_NUMBER>\.?\d(?:\.|[\w_]|'[\w_]|[eEpP][-+])*)",
+    r'(?P<CPP_STRING>"(?:[^"\\\n]|\\[\s\S])*")',
+    r"(?P<CPP_CHAR>(?:u8|u|U|L)?'(?:[^'\\\n]|\\[\s\S])*')",
+    r'(?P<CPP_COMMENT1>/\*[\s\S]*?\*/)',
+    r'(?P<CPP_COMMENT2>//[^\n]*)',
+    r'(?P<CPP_ID>[A-Za-z_][\w_]*)',
+    '(?P<PUNCT>' + '|'.join([re.escape(p) for p, _ in _punctuators]) + ')',
+    r'(?P<ERROR>[\s\S])'
+]))
+_string_literal_linecont_pat = re.compile(r'\\[ \t]*\n')
+
+# ------------------------------------------------------------------
+# HideSet object
+#
+# The set of names of the macros a token was expanded from, which may not be
+# expanded again when the token is rescanned. Each hide-set is an immutable
+# frame which adds one name to its parent frame, so adding a name is O(1) and
+# the hide-sets of nested expansions share their common parts. Every eighth
+# frame up the chain is a checkpoint, which caches the names of all the frames
+# above it in a frozenset when first needed, so membership needs at most eight
+# frames to be walked before a set lookup.
+# ------------------------------------------------------------------
+
+class HideSet(object):
+    """An immutable set of macro names.
+
+    >>> a = empty_hideset.add('A')
+    >>> b = a.add('B')
+    >>> ('A' in b, 'B' in b, 'B' in a, 'A' in empty_hideset)
+    (True, True, False, False)
+    >>> sorted(b)
+    ['A', 'B']
+    >>> c = b
+    >>> for n in range(20): c = c.add('C%d' % n)
+    >>> ('A' in c, 'C0' in c, 'C19' in c, 'C20' in c, len(c))
+    (True, True, True, False, 22)
+    """
+    __slots__ = ('name', 'parent', 'depth', '__members')
+
+    def __init__(self, name = None, parent = None):
+        self.name = name
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.__members = None if parent is not None else frozenset()
+
+    def add(self, name):
+        """Returns a hide-set with name added"""
+        if name == self.name:
+            return self
+        return HideSet(name, self)
+
+    def __checkpoint_members(self):
+        # Only ever called on a checkpoint frame. Builds any uncached checkpoints
+        # above this one from the top down, so this never recurses.
+        checkpoints = []
+        hs = self
+        while hs.__members is None:
+            checkpoints.append(hs)
+            for n in range(8):
+                hs = hs.parent
+        members = hs.__members
+        for hs in reversed(checkpoints):
+            names = []
+            frame = hs
+            for n in range(8):
+                names.append(frame.name)
+                frame = frame.parent
+            members = hs.__members = members.union(names)
+        return members
+
+    def __members_set(self):
+        names = []
+        hs = self
+        while hs.depth & 7:
+            names.append(hs.name)
+            hs = hs.parent
+        return hs.__checkpoint_members().union(names)
+
+    def __contains__(self, name):
+        hs = self
+        while hs.depth & 7:
+            if hs.name == name:
+                return True
+            hs = hs.parent
+        members = hs.__members
+        if members is None:
+            members = hs.__checkpoint_members()
+        return name in members
+
+    def __iter__(self):
+        return iter(self.__members_set())
+
+    def __len__(self):
+        return len(self.__members_set())
+
+    def __repr__(self):
+        return "HideSet(%s)" % ', '.join(sorted(self.__members_set()))
+
+# The hide-set of a token which has not come from any macro expansion
+empty_hideset = HideSet()
+
+# ------------------------------------------------------------------
+# Token object
+#
+# Every token pcpp works with is one of these. It has fixed slots rather
+# than a per instance __dict__, as a large translation unit can have
+# millions of them alive at once.
+# ------------------------------------------------------------------
+
+class Token(object):
+    """A preprocessor token, with the same attributes as the tokens returned by PLY
+    plus the source file it came from and its HideSet.
+
+    >>> tok = Token('CPP_ID', 'FOO', 5, 10, 'foo.h')
+    >>> tok2 = tok.clone()
+    >>> tok2.value = 'BAR'
+    >>> (tok.value, tok2.value, tok2.source)
+    ('FOO', 'BAR', 'foo.h')
+    """
+    __slots__ = ('type', 'value', 'lineno', 'lexpos', 'source', 'hideset')
+    # PLY's yacc sets a lexer attribute on the token it reports a syntax error for,
+    # unless it already has one. Nothing in pcpp uses it, so a class attribute does.
+    lexer = None
+
+    def __init__(self, type, value, lineno, lexpos, source = None, hideset = empty_hideset):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+        self.source = source
+        self.hideset = hideset
+
+    def clone(self):
+        """Returns a shallow copy of this token, much more cheaply than copy.copy() can"""
+        return Token(self.type, self.value, self.lineno, self.lexpos, self.source, self.hideset)
+
+    def __str__(self):
+        return "LexToken(%s,%r,%d,%d)" % (self.type, self.value, self.lineno, self.lexpos)
+    def __repr__(self):
+        return str(self)
+
+def as_token(tok):
+    """Returns tok if it is a Token, else a Token made from a token returned by some
+    other lexer such as PLY"""
+    if type(tok) is Token:
+        return tok
+    return Token(tok.type, tok.value, tok.lineno, tok.lexpos, getattr(tok, 'source', None), getattr(tok, 'hideset', empty_hideset))
+
+# ------------------------------------------------------------------
+# FastLexer object
+#
+# Implements the subset of the PLY lexer interface which pcpp uses:
+# input(), token(), clone(), iteration, and the lineno and lexpos
+# attributes.
+# ------------------------------------------------------------------
+
+class FastLexer(object):
+    """A lexer for the default preprocessor token set which needs no PLY tables.
+
+    >>> lex = FastLexer()
+    >>> lex.input('#define FOO(x) L"a\\\\\\nb" 0x1F /* c */\\n')
+    >>> [(tok.type, tok.value, tok.lineno) for tok in lex]  # doctest: +NORMALIZE_WHITESPACE
+    [('CPP_POUND', '#', 1), ('CPP_ID', 'define', 1), ('CPP_WS', ' ', 1), ('CPP_ID', 'FOO', 1),
+     ('CPP_LPAREN', '(', 1), ('CPP_ID', 'x', 1), ('CPP_RPAREN', ')', 1), ('CPP_WS', ' ', 1),
+     ('CPP_ID', 'L', 1), ('CPP_STRING', '"ab"', 1), ('CPP_WS', ' ', 2), ('PP_NUMBER', '0x1F', 2),
+     ('CPP_WS', ' ', 2), ('CPP_COMMENT1', '/* c */', 2), ('CPP_WS', '\\n', 2)]
+    >>> lex.input("a ^= $")
+    >>> [(tok.type, tok.value) for tok in lex]
+    [('CPP_ID', 'a'), ('CPP_WS', ' '), ('CPP_HAT', '^'), ('CPP_EQUAL', '='), ('CPP_WS', ' '), ('$', '$')]
+    """
+    def __init__(self):
+        self.lexdata = ''
+        self.lexpos = 0
+        self.lineno = 1
+
+    def clone(self):
+        """Returns a new lexer in the same state. As there are no tables to share, this is cheap."""
+        c = FastLexer()
+        c.lexdata = self.lexdata
+        c.lexpos = self.lexpos
+        c.lineno = self.lineno
+        return c
+
+    def input(self, data):
+        """Sets the text to be lexed, starting from its beginning"""
+        self.lexdata = data
+        self.lexpos = 0
+
+    def token(self):
+        """Returns the next token, or None if the end of the input has been reached"""
+        m = _master_pat.match(self.lexdata, self.lexpos)
+        if m is None:
+            return None
+        tok = self.__make_token(m, self.lineno)
+        self.lexpos = m.end()
+        self.lineno = tok.lineno + self.__newlines(tok, m)
+        return tok
+
+    def __iter__(self):
+        """Lexes all remaining input in a single pass. The lexer's lineno and lexpos are
+        advanced to the end of the input when iteration has finished."""
+        lineno = self.lineno
+        token = Token
+        punctuator_types = _punctuator_types
+        linecont_sub = _string_literal_linecont_pat.subn
+        for m in _master_pat.finditer(self.lexdata, self.lexpos):
+            type = m.lastgroup
+            value = m.group()
+            start_lineno = lineno
+            if type == 'CPP_ID':
+                pass
+            elif type == 'PUNCT':
+                type = punctuator_types[value]
+            elif type == 'CPP_WS':
+                if value == '\n':
+                    lineno += 1
+            elif type == 'ERROR':
+                type = value
+            elif type == 'CPP_LINECONT':
+                value = value[1:-1]
+                lineno += 1
+            elif type == 'CPP_STRING':
+                value, subs_made = linecont_sub('', value)
+                lineno += subs_made + value.count('\n')
+            elif type == 'CPP_CHAR' or type == 'CPP_COMMENT1':
+                lineno += value.count('\n')
+            yield token(type, value, start_lineno, m.start())
+        self.lexpos = len(self.lexdata)
+        self.lineno = lineno
+
+    @staticmethod
+    def __make_token(m, lineno):
+        type = m.lastgroup
+        value = m.group()
+        if type == 'PUNCT':
+            type = _punctuator_types[value]
+        elif type == 'ERROR':
+            type = value
+        elif type == 'CPP_LINECONT':
+            value = value[1:-1]
+        elif type == 'CPP_STRING':
+            value = _string_literal_linecont_pat.sub('', value)
+        return Token(type, value, lineno, m.start())
+
+    @staticmethod
+    def __newlines(tok, m):
+        # How many lines the token matched by m spans
+        if tok.type == 'CPP_WS':
+            return 1 if tok.value == '\n' else 0
+        elif tok.type == 'CPP_LINECONT':
+            return 1
+        elif tok.type in ('CPP_STRING', 'CPP_CHAR', 'CPP_COMMENT1'):
+            return m.group().count('\n')
+        return 0
+
+# ------------------------------------------------------------------
+# ConditionalIndex object
+#
+# Finds where the lines of a disabled group end without lexing them, and
+# remembers it for the next time the same file is included. Only lines
+# which contain a quote, a backslash or a comment, or which start with '#',
+# need looking at individually; the lines in between are merely counted.
+# Lines which are more awkward still, like a directive preceded by a
+# comment, are treated as if they might be a conditional directive, so the
+# preprocessor always gets to see them.
+# ------------------------------------------------------------------
+
+# Matches the start of a line which is not plain text
+_interesting_line_pat = re.compile(r'''^(?:[ \t]*#|(?:[^\n"'\\/]|/(?![/*]))*(?:["'\\]|/[/*]))''', re.M)
+# Matches the start of a line which could be a directive
+_directive_pat = re.compile(r'[ \t]*(?:#[ \t]*([A-Za-z_][\w_]*)?|/\*|\\)')
+# Matches a logical line up to its newline, splitting it where the master regular
+# expression would wherever that affects where the line ends
+_logical_line_pat = re.compile('(?:' + '|'.join([
+    r'''[^\n"'\\/\w.]+''',
+    r'\\[ \t]*\n',
+    r"\.?\d(?:\.|[\w_]|'[\w_]|[eEpP][-+])*",
+    r'"(?:[^"\\\n]|\\[\s\S])*"',
+    r"(?:u8|u|U|L)?'(?:[^'\\\n]|\\[\s\S])*'",
+    r'/\*[\s\S]*?\*/',
+    r'//[^\n]*',
+    r'[A-Za-z_][\w_]*',
+    r'[^\n]'
+]) + ')*')
+_conditional_kinds = {'if': 'open', 'ifdef': 'open', 'ifndef': 'open', 'elif': 'else', 'else': 'else', 'endif': 'endif'}
+
+class ConditionalIndex(object):
+    """Where the disabled groups in some text end.
+
+    >>> index = ConditionalIndex('#if A\\nint a; // a\\n#define B\\n#ifdef C\\n#else\\n#endif\\n#else\\nint b;\\n#endif\\n')
+    >>> index.skip(6, 2)
+    (50, 7, 1, 1, [('CPP_COMMENT2', '// a', 2, 13, True)])
+    >>> index.skip(56, 8)
+    (63, 9, 1, 0, [])
+    >>> index.skip(56, 8) is index.skip(56, 8)
+    True
+    """
+    def __init__(self, text):
+        self.text = text
+        self.__skips = {}        # offset of the end of a line => what skip() returns for it
+
+    def skip(self, pos, lineno):
+        """Given pos, the offset of the end of a line which began a disabled group, and
+        lineno, the number of the line after it, returns (offset, lineno, lines, commented,
+        comments) for the next line which could be a conditional directive ending that
+        group, skipping over any nested groups. lines is how many lines of text there
+        are until then, commented how many of those end with a line comment, and
+        comments is each (type, value, lineno, lexpos, counted) comment until then,
+        where counted is true for those line comments."""
+        skipped = self.__skips.get(pos)
+        if skipped is None:
+            skipped = self.__skips[pos] = self.__scan(pos, lineno)
+        return skipped
+
+    def __scan(self, pos, lineno):
+        text = self.text
+        n = len(text)
+        lines = 0
+        comments = []
+        depth = 0
+        outer = None             # where the outermost nested group started
+        while True:
+            m = _interesting_line_pat.search(text, pos) if pos < n else None
+            if m is None:
+                if pos < n:
+                    plain = text.count('\n', pos, n)
+                    lines += plain + (text[-1] != '\n')
+                    lineno += plain
+                stop = (n, lineno, lines, len(comments))
+                break
+            start = m.start()
+            plain = text.count('\n', pos, start)
+            lines += plain
+            lineno += plain
+            kind = None
+            m = _directive_pat.match(text, start)
+            if m is not None:
+                name = m.group(1)
+                kind = _conditional_kinds.get(name, 'directive') if name else '?'
+            if depth == 0 and (kind == 'else' or kind == 'endif'):
+                stop = (start, lineno, lines, len(comments))
+                break
+            # Find the end of the logical line, and any comments in it
+            end = _logical_line_pat.match(text, start).end()
+            if end < n:
+                end += 1
+            first_comment = len(comments)
+            if kind == '?' or text.find('/*', start, end) >= 0 or text.find('//', start, end) >= 0:
+                first = None
+                unclosed = False
+                for m in _master_pat.finditer(text, start, end):
+                    type = m.lastgroup
+                    if type == 'CPP_COMMENT1' or type == 'CPP_COMMENT2':
+                        at = m.start()
+                        comments.append((type, m.group(), lineno + text.count('\n', start, at), at, False))
+                    elif first is None and type != 'CPP_WS' and type != 'CPP_LINECONT':
+                        first = m.group()
+                    if m.group() == '/' and text.startswith('*', m.end()):
+                        # A block comment not closed in this text, which may be only
+                        # part of a file, so leave it to the preprocessor
+                        unclosed = True
+                # Something starting with a comment or a line continuation is only a
+                # directive if the first thing after them is a '#'
+                if kind == '?' and first != '#':
+                    kind = None
+                if unclosed:
+                    kind = '?'
+            if kind == '?':
+                stop = (start, lineno, lines, first_comment) if depth == 0 else outer
+                break
+            elif kind is None:
+                lines += 1
+                if len(comments) > first_comment and comments[-1][0] == 'CPP_COMMENT2':
+                    # Which becomes a newline if the comment is removed
+                    comments[-1] = comments[-1][:4] + (True,)
+            elif kind == 'open':
+                if depth == 0:
+                    outer = (start, lineno, lines, first_comment)
+                depth += 1
+            elif kind == 'endif':
+                depth -= 1
+            lineno += text.count('\n', start, end)
+            pos = end
+        if depth > 0:
+            # A nested group isn't ended, so let the preprocessor report it
+            stop = outer
+        offset, lineno, lines, last = stop
+        comments = comments[:last]
+        return offset, lineno, lines, sum([comment[4] for comment in comments]), comments
+
+
+# ------------------------------------------------------------------
+# minimised_source()
+#
+# The directives of some text without the rest, for when only the macros
+# it defines and the files it includes are of interest, as clang-scan-deps
+# does. Every other line within a conditional group is left empty, so that
+# the directives keep their line numbers and lexing what is left costs
+# little more than lexing the directives. Lines outside any group are kept,
+# as they decide whether the text is wholly wrapped in an include guard.
+# ------------------------------------------------------------------
+
+def minimised_source(text):
+    """Returns text with every line within a conditional group which isn't a directive
+    left empty.
+
+    >>> minimised_source('a\\n#if A\\nint a = A; /* b\\n#define C */\\n/* d */ # include "e.h" // f\\n#endif\\ng')
+    'a\\n#if A\\n\\n\\n/* d */ # include "e.h" // f\\n#endif\\ng'
+    """
+    n = len(text)
+    pos = 0
+    depth = 0
+    out = []
+    while pos < n:
+        m = _interesting_line_pat.search(text, pos)
+        start = m.start() if m is not None else n
+        out.append(text[pos:start] if depth == 0 else '\n' * text.count('\n', pos, start))
+        if m is None:
+            break
+        end = _logical_line_pat.match(text, start).end()
+        name = None
+        m = _directive_pat.match(text, start)
+        if m is not None:
+            if '#' in m.group():
+                name = m.group(1) or ''
+            else:
+                # Something starting with a comment or a line continuation is only a
+                # directive if the first thing after them is a '#'
+                for m in _master_pat.finditer(text, start, end):
+                    if m.lastgroup not in ('CPP_WS', 'CPP_LINECONT', 'CPP_COMMENT1', 'CPP_COMMENT2'):
+                        if name is not None:
+                            name = m.group() if m.lastgroup == 'CPP_ID' else ''
+                            break
+                        elif m.group() != '#':
+                            break
+                        name = ''
+        if name is not None or depth == 0:
+            out.append(text[start:end])
+        else:
+            out.append('\n' * text.count('\n', start, end))
+        kind = _conditional_kinds.get(name)
+        if kind == 'open':
+            depth += 1
+        elif kind == 'endif' and depth > 0:
+            depth -= 1
+        if end < n:
+            out.append('\n')
+            end += 1
+        pos = end
+    return ''.join(out)
+
+
+# ------------------------------------------------------------------
+# LexedFile object
+#
+# The lines of a file lexed by FastLexer, kept so that the next time the
+# file is included, by this or any other preprocessor, it need not be read
+# or lexed again. Lines are lexed a batch at a time as they are first
+# needed, so those in disabled groups which are skipped over need never be.
+# The tokens kept are never handed out, only copies of them.
+#
+# A LexedFile can also be saved in a compact binary format, which is a
+# table of the distinct token values plus parallel arrays of the token
+# types, values, line numbers and offsets. One loaded back makes the
+# tokens of each line straight from those arrays as it is reached.
+# ------------------------------------------------------------------
+
+# Roughly how many bytes a token kept by a LexedFile takes up
+_lexed_token_size = 160
+# What a LexedFile saved by to_bytes() starts with
+_lexed_file_magic = b'PCPPLEX1'
+# Followed by the sizes of its text, type names and values, then how many values, tokens and lines it has
+_lexed_file_header = '<8s6I'
+
+class LexedFile(object):
+    """The lines of some text, lexed as they are needed.
+
+    >>> lexed = LexedFile('a b\\n/* c\\n*/ d')
+    >>> tokens, pos, lineno = lexed.line(0, 1)
+    >>> [tok.value for tok in tokens], pos, lineno
+    (['a', ' ', 'b', '\\n'], 4, 2)
+    >>> tokens, pos, lineno = lexed.line(4, 2)
+    >>> [(tok.value, tok.lineno) for tok in tokens], pos, lineno
+    ([('/* c\\n*/', 2), (' ', 3), ('d', 3), ('\\n', 3)], 13, 4)
+    >>> lexed.line(13, 4) is None
+    True
+    """
+    batch = 64                   # how many lines to lex at a time
+
+    def __init__(self, text):
+        self.text = text
+        self.index = ConditionalIndex(text)
+        self.size = len(text)    # roughly how many bytes this takes up
+        self.on_grow = None      # called with how many bytes size grew by whenever lines are lexed
+        self.__lines = {}        # offset of the start of a line => what line() returns for it
+        self.__stored = None     # the arrays of a file loaded by from_bytes()
+        self.__lock = threading.Lock()  # held while lexing, as a file may be shared between threads
+
+    def line(self, pos, lineno):
+        """Given pos, the offset of the start of a line, and lineno, its line number, returns
+        (tokens, pos, lineno) for the tuple of its tokens, ending in a newline, and the
+        offset and number of the line after it, or None if pos is the end of the text."""
+        line = self.__lines.get(pos)
+        if line is None and pos < len(self.text):
+            if self.__stored is not None and pos in self.__stored[-1]:
+                tokens, next_pos, next_lineno = self.__stored_line(pos, None)
+                return tuple(tokens), next_pos, next_lineno
+            with self.__lock:
+                # Another thread may have lexed it while this one waited
+                line = self.__lines.get(pos)
+                if line is None:
+                    size = self.size
+                    self.__lex(pos, lineno)
+                    line = self.__lines[pos]
+                    if self.on_grow is not None:
+                        self.on_grow(self.size - size)
+        return line
+
+    def copy_line(self, pos, lineno, source):
+        """As line(), but returns a list of new tokens from source, which can be modified."""
+        if self.__stored is not None and pos in self.__stored[-1]:
+            return self.__stored_line(pos, source)
+        line = self.line(pos, lineno)
+        if line is None:
+            return None
+        tokens, pos, lineno = line
+        return [Token(tok.type, tok.value, tok.lineno, tok.lexpos, source) for tok in tokens], pos, lineno
+
+    def __stored_line(self, pos, source):
+        types, values, linenos, lexposs, line_starts, first_tokens, lines = self.__stored
+        n = lines[pos]
+        start, end = first_tokens[n], first_tokens[n + 1]
+        tokens = list(map(Token, types[start:end], values[start:end], linenos[start:end], lexposs[start:end], [source] * (end - start)))
+        next_pos = line_starts[n + 1] if n + 1 < len(line_starts) else len(self.text)
+        return tokens, next_pos, linenos[end - 1] + 1
+
+    def to_bytes(self):
+        """Returns all of the text lexed, in the binary format which from_bytes() reads.
+
+        >>> lexed = LexedFile.from_bytes(LexedFile('#define A "a"\\nA /* b\\n*/ A').to_bytes())
+        >>> [(tok.type, tok.value, tok.lineno, tok.lexpos) for tok in lexed.copy_line(14, 2, 'a.h')[0]]  # doctest: +NORMALIZE_WHITESPACE
+        [('CPP_ID', 'A', 2, 14), ('CPP_WS', ' ', 2, 15), ('CPP_COMMENT1', '/* b\\n*/', 2, 16),
+         ('CPP_WS', ' ', 3, 23), ('CPP_ID', 'A', 3, 24), ('CPP_WS', '\\n', 3, 24)]
+        >>> lexed.copy_line(0, 1, 'a.h')[1:], lexed.copy_line(14, 2, 'a.h')[1:], lexed.line(25, 4)
+        ((14, 2), (25, 4), None)
+        """
+        tokens, line_starts, first_tokens = [], array('I'), array('I')
+        pos, lineno = 0, 1
+        while True:
+            line = self.line(pos, lineno)
+            if line is None:
+                break
+            line_starts.append(pos)
+            first_tokens.append(len(tokens))
+            tokens.extend(line[0])
+            pos, lineno = line[1], line[2]
+        first_tokens.append(len(tokens))
+        # Number each distinct type and value in the order first seen
+        name_ids, string_ids = {}, {}
+        type_ids = array('I', [name_ids.setdefault(tok.type, len(name_ids)) for tok in tokens])
+        value_ids = array('I', [string_ids.setdefault(tok.value, len(string_ids)) for tok in tokens])
+        names, strings = list(name_ids), list(string_ids)
+        linenos = array('I', [tok.lineno for tok in tokens])
+        lexposs = array('I', [tok.lexpos for tok in tokens])
+        lengths = array('I', [len(x) for x in strings])
+        blobs = [self.text, '\n'.join(names), ''.join(strings)]
+        blobs = [x.encode('utf-8', 'surrogatepass') for x in blobs]
+        arrays = [lengths, type_ids, value_ids, linenos, lexposs, line_starts, first_tokens]
+        if sys.byteorder != 'little':
+            for x in arrays:
+                x.byteswap()
+        header = struct.pack(_lexed_file_header, _lexed_file_magic, *([len(x) for x in blobs] + [len(lengths), len(type_ids), len(line_starts)]))
+        return b''.join([header] + blobs + [x.tobytes() for x in arrays])
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Returns the LexedFile saved by to_bytes() as data, raising ValueError if data
+        is not in that format."""
+        size = struct.calcsize(_lexed_file_header)
+        try:
+            magic, text_size, names_size, strings_size, string_count, token_count, line_count = struct.unpack_from(_lexed_file_header, data)
+        except struct.error:
+            raise ValueError("Not a saved LexedFile")
+        counts = [string_count] + [token_count] * 4 + [line_count, line_count + 1]
+        if magic != _lexed_file_magic or len(data) != size + text_size + names_size + strings_size + 4 * sum(counts):
+            raise ValueError("Not a saved LexedFile")
+        blobs = []
+        for blob_size in (text_size, names_size, strings_size):
+            blobs.append(data[size:size + blob_size].decode('utf-8', 'surrogatepass'))
+            size += blob_size
+        arrays = []
+        for count in counts:
+            x = array('I')
+            if x.itemsize != 4:
+                raise ValueError("Unsupported platform")
+            x.frombytes(data[size:size + 4 * count])
+            if sys.byteorder != 'little':
+                x.byteswap()
+            arrays.append(x)
+            size += 4 * count
+        text, names, strings = blobs
+        lengths, type_ids, value_ids, linenos, lexposs, line_starts, first_tokens = arrays
+        names = names.split('\n')
+        values = []
+        offset = 0
+        for length in lengths:
+            values.append(strings[offset:offset + length])
+            offset += length
+        lexed = cls(text)
+        lexed.__stored = ([names[n] for n in type_ids], [values[n] for n in value_ids], linenos, lexposs, line_starts,
+            first_tokens, dict(zip(line_starts, range(line_count))))
+        lexed.size = len(text) + len(data)
+        return lexed
+
+    def __lex(self, pos, lineno):
+        lines = self.__lines
+        lex = FastLexer()
+        lex.input(self.text)
+        lex.lexpos = pos
+        lex.lineno = lineno
+        tokens = []
+        count = 0
+        for tok in lex:
+            tokens.append(tok)
+            if tok.type == 'CPP_WS' and tok.value == '\n':
+                lines[pos] = (tuple(tokens), tok.lexpos + 1, tok.lineno + 1)
+                self.size += len(tokens) * _lexed_token_size
+                pos = tok.lexpos + 1
+                tokens = []
+                count += 1
+                if count == self.batch or pos in lines:
+                    return
+        if tokens:
+            # The last line lacks a newline, so gets one
+            last = tokens[-1]
+            tokens.append(Token('CPP_WS', '\n', last.lineno, last.lexpos))
+            lines[pos] = (tuple(tokens), len(self.text), last.lineno + 1)
+            self.size += len(tokens) * _lexed_token_size
+
+# ------------------------------------------------------------------
+# LexedFileCache object
+#
+# A cache of LexedFile which may be shared between preprocessors, and so
+# between threads, which evicts those least recently used once they take
+# up too much memory. Keys are whatever identifies a file and how it was
+# read. How much memory they take up is kept as a running total, which
+# grows as the lines of each file are lexed.
+# ------------------------------------------------------------------
+
+class LexedFileCache(object):
+    """A cache of LexedFile, holding no more than roughly max_size bytes of them.
+
+    >>> cache = LexedFileCache(100)
+    >>> cache.add('a.h', LexedFile('a' * 60))
+    >>> cache.get('a.h').text == 'a' * 60, cache.get('b.h')
+    (True, None)
+    >>> cache.add('b.h', LexedFile('b' * 60))
+    >>> cache.get('a.h'), len(cache), cache.size
+    (None, 1, 60)
+    >>> sorted(cache.stats.items())
+    [('evictions', 1), ('hits', 1), ('misses', 2)]
+    >>> tokens = cache.get('b.h').line(0, 1)
+    >>> cache.size > 60
+    True
+    """
+    def __init__(self, max_size = 64 << 20):
+        self.max_size = max_size
+        self.stats = collections.Counter()  # hits, misses and evictions
+        self.__files = collections.OrderedDict()  # key => LexedFile, least recently used first
+        self.__sizes = {}        # key => size of its LexedFile, as last told
+        self.__size = 0          # total of __sizes
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__files)
+
+    @property
+    def size(self):
+        """Roughly how many bytes the files cached take up"""
+        return self.__size
+
+    def get(self, key):
+        """Returns the LexedFile cached for key, or None"""
+        with self.__lock:
+            lexed = self.__files.get(key)
+            if lexed is None:
+                self.stats['misses'] += 1
+            else:
+                self.__files.move_to_end(key)
+                self.stats['hits'] += 1
+                # Lines lexed since it was added may have made the cache too big
+                self.__evict()
+            return lexed
+
+    def add(self, key, lexed):
+        """Caches the LexedFile lexed for key"""
+        with self.__lock:
+            self.__remove(key)
+            self.__files[key] = lexed
+            self.__sizes[key] = lexed.size
+            self.__size += lexed.size
+            lexed.on_grow = functools.partial(self.__grown, key, lexed)
+            self.__evict()
+
+    def clear(self):
+        """Removes every file from the cache"""
+        with self.__lock:
+            for key in list(self.__files):
+                self.__remove(key)
+
+    def __grown(self, key, lexed, size):
+        with self.__lock:
+            if self.__files.get(key) is lexed:
+                self.__sizes[key] += size
+                self.__size += size
+
+    def __remove(self, key):
+        lexed = self.__files.pop(key, None)
+        if lexed is not None:
+            lexed.on_grow = None
+            self.__size -= self.__sizes.pop(key)
+
+    def __evict(self):
+        # The most recently used file is kept however big it is
+        while self.__size > self.max_size and len(self.__files) > 1:
+            self.__remove(next(iter(self.__files)))
+            self.stats['evictions'] += 1
+
+
+# ------------------------------------------------------------------
+# DiskLexedFileCache object
+#
+# A directory of saved LexedFile, named after a hash of their text, which
+# carries over from one run of the preprocessor to the next. Each is
+# written to a temporary file which is then renamed into place, so that
+# any number of processes can share the directory. Once the directory
+# grows too big, the files least recently used are removed.
+# ------------------------------------------------------------------
+
+class DiskLexedFileCache(object):
+    """A directory of LexedFile saved by to_bytes(), holding no more than roughly
+    max_size bytes of them."""
+    def __init__(self, path, max_size = 256 << 20):
+        self.path = path
+        self.max_size = max_size
+        self.stats = collections.Counter()  # hits, misses, writes and evictions
+        self.__size = None       # bytes of files in the directory, once known
+        self.__lock = threading.Lock()
+
+    def key(self, text):
+        """Returns the key for the LexedFile of text, which depends on how it is lexed"""
+        digest = hashlib.sha1(_lexed_file_magic + b'\n')
+        digest.update(text.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the LexedFile saved for key, or None"""
+        path = os.path.join(self.path, key + '.lex')
+        try:
+            with open(path, 'rb') as ih:
+                lexed = LexedFile.from_bytes(ih.read())
+            # Mark it as recently used
+            os.utime(path)
+        except (OSError, ValueError, UnicodeError):
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return lexed
+
+    def add(self, key, lexed):
+        """Saves the LexedFile lexed for key, lexing all of it"""
+        data = lexed.to_bytes()
+        try:
+            os.makedirs(self.path, exist_ok = True)
+            fd, temp = tempfile.mkstemp(suffix = '.tmp', dir = self.path)
+            path = os.path.join(self.path, key + '.lex')
+            try:
+                with os.fdopen(fd, 'wb') as oh:
+                    oh.write(data)
+                os.replace(temp, path)
+            except BaseException:
+                os.remove(temp)
+                raise
+        except OSError:
+            # A cache which cannot be written to is merely not used
+            return
+        self.stats['writes'] += 1
+        with self.__lock:
+            if self.__size is None:
+                self.__size = sum([size for mtime, size, path in self.__files()])
+            else:
+                self.__size += len(data)
+            if self.__size > self.max_size:
+                self.__evict(path)
+
+    def __files(self):
+        # (mtime, size, path) of each saved LexedFile in the directory
+        files = []
+        try:
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.lex'):
+                    try:
+                        s = entry.stat()
+                        files.append((s.st_mtime_ns, s.st_size, entry.path))
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return files
+
+    def __evict(self, keep):
+        # Down to three quarters of max_size, so that the directory needn't be rescanned
+        # for a while, though never the file just saved at keep
+        files = sorted(self.__files())
+        size = sum([size for mtime, size, path in files])
+        for mtime, file_size, path in files:
+            if size <= self.max_size * 3 // 4:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self.stats['evictions'] += 1
+            except OSError:
+                # Another process may have removed it already
+                pass
+            size -= file_size
+        self.__size = size
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
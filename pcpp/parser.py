@@ -151,6 +151,7 @@ from ply import lex, yacc
 from ply.lex import LexToken
 sys.path = oldsyspath
 del oldsyspath
+from pcpp.lexer import FastLexer, Token, as_token, HideSet, empty_hideset
 
 # -----------------------------------------------------------------------------
 # trigraph()
@@ -185,8 +186,20 @@ _trigraph_rep = {
 def trigraph(input):
     return _trigraph_pat.sub(lambda g: _trigraph_rep[g.group()[-1]],input)
 
-def default_lexer():
-    return lex.lex(optimize=in_production)
+# The lexer engine default_lexer() uses when none is specified. 'fast' is the hand
+# written lexer in lexer.py, 'ply' is the PLY lexer generated from the rules above.
+# Both produce the same tokens.
+default_lexer_engine = 'fast'
+lexer_engines = ('fast', 'ply')
+
+def default_lexer(engine=None):
+    if engine is None:
+        engine = default_lexer_engine
+    if engine == 'fast':
+        return FastLexer()
+    elif engine == 'ply':
+        return lex.lex(optimize=in_production)
+    raise ValueError("Unknown lexer engine '%s', must be one of %s" % (engine, ', '.join(lexer_engines)))
 
 # ------------------------------------------------------------------
 # Macro object
@@ -214,9 +227,40 @@ class Macro(object):
             self.vararg = arglist[-1]
         self.source = None
         self.lineno = None
+        self.template = None     # compiled from the patch lists on first expansion
     def __repr__(self):
         return "%s(%s)=%s" % (self.name, self.arglist, self.value)
 
+# ------------------------------------------------------------------
+# LazyMacro object
+#
+# A function like macro whose replacement list is kept as the raw tokens
+# after its parameter list in .body, and only turned into a .value with
+# patch lists by the supplied complete callable when first needed, be
+# that by macro expansion or by anything else examining the macro.
+# ------------------------------------------------------------------
+
+class LazyMacro(Macro):
+    def __init__(self,name,body,arglist,variadic,complete):
+        self.name = name
+        self.body = body
+        self.arglist = arglist
+        self.variadic = variadic
+        if variadic:
+            self.vararg = arglist[-1]
+        self.source = None
+        self.lineno = None
+        self.__complete = complete
+    def __getattr__(self,name):
+        # Only called for attributes not set yet, i.e. value, template and the patch lists
+        if name.startswith('__'):
+            raise AttributeError(name)
+        complete = self.__dict__.pop('_LazyMacro__complete', None)
+        if complete is None:
+            raise AttributeError(name)
+        complete(self)
+        return getattr(self, name)
+
 # ------------------------------------------------------------------
 # Preprocessor event hooks
 #
@@ -258,11 +302,16 @@ class PreprocessorHooks(object):
         so ``includepath`` may not exist. If it does not, raise the appropriate
         ``IOError`` exception.
         
-        The default calls ``io.open(includepath, 'r', encoding = self.assume_encoding)``,
+        The default calls ``self.vfs.open(includepath, encoding = self.assume_encoding)``,
+        which opens files within any archives mounted in the ``VirtualFileSystem`` and
+        otherwise calls ``io.open(includepath, 'r', encoding = self.assume_encoding)``,
         examines if it starts with a BOM (if so, it removes it), and returns the file
         object opened. This raises the appropriate exception if the path was not found.
+
+        If ``read_ahead_threads`` is set, this is called from those threads, so must be
+        safe to call from several threads at once.
         """
-        ret = open(includepath, 'r', encoding = self.assume_encoding)
+        ret = self.vfs.open(includepath, encoding = self.assume_encoding)
         bom = ret.read(1)
         #print(repr(bom))
         if bom != '\ufeff':
@@ -369,7 +418,19 @@ class PreprocessorHooks(object):
         not a token.
         """
         pass
-    
+
+    def on_include_replay(self,abssource):
+        """Called before an included file is replayed from ``include_replay_cache``, or
+        preprocessed so that it can be replayed later. Replaying a file calls none of
+        these hooks, so return None if hooks with side effects must see all of it, and
+        it is then always preprocessed. Otherwise return something to tell apart what
+        these hooks would make of it, which is compared with repr() in later runs, as
+        it is only replayed when the same.
+
+        The default returns an empty tuple.
+        """
+        return ()
+
     def on_comment(self,tok):
         """Called when the preprocessor encounters a comment token. You can modify the token
         in place. You must return True to let the comment pass through, else it will be removed.
@@ -3,15 +3,20 @@
 # (C) 2017-2026 Niall Douglas http://www.nedproductions.biz/
 # Started: March 2017
 
-import sys, argparse, traceback, os, copy, io, re
+import sys, argparse, traceback, os, copy, io, re, collections, hashlib, marshal, tempfile
 if __name__ == '__main__' and __package__ is None:
     sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
-from pcpp.preprocessor import Preprocessor, OutputDirective, Action
+from pcpp.preprocessor import Preprocessor, OutputDirective, Action, IncludeReplayCache
+from pcpp.parser import default_lexer, default_lexer_engine, lexer_engines
 
 version='1.31'
 
 __all__ = []
 
+def _make_quoted(path):
+    """Returns path quoted for use as a target or prerequisite in a Makefile"""
+    return re.sub(r'(\\*)([ \t#])', lambda m: m.group(1) * 2 + '\\' + m.group(2), path).replace('$', '$$')
+
 class FileAction(argparse.Action):
     def __init__(self, option_strings, dest, **kwargs):
         super(FileAction, self).__init__(option_strings, dest, **kwargs)
@@ -24,6 +29,143 @@ class FileAction(argparse.Action):
         items += [argparse.FileType('rt')(value) for value in values]
         setattr(namespace, self.dest, items)
 
+# ------------------------------------------------------------------
+# OutputCache object
+#
+# A directory of the output of whole runs, as ccache keeps for compilers.
+# Each key, a hash of the inputs and options, names a manifest listing the
+# files each earlier run with that key read, along with the hash of their
+# contents, and the hash of its output, which names the file holding it.
+# Files are written under another name and renamed into place, so any
+# number of processes can share the directory. Once the directory grows
+# too big, the files least recently used are removed.
+# ------------------------------------------------------------------
+
+class OutputCache(object):
+    """A directory of the output of earlier runs, holding no more than roughly
+    max_size bytes of them."""
+    # Manifests are saved with marshal, so only load into the same version of Python
+    _magic = b'PCPPOUTPUT2 %d.%d marshal %d\n' % (sys.version_info[0], sys.version_info[1], marshal.version)
+
+    def __init__(self, path, max_size = 1 << 30, max_entries = 8):
+        self.path = path
+        self.max_size = max_size
+        self.max_entries = max_entries  # how many runs each manifest remembers
+        self.stats = collections.Counter()  # hits, misses, uncacheable and evictions
+
+    def get(self, key, read, exists = os.path.exists):
+        """Returns the output saved for key by a run whose files are unchanged, and
+        none of whose missing files now exist, or None. read(path) returns the bytes
+        of the file at path, and exists(path) whether there is one."""
+        digests = {}
+        for files, missing, output in self.__load(key + '.manifest') or ():
+            for path, digest in files:
+                if path not in digests:
+                    try:
+                        digests[path] = hashlib.sha1(read(path)).hexdigest()
+                    except OSError:
+                        digests[path] = None
+                if digests[path] != digest:
+                    break
+            else:
+                if any([exists(path) for path in missing]):
+                    continue
+                data = self.__load(output + '.output')
+                if data is not None:
+                    self.stats['hits'] += 1
+                    return data
+        return None
+
+    def add(self, key, files, output, missing = ()):
+        """Saves output for key, made by reading files, a list of (path, bytes), and by
+        looking for the files at the paths in missing, which weren't there"""
+        files = tuple([(path, hashlib.sha1(data).hexdigest()) for path, data in files])
+        missing = tuple(sorted(missing))
+        digest = hashlib.sha1(output.encode('utf-8', 'surrogatepass')).hexdigest()
+        entries = [x for x in (self.__load(key + '.manifest') or []) if x[:2] != (files, missing)]
+        self.__save(digest + '.output', output)
+        self.__save(key + '.manifest', [(files, missing, digest)] + entries[:self.max_entries - 1])
+        self.stats['misses'] += 1
+        size = sum([size for mtime, size, path in self.__files()])
+        if size > self.max_size:
+            self.__evict(size, (os.path.join(self.path, key + '.manifest'), os.path.join(self.path, digest + '.output')))
+
+    def totals(self):
+        """Returns the stats of every run using the directory, and how many files of what
+        size it holds"""
+        totals = collections.Counter(self.__load('stats') or {})
+        files = self.__files()
+        totals['files'] = len(files)
+        totals['size'] = sum([size for mtime, size, path in files])
+        return totals
+
+    def save_stats(self):
+        """Adds the stats of this run to those of every run"""
+        totals = collections.Counter(self.__load('stats') or {})
+        totals.update(self.stats)
+        self.__save('stats', dict(totals))
+
+    def __load(self, name):
+        path = os.path.join(self.path, name)
+        try:
+            with open(path, 'rb') as ih:
+                data = ih.read()
+            if not data.startswith(self._magic):
+                return None
+            ret = marshal.loads(data[len(self._magic):])
+            # Mark it as recently used
+            os.utime(path)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return ret
+
+    def __save(self, name, value):
+        data = self._magic + marshal.dumps(value)
+        try:
+            os.makedirs(self.path, exist_ok = True)
+            fd, temp = tempfile.mkstemp(suffix = '.tmp', dir = self.path)
+            try:
+                with os.fdopen(fd, 'wb') as oh:
+                    oh.write(data)
+                os.replace(temp, os.path.join(self.path, name))
+            except BaseException:
+                os.remove(temp)
+                raise
+        except OSError:
+            # A cache which cannot be written to is merely not used
+            pass
+
+    def __files(self):
+        # (mtime, size, path) of each manifest and output in the directory
+        files = []
+        try:
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.manifest') or entry.name.endswith('.output'):
+                    try:
+                        s = entry.stat()
+                        files.append((s.st_mtime_ns, s.st_size, entry.path))
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return files
+
+    def __evict(self, size, keep):
+        # Down to three quarters of max_size, so that the directory needn't be emptied
+        # again for a while, though never the files just saved in keep
+        for mtime, file_size, path in sorted(self.__files()):
+            if size <= self.max_size * 3 // 4:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+                self.stats['evictions'] += 1
+            except OSError:
+                # Another process may have removed it already
+                pass
+            size -= file_size
+
 class CmdPreprocessor(Preprocessor):
     def __init__(self, argv):
         if len(argv) < 2:
@@ -41,7 +183,7 @@ class CmdPreprocessor(Preprocessor):
         argp.add_argument('-D', dest = 'defines', metavar = 'macro[=val]', nargs = 1, action = 'append', help = 'Predefine name as a macro [with value]')
         argp.add_argument('-U', dest = 'undefines', metavar = 'macro', nargs = 1, action = 'append', help = 'Pre-undefine name as a macro')
         argp.add_argument('-N', dest = 'nevers', metavar = 'macro', nargs = 1, action = 'append', help = 'Never define name as a macro, even if defined during the preprocessing.')
-        argp.add_argument('-I', dest = 'includes', metavar = 'path', nargs = 1, action = 'append', help = "Path to search for unfound #include's")
+        argp.add_argument('-I', dest = 'includes', metavar = 'path', nargs = 1, action = 'append', help = "Path to search for unfound #include's, which may be within a zip or tar archive as archive.zip!/path")
         #argp.add_argument('--passthru', dest = 'passthru', action = 'store_true', help = 'Pass through everything unexecuted except for #include and include guards (which need to be the first thing in an include file')
         argp.add_argument('--passthru-defines', dest = 'passthru_defines', action = 'store_true', help = 'Pass through but still execute #defines and #undefs if not always removed by preprocessor logic')
         argp.add_argument('--passthru-unfound-includes', dest = 'passthru_unfound_includes', action = 'store_true', help = 'Pass through #includes not found without execution')
@@ -51,6 +193,8 @@ class CmdPreprocessor(Preprocessor):
         argp.add_argument('--passthru-has-include', dest = 'passthru_has_include', action = 'store_true', help = 'Pass through __has_include expressions unmodified')
         argp.add_argument('--passthru-includes', dest = 'passthru_includes', metavar = '<regex>', default = None, nargs = 1, help = "Regular expression for which #includes to not expand. #includes, if found, are always executed")
         argp.add_argument('--disable-auto-pragma-once', dest = 'auto_pragma_once_disabled', action = 'store_true', default = False, help = 'Disable the heuristics which auto apply #pragma once to #include files wholly wrapped in an obvious include guard macro')
+        argp.add_argument('--disable-skip-guarded-includes', dest = 'skip_guarded_includes_disabled', action = 'store_true', default = False, help = 'Always open #include files, even when wholly wrapped in an include guard macro which is already defined')
+        argp.add_argument('--include-once-by-content', dest = 'include_once_by_content', action = 'store_true', default = False, help = 'Also skip #include files identical to one already seen with #pragma once, as GCC does')
         argp.add_argument('--enable-include-next', dest = 'include_next_enabled', action = 'store_true', default = False, help = 'Enable #include_next support, which you should try to avoid using')
         argp.add_argument('--line-directive', dest = 'line_directive', metavar = 'form', default = '#line', nargs = '?', help = "Form of line directive to use, defaults to #line, specify nothing to disable output of line directives")
         argp.add_argument('--debug', dest = 'debug', action = 'store_true', help = 'Generate a pcpp_debug.log file logging execution')
@@ -61,6 +205,26 @@ class CmdPreprocessor(Preprocessor):
         argp.add_argument('--output-encoding', dest = 'output_encoding', metavar = '<encoding>', default = None, nargs = 1, help = 'The text encoding to use when writing files')
         argp.add_argument('--write-bom', dest = 'write_bom', action = 'store_true', help = 'Prefix any output with a Unicode BOM')
         argp.add_argument('--trigraphs', dest = 'enable_trigraphs', action = 'store_true', help = 'Enable processing trigraphs')
+        argp.add_argument('--max-expansion-depth', dest = 'max_expansion_depth', metavar = '<depth>', type = int, default = None, help = 'Report an error instead of expanding macros nested more than this deep (default is unlimited)')
+        argp.add_argument('--macro-cache-size', dest = 'macro_invocation_cache_size', metavar = '<entries>', type = int, default = 4096, help = 'How many expansions of function like macro invocations to cache, 0 disables the cache (default is 4096)')
+        argp.add_argument('--lazy-defines', dest = 'lazy_macro_definitions', action = 'store_true', help = 'Only process the replacement list of a function like macro when it is first used')
+        argp.add_argument('--save-state', dest = 'save_state', metavar = 'path', default = None, help = 'Save the macros and other state left after preprocessing the inputs, for --load-state')
+        argp.add_argument('--load-state', dest = 'load_state', metavar = 'path', default = None, help = 'Start from the state saved by --save-state, preprocessing the files it was made from again, and saving it again, if any have changed')
+        argp.add_argument('--replay-includes', dest = 'replay_includes', action = 'store_true', help = 'Replay the output and effects of files included again with the same macros they examine, instead of preprocessing them again')
+        argp.add_argument('--replay-dir', dest = 'replay_dir', metavar = 'path', default = None, help = 'Directory in which to keep what --replay-includes replays, for reuse by later runs')
+        argp.add_argument('--read-ahead-threads', dest = 'read_ahead_threads', metavar = 'count', type = int, default = 0, help = 'Read files about to be #included with this many background threads')
+        argp.add_argument('--cache-dir', dest = 'cache_dir', metavar = 'path', default = None, help = 'Directory in which to keep included files lexed, for reuse by later runs')
+        argp.add_argument('--output-cache', dest = 'output_cache', metavar = 'path', default = None, help = 'Directory in which to keep the output of runs, which runs with the same inputs and options write instead of preprocessing if no file read has changed')
+        argp.add_argument('--output-cache-size', dest = 'output_cache_size', metavar = 'bytes', type = int, default = 1 << 30, help = 'How many bytes --output-cache may hold before those least recently used are removed (default is 1Gb)')
+        argp.add_argument('--cache-stats', dest = 'cache_stats', action = 'store_true', help = 'Print statistics of --output-cache to stderr')
+        argp.add_argument('--deps-only', dest = 'deps_only', action = 'store_true', help = 'Only execute directives to find the files #included, writing a Makefile rule depending on them instead of any output')
+        argp.add_argument('-M', '-MM', dest = 'deps_M', action = 'store_true', help = 'As --deps-only')
+        argp.add_argument('-MD', '-MMD', dest = 'deps_MD', action = 'store_true', help = 'Also write a Makefile rule depending on the files #included, to the output with a .d suffix unless -MF is given')
+        argp.add_argument('-MF', dest = 'deps_MF', metavar = 'path', default = None, help = 'Write the Makefile rule to this file')
+        argp.add_argument('-MT', dest = 'deps_targets', metavar = 'target', action = 'append', help = 'Target of the Makefile rule, instead of the output or, with --deps-only, the input with a .o suffix')
+        argp.add_argument('-MQ', dest = 'deps_targets', metavar = 'target', action = 'append', type = _make_quoted, help = 'As -MT, quoting any characters special to make')
+        argp.add_argument('-MP', dest = 'deps_MP', action = 'store_true', help = 'Add a rule for each file #included depending on nothing, so make still works once one is removed')
+        argp.add_argument('--lexer', dest = 'lexer', metavar = '<engine>', default = default_lexer_engine, choices = lexer_engines, help = 'The lexer engine to use, one of %s (default is %s)' % (', '.join(lexer_engines), default_lexer_engine))
         argp.add_argument('--version', action='version', version='pcpp ' + version)
         args = argp.parse_known_args(argv[1:])
         #print(args)
@@ -68,7 +232,7 @@ class CmdPreprocessor(Preprocessor):
             print("NOTE: Argument %s not known, ignoring!" % arg, file = sys.stderr)
 
         self.args = args[0]
-        super(CmdPreprocessor, self).__init__()
+        super(CmdPreprocessor, self).__init__(default_lexer(self.args.lexer))
         
         # Override Preprocessor instance variables
         self.define("__PCPP_VERSION__ " + version)
@@ -77,6 +241,8 @@ class CmdPreprocessor(Preprocessor):
         if self.args.debug:
             self.debugout = open("pcpp_debug.log", "wt")
         self.auto_pragma_once_enabled = not self.args.auto_pragma_once_disabled
+        self.skip_guarded_includes = not self.args.skip_guarded_includes_disabled
+        self.include_once_by_content = self.args.include_once_by_content
         self.include_next_enabled = self.args.include_next_enabled
         self.line_directive = self.args.line_directive
         if self.line_directive is not None and self.line_directive.lower() in ('nothing', 'none', ''):
@@ -110,10 +276,19 @@ class CmdPreprocessor(Preprocessor):
             if self.args.write_bom:
                 self.args.output.write('\ufeff')
         self.enable_trigraphs = self.args.enable_trigraphs
+        self.max_expansion_depth = self.args.max_expansion_depth
+        self.macro_invocation_cache_size = self.args.macro_invocation_cache_size
+        self.lazy_macro_definitions = self.args.lazy_macro_definitions
+        self.cache_dir = self.args.cache_dir
+        self.read_ahead_threads = self.args.read_ahead_threads
+        self.dependencies_only = self.args.deps_only or self.args.deps_M
+        if self.args.replay_includes or self.args.replay_dir is not None:
+            self.include_replay_cache = IncludeReplayCache(self.args.replay_dir)
         
         # My own instance variables
         self.bypass_ifpassthru = False
         self.potential_include_guard = None
+        self.output_cacheable = True
 
         if self.args.defines:
             self.args.defines = [x[0] for x in self.args.defines]
@@ -128,12 +303,27 @@ class CmdPreprocessor(Preprocessor):
                 self.undef(d)
         if self.args.nevers:
             self.args.nevers = [x[0] for x in self.args.nevers]
+            # Even in a disabled group, the #define of a never defined macro leaves a blank line
+            self.skip_disabled_regions = False
         if self.args.includes:
             self.args.includes = [x[0] for x in self.args.includes]
             for d in self.args.includes:
                 self.add_path(d)
 
+        output_cache = None
         try:
+            if self.args.output_cache is not None:
+                output_cache = OutputCache(self.args.output_cache, self.args.output_cache_size)
+                self.probed_paths = set()
+                if self.__output_cache_run(output_cache):
+                    return
+            if self.args.load_state:
+                try:
+                    if not self.load_state(self.args.load_state):
+                        self.save_state(self.args.load_state)
+                except (IOError, ValueError) as e:
+                    print("Could not load state from %s due to %s" % (self.args.load_state, e), file = sys.stderr)
+                    sys.exit(-1)
             if len(self.args.inputs) == 1:
                 self.parse(self.args.inputs[0])
             else:
@@ -141,7 +331,17 @@ class CmdPreprocessor(Preprocessor):
                 for i in self.args.inputs:
                     input += '#include "' + i.name + '"\n'
                 self.parse(input)
-            self.write(self.args.output)
+            if self.dependencies_only:
+                while self.token() is not None:
+                    pass
+            elif output_cache is None:
+                self.write(self.args.output)
+            else:
+                self.__output_cache_add(output_cache)
+            if self.dependencies_only or self.args.deps_MD:
+                self.__write_dependencies()
+            if self.args.save_state:
+                self.save_state(self.args.save_state)
         except:
             print(traceback.print_exc(10), file = sys.stderr)
             print("\nINTERNAL PREPROCESSOR ERROR AT AROUND %s:%d, FATALLY EXITING NOW\n"
@@ -152,6 +352,10 @@ class CmdPreprocessor(Preprocessor):
                 i.close()
             if self.args.output != sys.stdout:
                 self.args.output.close()
+            if output_cache is not None:
+                output_cache.save_stats()
+                if self.args.cache_stats:
+                    self.__output_cache_report(output_cache)
         
         if self.args.time:
             print("\nTime report:")
@@ -192,7 +396,124 @@ class CmdPreprocessor(Preprocessor):
             filetimes = [(v[0],v[1],k) for k,v in filetimes.items()]
             filetimes.sort(reverse=True)
             for t,s,p in filetimes:
-                print(('%f,%f,%d,"%s"' % (t, s, os.stat(p).st_size, p)), file = self.args.filetimes)
+                print(('%f,%f,%d,"%s"' % (t, s, self.vfs.getsize(p), p)), file = self.args.filetimes)
+    # ----------------------------------------------------------------------
+    # __output_cache_run(), __output_cache_add() and __output_cache_report()
+    #
+    # With --output-cache, the output of a run is saved under a key hashing
+    # the inputs, the options affecting the output and the directory run in,
+    # along with the hash of every file read, and the paths of the files
+    # looked for but not found. A later run with the same key writes the
+    # output saved instead of preprocessing, if every file read is unchanged
+    # and none of those not found have since been created. Runs whose output
+    # depends on the time, or which print warnings or errors, or which write
+    # more than the output, aren't saved.
+    # ----------------------------------------------------------------------
+
+    # Options which change how, but not what, is output
+    _output_cache_ignored = ('inputs', 'output', 'output_cache', 'output_cache_size', 'cache_stats', 'cache_dir',
+                             'read_ahead_threads', 'replay_includes', 'replay_dir', 'lexer', 'macro_invocation_cache_size',
+                             'lazy_macro_definitions')
+
+    def __output_cache_run(self, output_cache):
+        # Writes the output saved by an earlier run, returning True if there was any
+        self.__output_cache_key = None
+        if self.args.debug or self.args.time or self.args.filetimes or self.args.save_state or self.args.load_state:
+            return False
+        if self.dependencies_only or self.args.deps_MD:
+            return False
+        digest = hashlib.sha1(OutputCache._magic)
+        options = [x for x in sorted(vars(self.args).items()) if x[0] not in self._output_cache_ignored]
+        digest.update(repr((version, os.getcwd(), os.environ.get('SOURCE_DATE_EPOCH'), options)).encode('utf-8', 'surrogatepass'))
+        for i in self.args.inputs:
+            if i is sys.stdin:
+                return False
+            try:
+                data = self.vfs.read(i.name)
+            except OSError:
+                return False
+            digest.update(repr(i.name).encode('utf-8', 'surrogatepass') + b'\n' + data)
+        self.__output_cache_key = digest.hexdigest()
+        output = output_cache.get(self.__output_cache_key, self.vfs.read, lambda path: self.vfs.mtime(path) is not None)
+        if output is None:
+            return False
+        self.args.output.write(output)
+        return True
+
+    def __output_cache_add(self, output_cache):
+        # Writes the output, saving it if it can be
+        oh = io.StringIO()
+        self.write(oh)
+        output = oh.getvalue()
+        self.args.output.write(output)
+        if self.__output_cache_key is None or self.return_code != 0 or not self.output_cacheable:
+            output_cache.stats['uncacheable'] += 1
+            return
+        files = []
+        for inclusion in self.include_times:
+            path = inclusion.included_abspath
+            if path is not None and path not in [x[0] for x in files]:
+                files.append((path, self.vfs.read(path)))
+        if 'SOURCE_DATE_EPOCH' not in os.environ and not self.args.passthru_magic_macros:
+            for path, data in files:
+                if b'__DATE__' in data or b'__TIME__' in data:
+                    output_cache.stats['uncacheable'] += 1
+                    return
+        # Were any file looked for but not found created, the output could differ
+        read = set([x[0] for x in files])
+        missing = [path for path in self.probed_paths if path not in read and self.vfs.mtime(path) is None]
+        output_cache.add(self.__output_cache_key, files, output, missing)
+
+    def __output_cache_report(self, output_cache):
+        totals = output_cache.totals()
+        lookups = totals['hits'] + totals['misses']
+        print("Output cache %s:" % output_cache.path, file = sys.stderr)
+        print("  hits          %10d (%.1f%%)" % (totals['hits'], 100.0 * totals['hits'] / lookups if lookups else 0), file = sys.stderr)
+        print("  misses        %10d" % totals['misses'], file = sys.stderr)
+        print("  uncacheable   %10d" % totals['uncacheable'], file = sys.stderr)
+        print("  evictions     %10d" % totals['evictions'], file = sys.stderr)
+        print("  files         %10d" % totals['files'], file = sys.stderr)
+        print("  size          %10.1f Mb (of %.1f Mb)" % (totals['size'] / 1048576.0, output_cache.max_size / 1048576.0), file = sys.stderr)
+
+    # ----------------------------------------------------------------------
+    # __write_dependencies()
+    #
+    # Writes a Makefile rule, as GCC's -M options do, making the targets given
+    # by -MT and -MQ depend on the inputs and every file they #included.
+    # ----------------------------------------------------------------------
+
+    def __write_dependencies(self):
+        deps = []
+        for inclusion in self.include_times:
+            path = inclusion.included_abspath
+            # Not stdin, nor the #includes of each input made when there are several
+            if path is not None and self.vfs.mtime(path) is not None:
+                # Relative to the current directory if within it
+                try:
+                    relpath = os.path.relpath(path)
+                except ValueError:
+                    relpath = os.pardir
+                dep = _make_quoted(path if relpath.startswith(os.pardir) else relpath)
+                if dep not in deps:
+                    deps.append(dep)
+        first = self.args.inputs[0].name if self.args.inputs and self.args.inputs[0] is not sys.stdin else '-'
+        stem = os.path.splitext(os.path.basename(first))[0]
+        output = self.args.output.name if self.args.output is not sys.stdout else None
+        targets = self.args.deps_targets
+        if not targets:
+            targets = [_make_quoted(output if output is not None and not self.dependencies_only else stem + '.o')]
+        rule = ' '.join(targets) + ':' + ''.join([' \\\n ' + dep for dep in deps]) + '\n'
+        if self.args.deps_MP:
+            rule += ''.join(['\n' + dep + ':\n' for dep in deps[1:]])
+        if self.args.deps_MF is None and self.dependencies_only:
+            self.args.output.write(rule)
+            return
+        path = self.args.deps_MF
+        if path is None:
+            path = os.path.splitext(output)[0] + '.d' if output is not None else stem + '.d'
+        with open(path, 'wt') as oh:
+            oh.write(rule)
+
     def on_include_not_found(self,is_malformed,is_system_include,curdir,includepath):
         if self.args.passthru_unfound_includes:
             raise OutputDirective(Action.IgnoreAndPassThrough)
@@ -240,12 +561,22 @@ class CmdPreprocessor(Preprocessor):
     def on_directive_unknown(self,directive,toks,ifpassthru,precedingtoks):
         if ifpassthru:
             return None  # Pass through
+        if directive.value == 'warning':
+            # Only the output is saved by --output-cache
+            self.output_cacheable = False
         return super(CmdPreprocessor, self).on_directive_unknown(directive,toks,ifpassthru,precedingtoks)
 
     def on_potential_include_guard(self,macro):
         self.potential_include_guard = macro
         return super(CmdPreprocessor, self).on_potential_include_guard(macro)
 
+    def on_include_replay(self,abssource):
+        if self.args.passthru_undefined_exprs:
+            # What passes through depends upon what is left of other files passed through
+            return None
+        return (self.args.passthru_unfound_includes, self.args.passthru_defines, self.args.passthru_comments,
+                tuple(self.args.undefines or ()), tuple(self.args.nevers or ()))
+
     def on_comment(self,tok):
         if self.args.passthru_comments:
             return True  # Pass through
@@ -9,15 +9,24 @@
 # This edition substantially improves on standards conforming output,
 # getting quite close to what clang or GCC outputs.
 
-import sys, os, re, codecs, time, copy, traceback
+import sys, os, re, codecs, time, traceback, collections, itertools, threading, hashlib
+import concurrent.futures, marshal, tempfile
 if __name__ == '__main__' and __package__ is None:
     sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
-from pcpp.parser import STRING_TYPES, default_lexer, trigraph, Macro, Action, OutputDirective, PreprocessorHooks
+from pcpp.parser import STRING_TYPES, default_lexer, trigraph, Macro, LazyMacro, Action, OutputDirective, PreprocessorHooks, FastLexer, as_token, HideSet, empty_hideset, Token
+from pcpp.lexer import ConditionalIndex, LexedFile, LexedFileCache, DiskLexedFileCache, minimised_source
+from pcpp.vfs import VirtualFileSystem
 from pcpp.evaluator import Evaluator
+from operator import attrgetter
 
 import io
 FILE_TYPES = io.IOBase
+# The characters str.splitlines() splits lines at
+_line_breaks = '\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029'
 clock = time.process_time
+_token_type = attrgetter('type')
+_token_value = attrgetter('value')
+_token_clone = Token.clone
 
 __all__ = ['Preprocessor', 'PreprocessorHooks', 'OutputDirective', 'Action', 'Evaluator']
 
@@ -36,6 +45,414 @@ class FileInclusionTime(object):
         self.depth = depth
         self.elapsed = 0.0
 
+# ------------------------------------------------------------------
+# Include resolution cache
+#
+# Remembers which of the directories searched for an #include hold a file
+# of that name, so that the file need not be tried in each of them again.
+# Each directory is listed once, when first searched, rather than trying
+# to open every file it might hold. Names are compared case insensitively,
+# so a file which might be there on a case insensitive file system is
+# still tried.
+# ------------------------------------------------------------------
+
+class IncludeCache(object):
+    """Where the files to #include are, which may be shared between preprocessors.
+
+    If validate is true, the directories behind each answer are checked for
+    any files added or removed since, for the sake of long lived processes."""
+    def __init__(self, validate = False):
+        self.validate = validate
+        self.stats = collections.Counter()  # hits, misses and how many opens of files which aren't there were avoided
+        self.__listings = {}     # directory => (its st_mtime_ns, set of the lower case names in it)
+        self.__found = {}        # (search path, filename, is system include) => ((directory, st_mtime_ns) searched, paths found)
+        self.__lock = threading.Lock()
+
+    def find(self, path, filename, is_system_include, vfs = None):
+        """Returns the absolute paths of each file named filename, in the order of the
+        directories in path, if it might be there. Directories are listed through the
+        VirtualFileSystem vfs if given."""
+        key = (tuple(path), filename, is_system_include)
+        vfs = vfs or self.__real_file_system
+        with self.__lock:
+            found = self.__found.get(key)
+            if found is not None and self.validate:
+                for dname, mtime in found[0]:
+                    if vfs.mtime(dname) != mtime:
+                        found = None
+                        break
+            if found is None:
+                self.stats['misses'] += 1
+                searched, paths = [], []
+                for p in path:
+                    fulliname = os.path.abspath(os.path.join(p, filename))
+                    dname, name = os.path.split(fulliname)
+                    mtime, names = self.__listing(dname, vfs)
+                    searched.append((dname, mtime))
+                    if name.lower() in names:
+                        paths.append(fulliname)
+                found = self.__found[key] = (tuple(searched), tuple(paths))
+            else:
+                self.stats['hits'] += 1
+            self.stats['probes_avoided'] += len(path) - len(found[1])
+            return found[1]
+
+    def clear(self):
+        """Forgets everything found"""
+        with self.__lock:
+            self.__listings.clear()
+            self.__found.clear()
+
+    __real_file_system = VirtualFileSystem()
+
+    def __listing(self, dname, vfs):
+        listing = self.__listings.get(dname)
+        if listing is None or (self.validate and listing[0] != vfs.mtime(dname)):
+            mtime = vfs.mtime(dname)
+            try:
+                names = set([name.lower() for name in vfs.listdir(dname)])
+            except OSError:
+                names = frozenset()
+            if mtime is not None and time.time() - mtime / 1e9 < 1:
+                # File system timestamps are coarse, so a directory modified this recently
+                # might yet be modified again without its mtime changing
+                mtime = -1
+            listing = self.__listings[dname] = (mtime, names)
+        return listing
+
+class IncludeReadAhead(object):
+    """Opens and reads files about to be #included in a pool of threads, so that
+    waiting for them to be read overlaps preprocessing.
+
+    Each file is handed over by open(), still open, along with the text read
+    from it. At most max_files are kept waiting to be handed over, the longest
+    waiting being closed to make room for more. on_file_open is called from
+    the threads of the pool."""
+    def __init__(self, on_file_open, threads, max_files = 32):
+        self.max_files = max_files
+        self.stats = collections.Counter()  # scheduled, hits and discarded
+        self.__on_file_open = on_file_open
+        self.__executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.__pending = collections.OrderedDict()  # (is_system_include, path) => Future of [(path, open file or None if not found, its text)]
+
+    def schedule(self, is_system_include, paths):
+        """Looks for a file in each of paths in turn in the background, as include() would"""
+        todo = []
+        for path in paths:
+            if (is_system_include, path) in self.__pending:
+                # Whatever is already looking for it will carry on from here
+                break
+            todo.append(path)
+        if not todo:
+            return
+        self.stats['scheduled'] += 1
+        future = self.__executor.submit(self.__read, is_system_include, todo)
+        for path in todo:
+            self.__pending[(is_system_include, path)] = future
+        while len(self.__pending) > self.max_files:
+            self.__discard(*self.__pending.popitem(last = False))
+
+    def open(self, is_system_include, path):
+        """Returns the file at path and the text read from it if read ahead, waiting for
+        it to be read if need be, raising IOError if it was found not to exist, or None
+        if unknown"""
+        future = self.__pending.pop((is_system_include, path), None)
+        if future is None or future.cancelled():
+            return None
+        for name, ih, text in future.result():
+            if name == path:
+                if ih is None:
+                    raise IOError("%s not found" % path)
+                self.stats['hits'] += 1
+                return ih, text
+        return None
+
+    def close(self):
+        """Closes all files not handed over, and ends the pool of threads"""
+        while self.__pending:
+            self.__discard(*self.__pending.popitem(last = False))
+        self.__executor.shutdown(wait = False)
+
+    def __read(self, is_system_include, paths):
+        found = []
+        for path in paths:
+            try:
+                ih = self.__on_file_open(is_system_include, path)
+            except IOError:
+                found.append((path, None, None))
+                continue
+            try:
+                text = ih.read()
+            except (IOError, ValueError):
+                # Leave it to be opened again
+                ih.close()
+                break
+            found.append((path, ih, text))
+            break
+        return found
+
+    def __discard(self, key, future):
+        self.stats['discarded'] += 1
+        future.cancel()
+        def close(future):
+            if not future.cancelled() and future.exception() is None:
+                for name, ih, text in future.result():
+                    if name == key[1] and ih is not None:
+                        ih.close()
+        future.add_done_callback(close)
+
+# ------------------------------------------------------------------
+# Saved macros
+#
+# Macros as tuples which marshal can save, with the files named by their
+# tokens numbered, so that each file's path is saved once.
+# ------------------------------------------------------------------
+
+def _macro_fingerprint(m):
+    # What tells a definition of a macro apart from other definitions of it. A LazyMacro
+    # is told apart by its body, so as not to complete it, which differs from the same
+    # definition made eagerly, so at worst costs rebuilding what was saved.
+    tokens = m.body if isinstance(m, LazyMacro) else m.value
+    return (None if m.arglist is None else tuple(m.arglist), m.variadic, isinstance(m, LazyMacro), ''.join([tok.value for tok in tokens]))
+
+def _saved_macro(m, sources):
+    # Macro m as a tuple, numbering the files it names in the dict sources of path => number
+    source = sources.setdefault(m.source, len(sources))
+    tokens = tuple([(tok.type, tok.value, tok.lineno, tok.lexpos, sources.setdefault(tok.source, len(sources))) for tok in m.value])
+    if m.arglist is None:
+        return (m.name, tokens, source, m.lineno)
+    return (m.name, tokens, source, m.lineno, tuple(m.arglist), m.variadic, tuple(m.patch), tuple(m.str_patch), tuple(m.var_comma_patch))
+
+def _loaded_macro(saved, sources):
+    # The Macro saved by _saved_macro(), sources being the list of paths numbered
+    value = [Token(type, value, lineno, lexpos, sources[source]) for type, value, lineno, lexpos, source in saved[1]]
+    if len(saved) == 4:
+        macro = Macro(saved[0], value)
+    else:
+        macro = Macro(saved[0], value, list(saved[4]), saved[5])
+        macro.patch, macro.str_patch, macro.var_comma_patch = list(saved[6]), list(saved[7]), list(saved[8])
+    macro.source = sources[saved[2]]
+    macro.lineno = saved[3]
+    return macro
+
+# ------------------------------------------------------------------
+# Include replays
+#
+# What preprocessing an included file did, being the tokens it output and
+# the macros, #pragma once files and include guards it left, recorded with
+# everything which could have made it do otherwise: the macros it examined
+# before changing them, whether each file it included was in include_once
+# or had a known include guard, what each __has_include() found, and the
+# value of __COUNTER__ if it used it. Whenever all of those are the same
+# again, the file can be replayed instead of being preprocessed. The output
+# of each file included by one being recorded is kept as the IncludeReplay
+# of that file, rather than copied into it.
+# ------------------------------------------------------------------
+
+class IncludeReplay(object):
+    """What preprocessing a file did, and what that depended upon"""
+    def __init__(self):
+        self.deps = {}            # macro name => Macro, fingerprint of one or None if undefined, as first examined
+        self.has_includes = {}    # (name as written, path searched) => whether __has_include() found it
+        self.includes = {}        # path of a file #included => (whether in include_once, its include guard if known)
+        self.counter = None       # the value of __COUNTER__ it started from, if it used it
+        self.counted = 0          # how many times it used __COUNTER__
+        self.line = (0, 0)        # (linemacrodepth, linemacro) it started from, which decide __LINE__ if left stuck
+        self.line_left = None     # (linemacrodepth, linemacro) it left, if it changed them
+        self.output = []          # tokens output, and the IncludeReplay of each file included in between
+        self.macros = {}          # macro name => Macro left defined, or None if left undefined
+        self.include_once = {}    # entries it added to include_once
+        self.include_guards = {}  # entries it added to include_guards
+        self.include_times = []   # (included_path, included_abspath, depth) of it and each file it included
+        self.files = {}           # path of it and each file it included => (mtime, size)
+        self.probed = set()       # paths of the files looked for by #include or __has_include()
+        self.uncacheable = False  # whilst being recorded, whether anything happened which cannot be replayed
+
+    def tokens(self):
+        """Yields copies of the tokens output"""
+        stack = [iter(self.output)]
+        while stack:
+            for tok in stack[-1]:
+                if isinstance(tok, IncludeReplay):
+                    stack.append(iter(tok.output))
+                    break
+                yield tok.clone()
+            else:
+                stack.pop()
+
+    def consult(self, name, macros):
+        """Records the macro called name being examined, if it hasn't been or been changed already"""
+        if name not in self.deps and name not in self.macros:
+            self.deps[name] = macros.get(name)
+
+    def consult_all(self, deps):
+        """Records each macro in the dict deps of name => Macro or None being examined"""
+        for name, m in deps.items():
+            if name not in self.deps and name not in self.macros:
+                self.deps[name] = m
+
+    def consult_undefined(self, values):
+        """Records each identifier in the set of token values, none of which is a macro, being examined"""
+        self.deps.update(dict.fromkeys([x for x in values.difference(self.deps, self.macros) if x[:1].isidentifier()]))
+
+    def see_include(self, path, include_once, include_guards):
+        """Records whether the file at path was in include_once or guarded when #included"""
+        if path not in self.includes and path not in self.include_once and path not in self.include_guards:
+            self.includes[path] = (path in include_once, include_guards.get(path))
+
+    def merge(self, replay, output = True):
+        """Records the file replay is of being included, adding its output if output"""
+        self.consult_all(replay.deps)
+        for key, exists in replay.has_includes.items():
+            self.has_includes.setdefault(key, exists)
+        for path, seen in replay.includes.items():
+            if path not in self.includes and path not in self.include_once and path not in self.include_guards:
+                self.includes[path] = seen
+        # Which macros were changed is recorded, what they were changed to is found once done
+        self.macros.update(dict.fromkeys(replay.macros))
+        self.include_once.update(replay.include_once)
+        self.include_guards.update(replay.include_guards)
+        self.files.update(replay.files)
+        self.probed.update(replay.probed)
+        self.uncacheable = self.uncacheable or replay.uncacheable
+        if output:
+            self.output.append(replay)
+
+    def to_tuple(self):
+        """Returns this as a tuple which marshal can save"""
+        sources = {}
+        deps = dict([(name, m if m is None or isinstance(m, tuple) else _macro_fingerprint(m)) for name, m in self.deps.items()])
+        output = tuple([(tok.type, tok.value, tok.lineno, tok.lexpos, sources.setdefault(tok.source, len(sources))) for tok in self.tokens()])
+        macros = dict([(name, None if m is None else _saved_macro(m, sources)) for name, m in self.macros.items()])
+        return (deps, self.has_includes, self.includes, self.counter, self.counted, self.line, self.line_left, output, macros,
+                self.include_once, self.include_guards, tuple(self.include_times), self.files,
+                tuple([x[0] for x in sorted(sources.items(), key = lambda x: x[1])]), tuple(sorted(self.probed)))
+
+    @classmethod
+    def from_tuple(cls, saved):
+        """Returns the IncludeReplay saved by to_tuple()"""
+        ret = cls()
+        (ret.deps, ret.has_includes, ret.includes, ret.counter, ret.counted, ret.line, ret.line_left, output, macros,
+            ret.include_once, ret.include_guards, include_times, ret.files, sources, probed) = saved
+        ret.probed = set(probed)
+        ret.output = [Token(type, value, lineno, lexpos, sources[source]) for type, value, lineno, lexpos, source in output]
+        ret.macros = dict([(name, None if m is None else _loaded_macro(m, sources)) for name, m in macros.items()])
+        ret.include_times = list(include_times)
+        return ret
+
+class IncludeReplayCache(object):
+    """The IncludeReplay of included files, which may be shared between preprocessors,
+    and which are also saved to the directory path, if not None, for later runs.
+
+    Each file may have been preprocessed differently each time it was included, so
+    the max_replays most recently added IncludeReplay of it are kept."""
+    # Replays are saved with marshal, so only load into the same version of Python
+    _magic = b'PCPPREPLAY2 %d.%d marshal %d\n' % (sys.version_info[0], sys.version_info[1], marshal.version)
+
+    def __init__(self, path = None, max_replays = 4):
+        self.path = path
+        self.max_replays = max_replays
+        self.stats = collections.Counter()  # loads and writes of files in path
+        self.__replays = {}  # key => list of IncludeReplay, most recently added first
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the IncludeReplay for key, most recently added first"""
+        with self.__lock:
+            replays = self.__replays.get(key)
+        if replays is None:
+            replays = self.__load(key) if self.path is not None else []
+            with self.__lock:
+                replays = self.__replays.setdefault(key, replays)
+        return replays
+
+    def add(self, key, replay):
+        """Adds the IncludeReplay replay for key"""
+        with self.__lock:
+            replays = self.__replays[key] = [replay] + self.__replays.get(key, [])[:self.max_replays - 1]
+        if self.path is not None:
+            self.__save(key, replays)
+
+    def clear(self):
+        """Forgets every IncludeReplay, though not those saved"""
+        with self.__lock:
+            self.__replays.clear()
+
+    def __filename(self, key):
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode('utf-8', 'surrogatepass')).hexdigest() + '.replay')
+
+    def __load(self, key):
+        try:
+            with open(self.__filename(key), 'rb') as ih:
+                data = ih.read()
+            if not data.startswith(self._magic):
+                return []
+            saved_key, replays = marshal.loads(data[len(self._magic):])
+            if saved_key != key:
+                return []
+            replays = [IncludeReplay.from_tuple(x) for x in replays]
+        except (OSError, EOFError, ValueError, TypeError):
+            return []
+        self.stats['loads'] += 1
+        return replays
+
+    def __save(self, key, replays):
+        data = self._magic + marshal.dumps((key, [x.to_tuple() for x in replays]))
+        try:
+            os.makedirs(self.path, exist_ok = True)
+            fd, temp = tempfile.mkstemp(suffix = '.tmp', dir = self.path)
+            try:
+                with os.fdopen(fd, 'wb') as oh:
+                    oh.write(data)
+                os.replace(temp, self.__filename(key))
+            except BaseException:
+                os.remove(temp)
+                raise
+        except OSError:
+            # Replays which cannot be saved are merely not saved
+            return
+        self.stats['writes'] += 1
+
+# ------------------------------------------------------------------
+# Identifiers and functions of expressions
+#
+# What evalexpr() gives the Evaluator for the identifiers and functions
+# left in an expression once macros are expanded, which ask the hooks of
+# the preprocessor what each is.
+# ------------------------------------------------------------------
+
+class IndirectToMacroHook(object):
+    def __init__(self, p):
+        self.__preprocessor = p
+        self.partial_expansion = False
+    def __contains__(self, key):
+        return True
+    def __getitem__(self, key):
+        if key.startswith('defined('):
+            self.partial_expansion = True
+            return 0
+        repl = self.__preprocessor.on_unknown_macro_in_expr(key)
+        if repl is None:
+            self.partial_expansion = True
+            return key
+        return repl
+
+class IndirectToMacroFunctionHook(object):
+    def __init__(self, p, has_include):
+        self.__preprocessor = p
+        self.__has_include = has_include
+        self.partial_expansion = False
+    def __contains__(self, key):
+        return True
+    def __getitem__(self, key):
+        if not self.__preprocessor.passthru_expr_has_include and key == '__has_include':
+            return self.__has_include
+        repl = self.__preprocessor.on_unknown_macro_function_in_expr(key)
+        if repl is None:
+            self.partial_expansion = True
+            return key
+        return repl
+
 # ------------------------------------------------------------------
 # Preprocessor object
 #
@@ -49,6 +466,22 @@ class Preprocessor(PreprocessorHooks):
         if lexer is None:
             lexer = default_lexer()
         self.lexer = lexer
+        self.__lexers = []       # pool of lexer clones not currently in use
+        self.__hidesets = {}     # (hide-set, macro name) => hide-set with the macro name added
+        self.__expansions = collections.OrderedDict()  # (macro name, expanding_from) => cached expansion of an object like macro, least recently used first
+        self.__pasted = {}       # value of a token stitched by ## => tuple of (type, value) it lexes into
+        self.__invocations = collections.OrderedDict()  # (macro name, expanding_from, args) => cached expansion of a function like macro, least recently used first
+        self.__expansion_deps = []  # stack of {name: Macro or None} consulted by the expansions being cached
+        self.__uncacheable = 0   # incremented by anything making an expansion in progress uncacheable
+        self.__conditional_indexes = collections.OrderedDict()  # abssource => ConditionalIndex of its text, least recently used first
+        self.__disk_cache = None  # DiskLexedFileCache of cache_dir
+        self.__has_includes = {}  # (name as written, path searched) => whether __has_include() found it
+        self.__replay_frames = []  # IncludeReplay being recorded of each file being included, innermost last
+        self.include_cache = IncludeCache()  # where files to #include were found, which may be shared with other preprocessors
+        self.lexed_file_cache = LexedFileCache()  # files lexed, which may be shared with other preprocessors
+        self.include_replay_cache = None  # IncludeReplayCache to replay included files from, which may be shared with other preprocessors
+        self.vfs = VirtualFileSystem()  # the file system, with any archives or files in memory mounted in it
+        self.stats = collections.Counter()  # how often the preprocessor's fast paths and caches were used
         self.evaluator = Evaluator(self.lexer)
         self.macros = { }
         self.path = []           # list of -I formal search paths for includes
@@ -57,8 +490,10 @@ class Preprocessor(PreprocessorHooks):
         self.passthru_includes = None
         self.passthru_expr_has_include = False
         self.include_once = {}
+        self.include_guards = {}  # path of a file wholly within #ifndef MACRO ... #endif => MACRO
         self.include_depth = 0
         self.include_times = []  # list of FileInclusionTime
+        self.probed_paths = None  # if a set, the paths of every file looked for by #include or __has_include() are added to it
         self.return_code = 0
         self.debugout = None
         self.auto_pragma_once_enabled = True
@@ -67,11 +502,34 @@ class Preprocessor(PreprocessorHooks):
         self.compress = False
         self.assume_encoding = None
         self.enable_trigraphs = False
+        self.max_expansion_depth = None
+        self.cache_object_macros = True
+        self.object_macro_cache_size = 4096
+        self.macro_invocation_cache_size = 4096
+        self.lazy_macro_definitions = False
+        self.skip_disabled_regions = True
+        self.skip_guarded_includes = True
+        self.include_once_by_content = False  # whether files identical to one in include_once are skipped too
+        self.read_ahead_threads = 0       # how many threads to read files about to be #included with, if any
+        self.read_ahead_max_files = 32    # how many files read ahead may be kept open waiting to be #included
+        self.stream_block_size = 1 << 20  # how many characters of a file to read at a time
+        self.chunk_flush_size = 1 << 16   # how many tokens of text to gather before expanding them if possible
+        self.cache_dir = None             # directory in which to save lexed files for future runs
+        self.cache_dir_max_size = 1 << 28 # how many bytes of lexed files cache_dir may hold
+        self.dependencies_only = False    # whether to only execute directives, for finding the files included
 
         # Probe the lexer for selected tokens
         self.__lexprobe()
 
-        tm = time.localtime()
+        # As with reproducible builds, SOURCE_DATE_EPOCH fixes the date and time used
+        epoch = os.environ.get('SOURCE_DATE_EPOCH')
+        if epoch:
+            try:
+                tm = time.gmtime(int(epoch))
+            except (ValueError, OverflowError):
+                raise ValueError("SOURCE_DATE_EPOCH must be the number of seconds since 1970, not %r" % epoch)
+        else:
+            tm = time.localtime()
         self.define("__DATE__ \"%s\"" % time.strftime("%b %d %Y",tm))
         self.define("__TIME__ \"%s\"" % time.strftime("%H:%M:%S",tm))
         self.define("__PCPP__ 1")
@@ -82,12 +540,30 @@ class Preprocessor(PreprocessorHooks):
         self.linemacrodepth = 0
         self.countermacro = 0
         self.current_include_next_unique_ids = []
+        self.__once_ids = {}     # unique id of a file in include_once => its path
+        self.__guarded_newlines = {}  # path of a file in include_guards => how many newlines it outputs while its guard is defined
+        self.__once_contents = {}  # (size, digest of text) of a file in include_once => its path, if include_once_by_content
+        self.__once_sizes = set()  # sizes in __once_contents
+        self.__read_ahead = None  # IncludeReadAhead while parsing, if read_ahead_threads
+        self.__initial_macros = None  # fingerprints of the macros defined when parse() was first called, for save_state()
+        self.__replays_checked = set()  # IncludeReplay whose files were found unchanged
+        self.__passthru_outer = None  # dependencies_only outside the files being passed through, if in one
         self.parser = None
 
     @staticmethod
-    def __file_unique_id(fh):
-        s = os.stat(fh.fileno())
-        return s.st_ino ^ s.st_size
+    def __file_unique_id(fh, path):
+        # Returns ((st_dev, st_ino), st_size) of the open file fh, or of the file at
+        # path without opening it if fh is None, or path and None if it isn't a file
+        # of the file system
+        try:
+            s = os.stat(path) if fh is None else os.fstat(fh.fileno())
+        except (AttributeError, OSError, ValueError):
+            return path, None
+        return (s.st_dev, s.st_ino), s.st_size
+
+    @staticmethod
+    def __file_digest(text):
+        return hashlib.sha1(text.encode('utf-8', 'surrogatepass')).digest()
     
     # -----------------------------------------------------------------------------
     # tokenize()
@@ -102,6 +578,7 @@ class Preprocessor(PreprocessorHooks):
         while True:
             tok = self.lexer.token()
             if not tok: break
+            tok = as_token(tok)
             tok.source = ''
             tokens.append(tok)
         return tokens
@@ -230,7 +707,9 @@ class Preprocessor(PreprocessorHooks):
     # ----------------------------------------------------------------------
 
     def add_path(self,path):
-        """Adds a search path to the preprocessor. """
+        """Adds a search path to the preprocessor. A path of the form archive!/path within
+        it, such as sdk.zip!/include, searches within a zip or tar archive."""
+        self.vfs.mount_archive(path)
         self.path.append(path)
         # If the search path being added is relative, or has a common ancestor to the
         # current working directory, add a rewrite to relativise includes from this
@@ -242,6 +721,164 @@ class Preprocessor(PreprocessorHooks):
         if relpath is not None:
             self.rewrite_paths += [(re.escape(os.path.abspath(path) + os.sep) + '(.*)', os.path.join(relpath, '\\1'))]
 
+    # ----------------------------------------------------------------------
+    # prewarm_lexed_file_cache()
+    #
+    # Reads and lexes files into the cache of lexed files shared by every
+    # preprocessor, before anything includes them.
+    # ----------------------------------------------------------------------
+
+    def prewarm_lexed_file_cache(self, paths):
+        """Reads and lexes each of the files in paths into lexed_file_cache, so that no
+        preprocessor including them later need do so. Returns how many were cached, as
+        files which cannot be opened, or which are too big to cache, are passed over."""
+        cached = 0
+        for path in paths:
+            abspath = os.path.abspath(path)
+            try:
+                ih = self.on_file_open(False, abspath)
+            except IOError:
+                continue
+            try:
+                lexed = self.__lexed_file(ih, abspath)
+            finally:
+                ih.close()
+            if lexed is not None:
+                line = (None, 0, 1)
+                while line is not None:
+                    line = lexed.line(line[1], line[2])
+                cached += 1
+        return cached
+
+    def clear_lexed_file_cache(self):
+        """Removes every file from lexed_file_cache"""
+        if self.lexed_file_cache is not None:
+            self.lexed_file_cache.clear()
+
+    def lexed_file_cache_stats(self):
+        """Returns a dict of the hits, misses and evictions of lexed_file_cache since it
+        was created, and how many files it holds taking up roughly how many bytes"""
+        cache = self.lexed_file_cache
+        if cache is None:
+            return {}
+        stats = dict(cache.stats)
+        stats['files'] = len(cache)
+        stats['size'] = cache.size
+        return stats
+
+    # ----------------------------------------------------------------------
+    # save_state() and load_state()
+    #
+    # Saves the macros, #pragma once files, include guards and __COUNTER__
+    # left by preprocessing a set of headers, so that a later preprocessor can
+    # carry on from there without preprocessing them again, much like a
+    # precompiled header. The state is saved with marshal, so can only be
+    # loaded by the same version of Python. It records every file which was
+    # preprocessed, and the macros defined beforehand, and is only loaded if
+    # all of them are the same.
+    # ----------------------------------------------------------------------
+
+    _state_magic = b'PCPPSTATE3 %d.%d marshal %d\n' % (sys.version_info[0], sys.version_info[1], marshal.version)
+    # Macros which each preprocessor defines for itself
+    _unsaved_macros = ('__DATE__', '__TIME__', '__FILE__')
+
+    def __macro_fingerprints(self):
+        fingerprints = {}
+        for name, m in self.macros.items():
+            if name not in self._unsaved_macros:
+                fingerprints[name] = _macro_fingerprint(m)
+        return fingerprints
+
+    def save_state(self, path):
+        """Saves the state left by preprocessing so far to the file at path, for load_state()"""
+        files = []
+        for inclusion in self.include_times:
+            abspath = inclusion.included_abspath
+            if abspath is not None and abspath not in [x[0] for x in files]:
+                data = self.vfs.read(abspath)
+                files.append((abspath, self.vfs.mtime(abspath), len(data), hashlib.sha1(data).digest()))
+        # Only the macros which the files defined, redefined or undefined are saved
+        initial = self.__initial_macros if self.__initial_macros is not None else self.__macro_fingerprints()
+        sources = {}
+        macros = []
+        for name, m in self.macros.items():
+            if name not in self._unsaved_macros and initial.get(name) != _macro_fingerprint(m):
+                macros.append(_saved_macro(m, sources))
+        undefined = [name for name in initial if name not in self.macros]
+        # The files given to parse(), or those included by a string given to parse()
+        inputs = []
+        for inclusion in self.include_times:
+            if inclusion.depth == 0:
+                parent = inclusion.included_abspath
+            if inclusion.included_abspath is not None and (inclusion.depth == 0 or (inclusion.depth == 1 and parent is None)):
+                inputs.append(inclusion.included_abspath)
+        state = {
+            'inputs' : inputs,
+            'files' : files,
+            'initial' : initial,
+            'sources' : [x[0] for x in sorted(sources.items(), key = lambda x: x[1])],
+            'macros' : macros,
+            'undefined' : undefined,
+            'include_once' : self.include_once,
+            'include_guards' : self.include_guards,
+            'guarded_newlines' : self.__guarded_newlines,
+            'countermacro' : self.countermacro,
+        }
+        data = self._state_magic + marshal.dumps(state)
+        # Written under another name then renamed, so nothing ever loads half a file
+        temp = path + '.%d.tmp' % os.getpid()
+        with open(temp, 'wb') as oh:
+            oh.write(data)
+        os.replace(temp, path)
+
+    def load_state(self, path, rebuild = True):
+        """Loads the state saved by save_state() to the file at path, returning True if
+        it was loaded. If any file it was made from has changed since, or any macro
+        defined before them differs, it is not loaded, and if rebuild is true the files
+        it was made from are preprocessed instead, their output being discarded.
+
+        So the macros defined must be just those defined when the state was saved, so
+        it is loaded before defining any others or preprocessing anything else. Only
+        the macros which those files defined, redefined or undefined are changed."""
+        with open(path, 'rb') as ih:
+            data = ih.read()
+        if not data.startswith(self._state_magic):
+            raise ValueError("%s was not saved by save_state() of this version of Python" % path)
+        state = marshal.loads(data[len(self._state_magic):])
+        valid = state['initial'] == self.__macro_fingerprints()
+        for abspath, mtime, size, digest in (state['files'] if valid else ()):
+            try:
+                if self.vfs.mtime(abspath) == mtime and self.vfs.getsize(abspath) == size:
+                    continue
+                # Touched, but maybe not changed
+                data = self.vfs.read(abspath)
+            except OSError:
+                valid = False
+                break
+            if len(data) != size or hashlib.sha1(data).digest() != digest:
+                valid = False
+                break
+        if not valid:
+            self.stats['states_rebuilt'] += 1
+            if rebuild:
+                for abspath in state['inputs']:
+                    with self.on_file_open(False, abspath) as ih:
+                        self.parse(ih, abspath)
+                        while self.token() is not None:
+                            pass
+            return False
+        self.stats['states_loaded'] += 1
+        sources = state['sources']
+        for name in state['undefined']:
+            self.macros.pop(name, None)
+        for m in state['macros']:
+            self.macros[m[0]] = _loaded_macro(m, sources)
+        self.include_once.update(state['include_once'])
+        self.include_guards.update(state['include_guards'])
+        self.__guarded_newlines.update(state['guarded_newlines'])
+        self.countermacro = state['countermacro']
+        return True
+
 
     # ----------------------------------------------------------------------
     # group_lines()
@@ -255,31 +892,237 @@ class Preprocessor(PreprocessorHooks):
         r"""Given an input string, this function splits it into lines.  Trailing whitespace
         is removed. This function forms the lowest level of the preprocessor---grouping
         text into a line-by-line format.
-        """
-        lex = self.lexer.clone()
-        lines = [x.rstrip() for x in input.splitlines()]
 
-        input = "\n".join(lines)
-        lex.input(input)
-        lex.lineno = 1
+        input may also be a file like object, which is then read, decoded and lexed in
+        blocks of stream_block_size characters, with any trigraphs replaced if enabled.
+        Beyond a block, no more of it is held in memory at once than its longest
+        logical line.
 
-        current_line = []
-        while True:
-            tok = lex.token()
-            if not tok:
-                break
-            tok.source = abssource
-            current_line.append(tok)
-            if tok.type in self.t_WS and tok.value == '\n':
-                yield current_line
-                current_line = []
+        Sending True into the generator after it yields a line skips all the lines up
+        to the next one which could be a conditional directive ending the group that
+        line began, without lexing them. The generator then yields how many newlines
+        the skipped lines would have left behind once disabled, or zero if nothing
+        could be skipped, before carrying on as before.
+        """
+        if isinstance(input, LexedFile):
+            yield from self.__cached_lines(input, abssource, not self.dependencies_only)
+            return
+        if isinstance(input, STRING_TYPES):
+            blocks = [(input.splitlines(), True)]
+        else:
+            blocks = self.__read_lines(input)
+        held = []            # lines read but not lexed yet, as they may continue further on
+        whole = True         # whether all of the input is lexed at once
+        index = None         # ConditionalIndex of the text being lexed
+        indexed = None       # the text index is of
+        waiting = False      # whether waiting to read the end of a block comment
+        lex = self.__lexers.pop() if self.__lexers else self.lexer.clone()
+        try:
+            lex.lineno = 1
+            fast = isinstance(lex, FastLexer)
+
+            current_line = []
+            for lines, last in blocks:
+                held.extend([x.rstrip() for x in lines])
+                if waiting and not last and not any(['*/' in x for x in lines]):
+                    continue
+                waiting = False
+                if last:
+                    text = "\n".join(held)
+                    del held[:]
+                else:
+                    # The last line read, and any lines continued onto it, are held
+                    # back until it is known whether the next block continues them
+                    whole = False
+                    n = len(held) - 1
+                    while n > 0 and held[n-1].endswith('\\'):
+                        n -= 1
+                    if n <= 0:
+                        continue
+                    text = "\n".join(held[:n]) + "\n"
+                    del held[:n]
+                # A block comment not closed by the end of text might be closed later
+                opened = text.rfind('/*') if not last else -1
+                unclosed = opened >= 0 and text.find('*/', opened + 2) < 0
+                lex.input(text)
+                line_start = 0
+                line_lineno = lex.lineno
+                restart = True
+                while restart:
+                    restart = False
+                    # Tokens from any lexer other than our own need converting into Tokens
+                    for tok in (lex if fast else map(as_token, lex)):
+                        if unclosed and tok.value == '/' and text.startswith('*', tok.lexpos + 1):
+                            # Lex this line again once the comment is closed
+                            waiting = not any(['*/' in x for x in held])
+                            held[:0] = text[line_start:-1].split('\n')
+                            current_line = []
+                            lex.lineno = line_lineno
+                            break
+                        tok.source = abssource
+                        current_line.append(tok)
+                        if tok.type in self.t_WS and tok.value == '\n':
+                            skip = yield current_line
+                            current_line = []
+                            line_start = tok.lexpos + 1
+                            line_lineno = tok.lineno + 1
+                            if skip:
+                                skipped = None
+                                if fast:
+                                    if indexed is not text:
+                                        index = self.__conditional_index(text, whole, abssource)
+                                        indexed = text
+                                    skipped = self.__skip_lines(index, line_start, line_lineno, abssource)
+                                if skipped is not None:
+                                    # Restart lexing from the line skipped to
+                                    line_start, line_lineno, newlines = skipped
+                                    lex.lexpos, lex.lineno = line_start, line_lineno
+                                    restart = True
+                                    yield newlines
+                                    break
+                                yield 0
+        finally:
+            self.__lexers.append(lex)
 
         if current_line:
-            nltok = copy.copy(current_line[-1])
+            nltok = current_line[-1].clone()
             nltok.type = self.t_NEWLINE
             nltok.value = '\n'
             current_line.append(nltok)
-            yield current_line
+            if (yield current_line):
+                yield 0
+
+    def __cached_lines(self, lexed, abssource, blank = True):
+        # group_lines() for a LexedFile, whose tokens are copied as each line is reached,
+        # leaving out lines of nothing but a newline unless blank
+        pos, lineno = 0, 1
+        while True:
+            if not blank:
+                line = lexed.line(pos, lineno)
+                while line is not None and len(line[0]) == 1:
+                    pos, lineno = line[1], line[2]
+                    line = lexed.line(pos, lineno)
+            line = lexed.copy_line(pos, lineno, abssource)
+            if line is None:
+                return
+            tokens, pos, lineno = line
+            if (yield tokens):
+                skipped = self.__skip_lines(lexed.index, pos, lineno, abssource)
+                if skipped is not None:
+                    pos, lineno, newlines = skipped
+                    yield newlines
+                else:
+                    yield 0
+
+    def __streamed(self, ih):
+        # Whether the open file ih is big enough to be read as it is preprocessed
+        try:
+            return os.fstat(ih.fileno()).st_size > self.stream_block_size
+        except (AttributeError, OSError, ValueError):
+            return False
+
+    def __lexed_file(self, ih, abssource, minimised = False, data = None):
+        # Returns the LexedFile of the open file ih from lexed_file_cache, reading and
+        # lexing it if need be, or None if it isn't to be cached. If minimised, it is
+        # of only the directives of the file. data is the text of ih if already read.
+        cache = self.lexed_file_cache
+        if (cache is None and self.cache_dir is None) or not isinstance(self.lexer, FastLexer):
+            return None
+        try:
+            s = os.fstat(ih.fileno())
+        except (AttributeError, OSError, ValueError):
+            return None
+        if s.st_size > self.stream_block_size:
+            # Big files are better streamed, see __streamed()
+            return None
+        key = (abssource, s.st_mtime_ns, s.st_size, getattr(ih, 'encoding', None), self.enable_trigraphs, minimised)
+        lexed = cache.get(key) if cache is not None else None
+        if lexed is None:
+            if cache is not None:
+                self.stats['lexed_file_cache_misses'] += 1
+            if data is None:
+                data = ih.read()
+            if self.enable_trigraphs:
+                data = trigraph(data)
+            text = "\n".join([x.rstrip() for x in data.splitlines()])
+            if minimised:
+                text = minimised_source(text)
+            lexed = self.__saved_lexed_file(text) if self.cache_dir is not None else LexedFile(text)
+            if cache is not None:
+                cache.add(key, lexed)
+        else:
+            self.stats['lexed_file_cache_hits'] += 1
+        return lexed
+
+    def __saved_lexed_file(self, text):
+        # Returns the LexedFile of text saved in cache_dir, lexing and saving it if need be
+        store = self.__disk_cache
+        if store is None or store.path != self.cache_dir:
+            store = self.__disk_cache = DiskLexedFileCache(self.cache_dir)
+        store.max_size = self.cache_dir_max_size
+        key = store.key(text)
+        lexed = store.get(key)
+        if lexed is None:
+            self.stats['cache_dir_misses'] += 1
+            lexed = LexedFile(text)
+            store.add(key, lexed)
+        else:
+            self.stats['cache_dir_hits'] += 1
+        return lexed
+
+    def __read_lines(self, ih):
+        # Yields (lines, last) for each block read from ih, where lines are the lines
+        # the block completes, and last is True for the final block
+        size = self.stream_block_size
+        tail = ''
+        while True:
+            block = ih.read(size)
+            last = len(block) < size
+            data = tail + block
+            tail = ''
+            if not last:
+                # The last line may continue in the next block, even if it ends with '\r'
+                end = len(data) - 1 if data.endswith('\r') else len(data)
+                cut = max([data.rfind(c, 0, end) for c in _line_breaks]) + 1
+                tail = data[cut:]
+                data = data[:cut]
+            if self.enable_trigraphs:
+                data = trigraph(data)
+            yield data.splitlines(), last
+            if last:
+                return
+
+    def __conditional_index(self, text, whole, abssource):
+        # Only the index of a whole file is worth keeping for when it is included again,
+        # and only for the files most recently included
+        if not whole:
+            return ConditionalIndex(text)
+        indexes = self.__conditional_indexes
+        index = indexes.get(abssource)
+        if index is not None and index.text == text:
+            indexes.move_to_end(abssource)
+            self.stats['conditional_index_reuses'] += 1
+            return index
+        index = indexes[abssource] = ConditionalIndex(text)
+        while len(indexes) > 64:
+            indexes.popitem(last = False)
+        return index
+
+    def __skip_lines(self, index, pos, pos_lineno, abssource):
+        # Returns (lexpos, lineno, newlines) for skipping from pos, the end of a line, to
+        # the next line which could be a conditional directive, or None
+        lexpos, lineno, newlines, commented, comments = index.skip(pos, pos_lineno)
+        if lexpos == pos:
+            return None
+        if getattr(self.on_comment, '__func__', None) is not PreprocessorHooks.on_comment:
+            # Comments are removed from disabled lines, but on_comment() still gets to see them
+            commented = 0
+            for type, value, tok_lineno, tok_lexpos, counted in comments:
+                if not self.on_comment(Token(type, value, tok_lineno, tok_lexpos, abssource)) and counted:
+                    commented += 1
+        self.stats['disabled_regions_skipped'] += 1
+        self.stats['disabled_lines_skipped'] += lineno - pos_lineno
+        return lexpos, lineno, newlines + commented
 
     # ----------------------------------------------------------------------
     # tokenstrip()
@@ -316,7 +1159,7 @@ class Preprocessor(PreprocessorHooks):
     # define new arguments.
     # ----------------------------------------------------------------------
 
-    def collect_args(self,tokenlist,ignore_errors=False):
+    def collect_args(self,tokenlist,ignore_errors=False,start=0):
         """Collects comma separated arguments from a list of tokens.   The arguments
         must be enclosed in parenthesis.  Returns a tuple (tokencount,args,positions)
         where tokencount is the number of tokens consumed, args is a list of arguments,
@@ -327,29 +1170,31 @@ class Preprocessor(PreprocessorHooks):
         from each argument.  
         
         This function properly handles nested parenthesis and commas---these do not
-        define new arguments."""
+        define new arguments.
+
+        Collection begins at index start of tokenlist, to which tokencount and
+        positions are relative. tokenlist is only iterated, never sliced or indexed
+        beyond start, so it can also be a deque."""
         args = []
         positions = []
         current_arg = []
         nesting = 1
-        tokenlen = len(tokenlist)
+        toks = enumerate(itertools.islice(tokenlist, start, None))
     
         # Search for the opening '('.
-        i = 0
-        while (i < tokenlen) and (tokenlist[i].type in self.t_WS):
-            i += 1
+        t = None
+        for i, t in toks:
+            if t.type not in self.t_WS:
+                break
 
-        if (i < tokenlen) and (tokenlist[i].value == '('):
+        if t is not None and t.value == '(':
             positions.append(i+1)
         else:
             if not ignore_errors:
-                self.on_error(tokenlist[0].source,tokenlist[0].lineno,"Missing '(' in macro arguments")
+                self.on_error(tokenlist[start].source,tokenlist[start].lineno,"Missing '(' in macro arguments")
             return 0, [], []
 
-        i += 1
-
-        while i < tokenlen:
-            t = tokenlist[i]
+        for i, t in toks:
             if t.value == '(':
                 current_arg.append(t)
                 nesting += 1
@@ -366,7 +1211,6 @@ class Preprocessor(PreprocessorHooks):
                 current_arg = []
             else:
                 current_arg.append(t)
-            i += 1
     
         # Missing end argument
         if not ignore_errors:
@@ -388,6 +1232,7 @@ class Preprocessor(PreprocessorHooks):
         macro.patch     = []             # Standard macro arguments 
         macro.str_patch = []             # String conversion expansion
         macro.var_comma_patch = []       # Variadic macro comma patch
+        macro.template  = None           # Expansion template compiled from the above
         i = 0
         #print("BEFORE", macro.value)
         #print("BEFORE", [x.value for x in macro.value])
@@ -399,7 +1244,7 @@ class Preprocessor(PreprocessorHooks):
                 while j >= 0 and macro.value[j].type in self.t_WS:
                     j -= 1
                 if j >= 0 and macro.value[j].value == '#':
-                    macro.value[i] = copy.copy(macro.value[i])
+                    macro.value[i] = macro.value[i].clone()
                     macro.value[i].type = self.t_STRING
                     while i > j:
                         del macro.value[j]
@@ -441,15 +1286,20 @@ class Preprocessor(PreprocessorHooks):
         """Given a Macro and list of arguments (each a token list), this method
         returns an expanded version of a macro.  The return value is a token sequence
         representing the replacement macro tokens"""
-        # Make a copy of the macro token sequence
-        rep = [copy.copy(_x) for _x in macro.value]
+        return self.__run_expansion(self.__macro_expand_args(macro,args,expanding_from,0))
+
+    def __macro_expand_args(self,macro,args,expanding_from,depth):
+        template = macro.template
+        if template is None:
+            template = macro.template = self.__macro_template(macro)
+        expand_order, items = template
 
-        # Make string expansion patches.  These do not alter the length of the replacement sequence
+        # Make string expansion patches
         str_expansion = {}
         for argnum, i in macro.str_patch:
             if argnum not in str_expansion:
                 # Strip all non-space whitespace before stringization
-                tokens = copy.copy(args[argnum])
+                tokens = list(args[argnum])
                 for j in range(len(tokens)):
                     if tokens[j].type in self.t_WS and tokens[j].type != self.t_LINECONT:
                         tokens[j].value = ' '
@@ -463,185 +1313,446 @@ class Preprocessor(PreprocessorHooks):
                 str = "".join([x.value for x in tokens])
                 str = str.replace("\\","\\\\").replace('"', '\\"')
                 str_expansion[argnum] = '"' + str + '"'
-            rep[i] = copy.copy(rep[i])
-            rep[i].value = str_expansion[argnum]
-
-        # Make the variadic macro comma patch.  If the variadic macro argument is empty, we get rid
-        comma_patch = False
-        if macro.variadic and not args[-1]:
-            for i in macro.var_comma_patch:
-                rep[i] = None
-                comma_patch = True
-
-        # Make all other patches.   The order of these matters.  It is assumed that the patch list
-        # has been sorted in reverse order of patch location since replacements will cause the
-        # size of the replacement sequence to expand from the patch point.
-        
+
+        # Macro expand the arguments needing it, in the same order as they always have been
         expanded = { }
-        #print("***", macro)
-        #print(macro.patch)
+        for argnum in expand_order:
+            expanded[argnum] = yield list(args[argnum]), expanding_from, depth + 1
+
+        # If the variadic macro argument is empty, we get rid of the comma before ## __VA_ARGS__
+        comma_patch = macro.variadic and not args[-1]
+
+        # Fill in the template in a single pass
+        rep = []
+        for kind, x in items:
+            if kind == 'l':
+                rep.extend(map(_token_clone, x))
+            elif kind == 'e':
+                rep.extend(expanded[x])
+            elif kind == 't':
+                rep.extend(args[x])
+            elif kind == 's':
+                argnum, tok = x
+                tok = tok.clone()
+                tok.value = str_expansion[argnum]
+                rep.append(tok)
+            elif not comma_patch:
+                rep.append(x.clone())
+
+        # Arguments can contain ## too, so this has to look at the filled in template
+        if self.t_DPOUND in map(_token_type, rep):
+            rep = self.__paste_tokens(rep)
+
+        #print rep
+        return rep
+
+    # ----------------------------------------------------------------------
+    # __macro_template()
+    #
+    # Compiles the patch lists from macro_prescan() into an expansion template,
+    # a sequence of runs of literal tokens ('l'), arguments stringified ('s'),
+    # unexpanded ('t') and expanded ('e'), and variadic comma patches ('c'),
+    # together with the order in which the arguments are to be expanded.
+    # Templates are compiled the first time a macro is expanded.
+    # ----------------------------------------------------------------------
+
+    def __macro_template(self,macro):
+        slots = [None] * len(macro.value)
+        for argnum, i in macro.str_patch:
+            slots[i] = ('s', (argnum, macro.value[i]))
+        for i in macro.var_comma_patch:
+            slots[i] = ('c', macro.value[i])
+        expand_order = []
         for ptype, argnum, i in macro.patch:
-            #print([x.value for x in rep])
-            # Concatenation.   Argument is left unexpanded
-            if ptype == 't':
-                rep[i:i+1] = args[argnum]
-            # Normal expansion.  Argument is macro expanded first
-            elif ptype == 'e':
-                #print('*** Function macro arg', rep[i], 'replace with', args[argnum], 'which expands into', self.expand_macros(copy.copy(args[argnum])))
-                if argnum not in expanded:
-                    expanded[argnum] = self.expand_macros(copy.copy(args[argnum]), expanding_from)
-                rep[i:i+1] = expanded[argnum]
-
-        # Get rid of removed comma if necessary
-        if comma_patch:
-            rep = [_i for _i in rep if _i]
-            
-        # Do a token concatenation pass, stitching any tokens separated by ## into a single token
-        while len(rep) and rep[0].type == self.t_DPOUND:
-            del rep[0]
-        while len(rep) and rep[-1].type == self.t_DPOUND:
-            del rep[-1]
-        i = 1
+            slots[i] = (ptype, argnum)
+            if ptype == 'e' and argnum not in expand_order:
+                expand_order.append(argnum)
+        items = []
+        run = []
+        for tok, slot in zip(macro.value, slots):
+            if slot is None:
+                run.append(tok)
+            else:
+                if run:
+                    items.append(('l', run))
+                    run = []
+                items.append(slot)
+        if run:
+            items.append(('l', run))
+        return expand_order, items
+
+    # ----------------------------------------------------------------------
+    # __paste_tokens()
+    #
+    # Does a token concatenation pass, stitching any tokens separated by ##
+    # into a single token. The types of the stitched tokens are looked up by
+    # value in a table, which is filled by lexing any value not seen before.
+    # ----------------------------------------------------------------------
+
+    def __paste_tokens(self,rep):
+        t_DPOUND = self.t_DPOUND
+        first = 0
+        last = len(rep)
+        while first < last and rep[first].type == t_DPOUND:
+            first += 1
+        while last > first and rep[last-1].type == t_DPOUND:
+            last -= 1
+        out = []
         stitched = False
-        while i < len(rep) - 1:
-            if rep[i].type == self.t_DPOUND:
-                j = i + 1
-                while rep[j].type == self.t_DPOUND:
-                    j += 1
-                rep[i-1] = copy.copy(rep[i-1])
-                rep[i-1].type = None
-                rep[i-1].value += rep[j].value
-                while j >= i:
-                    del rep[i]
-                    j -= 1
+        i = first
+        while i < last:
+            tok = rep[i]
+            if tok.type == t_DPOUND:
+                i += 1
+                while rep[i].type == t_DPOUND:
+                    i += 1
+                left = out[-1]
+                if left.type is not None:
+                    left = out[-1] = left.clone()
+                    left.type = None
+                left.value += rep[i].value
                 stitched = True
             else:
-                i += 1
-        if stitched:
-            # Stitched tokens will have unknown type, so figure those out now
-            i = 0
-            lex = self.lexer.clone()
-            while i < len(rep):
-                if rep[i].type is None:
-                    lex.input(rep[i].value)
-                    toks = []
-                    while True:
-                        tok = lex.token()
-                        if not tok:
-                            break
-                        toks.append(tok)
-                    if len(toks) != 1:
-                        # Split it once again
-                        while len(toks) > 1:
-                            rep.insert(i+1, copy.copy(rep[i]))
-                            rep[i+1].value = toks[-1].value
-                            rep[i+1].type = toks[-1].type
-                            toks.pop()
-                        rep[i].value = toks[0].value
-                        rep[i].type = toks[0].type
-                    else:
-                        rep[i].type = toks[0].type
-                i += 1
-
-        #print rep
+                out.append(tok)
+            i += 1
+        if not stitched:
+            return out
+
+        # Stitched tokens will have unknown type, so figure those out now
+        pasted = self.__pasted
+        rep = []
+        for tok in out:
+            if tok.type is not None:
+                rep.append(tok)
+                continue
+            toks = pasted.get(tok.value)
+            if toks is None:
+                if len(pasted) >= 65536:
+                    pasted.clear()
+                lex = self.__lexers.pop() if self.__lexers else self.lexer.clone()
+                lex.input(tok.value)
+                toks = pasted[tok.value] = tuple([(x.type, x.value) for x in iter(lex.token, None)])
+                self.__lexers.append(lex)
+            if len(toks) == 1:
+                tok.type = toks[0][0]
+                rep.append(tok)
+            else:
+                # Split it once again
+                splits = []
+                for type, value in toks[1:]:
+                    split = tok.clone()
+                    split.type = type
+                    split.value = value
+                    splits.append(split)
+                tok.type, tok.value = toks[0]
+                rep.append(tok)
+                rep.extend(splits)
         return rep
 
+    # ----------------------------------------------------------------------
+    # __hideset_add()
+    #
+    # Adding a name to a hide-set is memoised, so the same history of macro
+    # expansions always produces the same hide-set object. Tokens which shared
+    # a hide-set before an expansion share one after it, as do the tokens of
+    # repeated expansions, and the cached members of hide-sets get reused.
+    # The memo is emptied once it holds too many, after which new hide-sets
+    # merely stop being shared with those made before.
+    # ----------------------------------------------------------------------
+
+    def __hideset_add(self,hideset,name):
+        key = (hideset, name)
+        ret = self.__hidesets.get(key)
+        if ret is None:
+            if len(self.__hidesets) >= 65536:
+                self.__hidesets.clear()
+            ret = self.__hidesets[key] = hideset.add(name)
+        return ret
+
+    # ----------------------------------------------------------------------
+    # __mark_expansion()
+    #
+    # Marks the tokens of the expansion of the macro named by token t as
+    # coming from t, and adds the macro to their hide-sets.
+    # ----------------------------------------------------------------------
+
+    def __mark_expansion(self,ex,t):
+        name = t.value
+        hidesets = self.__hidesets
+        for e in ex:
+            e.source = t.source
+            e.lineno = t.lineno
+            key = (e.hideset, name)
+            hideset = hidesets.get(key)
+            if hideset is None:
+                if len(hidesets) >= 65536:
+                    hidesets.clear()
+                hideset = hidesets[key] = e.hideset.add(name)
+            e.hideset = hideset
+
+    # ----------------------------------------------------------------------
+    # __run_expansion()
+    #
+    # Macro expansion does not recurse. The expansion of a macro's replacement
+    # list, and of each argument of a function like macro, happens in isolation
+    # in a nested expansion which the outer expansion asks for by yielding
+    # (tokens, expanding_from, depth), and whose result is sent back to it.
+    # This function runs the stack of these generators until the outermost one
+    # returns, so nesting depth is limited only by memory.
+    # ----------------------------------------------------------------------
+
+    def __run_expansion(self,expansion):
+        stack = [expansion]
+        result = None
+        recording = len(self.__expansion_deps)
+        try:
+            while True:
+                try:
+                    tokens, expanding_from, depth = stack[-1].send(result)
+                except StopIteration as e:
+                    stack.pop()
+                    if not stack:
+                        return e.value
+                    result = e.value
+                else:
+                    stack.append(self.__expand_macros(tokens, expanding_from, depth))
+                    result = None
+        finally:
+            # If an exception was thrown, forget about any expansions being cached
+            del self.__expansion_deps[recording:]
+
+    # ----------------------------------------------------------------------
+    # __cached_expansion() and __cache_expansion()
+    #
+    # The fully expanded replacement lists of object like macros are cached,
+    # as are those of function like macro invocations keyed additionally on
+    # the type, value and hide-set of each argument token. The latter cache
+    # is bounded, evicting the least recently used invocation.
+    # Whilst an expansion to be cached happens, each identifier it scans is
+    # recorded with the Macro it named at the time, or None. A cached expansion
+    # is only reused if all of those still name the same Macro, so defining,
+    # redefining or undefining any macro it depends on invalidates it. Each
+    # Macro object thus serves as its name's version. Expansions affected by
+    # __LINE__ or __COUNTER__, or which reported errors, are never cached.
+    # ----------------------------------------------------------------------
+
+    def __cached_expansion(self,cache,key,macro):
+        cached = cache.get(key)
+        if cached is None:
+            return None
+        m, deps, tokens, aliased = cached
+        if m is not macro:
+            return None
+        macros = self.macros
+        for name, dep in deps.items():
+            if macros.get(name) is not dep:
+                return None
+        if self.__expansion_deps:
+            self.__expansion_deps[-1].update(deps)
+        return self.__clone_tokens(tokens, aliased)
+
+    def __cache_expansion(self,cache,key,macro,deps,tokens):
+        # An argument used more than once in a function like macro puts the same
+        # token object into its expansion more than once, which must be preserved
+        aliased = len(set(map(id, tokens))) != len(tokens)
+        cache[key] = (macro, deps, self.__clone_tokens(tokens, aliased), aliased)
+
+    @staticmethod
+    def __clone_tokens(tokens,aliased):
+        if not aliased:
+            return [tok.clone() for tok in tokens]
+        clones = {}
+        ret = []
+        for tok in tokens:
+            clone = clones.get(id(tok))
+            if clone is None:
+                clone = clones[id(tok)] = tok.clone()
+            ret.append(clone)
+        return ret
 
     # ----------------------------------------------------------------------
     # expand_macros()
     #
     # Given a list of tokens, this function performs macro expansion.
+    #
+    # The tokens still to be scanned are held in a deque, with the expansion
+    # of each macro pushed back onto its front to be rescanned, and scanned
+    # tokens are appended to the output list. Each token is therefore moved
+    # a bounded number of times, rather than the rest of the line being
+    # shifted by every expansion. Tokens naming no macro at all are returned
+    # as they are, without being scanned.
     # ----------------------------------------------------------------------
 
-    def expand_macros(self,tokens,expanding_from=[]):
-        """Given a list of tokens, this function performs macro expansion."""
-        # Each token needs to track from which macros it has been expanded from to prevent recursion
-        for tok in tokens:
-            if not hasattr(tok, 'expanded_from'):
-                tok.expanded_from = []
-        i = 0
+    def expand_macros(self,tokens,expanding_from=empty_hideset):
+        """Given a list of tokens, this function performs macro expansion.
+        expanding_from is the HideSet of the macros currently being expanded.
+        Returns a new list of tokens."""
+        # Most lines of real code name no macros, and those need no expansion at all
+        self.stats['expand_macros_calls'] += 1
+        if not self.__expansion_deps:
+            values = set(map(_token_value, tokens))
+            if (self.macros.keys().isdisjoint(values)
+                    and not (self.expand_linemacro and '__LINE__' in values)
+                    and not (self.expand_countermacro and '__COUNTER__' in values)):
+                self.stats['expand_macros_without_macros'] += 1
+                if self.__replay_frames:
+                    self.__replay_frames[-1].consult_undefined(values)
+                return list(tokens)
+        # Each token tracks in its hide-set from which macros it has been expanded from to prevent recursion
+        if not isinstance(expanding_from, HideSet):
+            hideset = empty_hideset
+            for name in expanding_from:
+                hideset = hideset.add(name)
+            expanding_from = hideset
+        if not self.__replay_frames or self.__expansion_deps:
+            return self.__run_expansion(self.__expand_macros(tokens, expanding_from, 0))
+        # The macros examined are recorded just as for an expansion being cached
+        self.__expansion_deps.append({})
+        try:
+            return self.__run_expansion(self.__expand_macros(tokens, expanding_from, 0))
+        finally:
+            self.__replay_frames[-1].consult_all(self.__expansion_deps.pop())
+
+    def __expand_macros(self,tokens,expanding_from,depth):
+        pending = collections.deque(tokens)
+        out = []
         #print("*** EXPAND MACROS in", "".join([t.value for t in tokens]), "expanding_from=", expanding_from)
         #print(tokens)
-        #print([(t.value, t.expanded_from) for t in tokens])
-        while i < len(tokens):
-            t = tokens[i]
+        #print([(t.value, t.hideset) for t in tokens])
+        while pending:
+            t = pending[0]
             if self.linemacrodepth == 0:
                 self.linemacro = t.lineno
             self.linemacrodepth = self.linemacrodepth + 1
             if t.type == self.t_ID:
-                if t.value in self.macros and t.value not in t.expanded_from and t.value not in expanding_from:
+                if self.__expansion_deps:
+                    self.__expansion_deps[-1][t.value] = self.macros.get(t.value)
+                if t.value in self.macros and t.value not in t.hideset and t.value not in expanding_from:
                     # Yes, we found a macro match
                     m = self.macros[t.value]
-                    if m.arglist is None:
+                    if self.max_expansion_depth is not None and depth >= self.max_expansion_depth:
+                        self.on_error(t.source,t.lineno,"Macro %s not expanded as it would exceed the maximum macro expansion depth of %d" % (t.value, self.max_expansion_depth))
+                        # Also prevent its expansion when rescanned by the expansions enclosing this one
+                        t.hideset = self.__hideset_add(t.hideset, t.value)
+                        out.append(pending.popleft())
+                        self.__uncacheable += 1
+                    elif m.arglist is None:
                         # A simple macro
-                        rep = [copy.copy(_x) for _x in m.value]
-                        ex = self.expand_macros(rep, expanding_from + [t.value])
-                        #print("\nExpanding macro", m, "\ninto", ex, "\nreplacing", tokens[i:i+1])
-                        for e in ex:
-                            e.source = t.source
-                            e.lineno = t.lineno
-                            if not hasattr(e, 'expanded_from'):
-                                e.expanded_from = []
-                            e.expanded_from.append(t.value)
-                        tokens[i:i+1] = ex
+                        ex = key = None
+                        if self.cache_object_macros:
+                            key = (t.value, expanding_from) if self.max_expansion_depth is None else (t.value, expanding_from, depth)
+                            ex = self.__cached_expansion(self.__expansions, key, m)
+                            if ex is not None:
+                                self.__expansions.move_to_end(key)
+                                self.stats['object_macro_cache_hits'] += 1
+                            else:
+                                self.stats['object_macro_cache_misses'] += 1
+                        if ex is None:
+                            rep = [_x.clone() for _x in m.value]
+                            if key is None:
+                                ex = yield rep, self.__hideset_add(expanding_from, t.value), depth + 1
+                            else:
+                                uncacheable = self.__uncacheable
+                                self.__expansion_deps.append({})
+                                ex = yield rep, self.__hideset_add(expanding_from, t.value), depth + 1
+                                deps = self.__expansion_deps.pop()
+                                if self.__expansion_deps:
+                                    self.__expansion_deps[-1].update(deps)
+                                if uncacheable == self.__uncacheable:
+                                    self.__cache_expansion(self.__expansions, key, m, deps, ex)
+                                    while len(self.__expansions) > self.object_macro_cache_size:
+                                        self.__expansions.popitem(last = False)
+                                        self.stats['object_macro_cache_evictions'] += 1
+                        #print("\nExpanding macro", m, "\ninto", ex, "\nreplacing", t)
+                        self.__mark_expansion(ex, t)
+                        pending.popleft()
+                        pending.extendleft(reversed(ex))
                     else:
                         # A macro with arguments
-                        j = i + 1
-                        while j < len(tokens) and (tokens[j].type in self.t_WS or tokens[j].type in self.t_COMMENT):
+                        j = 1
+                        while j < len(pending) and (pending[j].type in self.t_WS or pending[j].type in self.t_COMMENT):
                             j += 1
                         # A function like macro without an invocation list is to be ignored
-                        if j == len(tokens) or tokens[j].value != '(':
-                            i = j
+                        if j == len(pending) or pending[j].value != '(':
+                            for n in range(j):
+                                out.append(pending.popleft())
                         else:
-                            tokcount,args,positions = self.collect_args(tokens[j:], True)
+                            tokcount,args,positions = self.collect_args(pending, True, j)
                             if tokcount == 0:
                                 # Unclosed parameter list, just bail out
+                                self.__uncacheable += 1
                                 break
                             if (not m.variadic
                                 # A no arg or single arg consuming macro is permitted to be expanded with nothing
                                 and (args != [[]] or len(m.arglist) > 1)
                                 and len(args) !=  len(m.arglist)):
                                 self.on_error(t.source,t.lineno,"Macro %s requires %d arguments but was passed %d" % (t.value,len(m.arglist),len(args)))
-                                i = j + tokcount
+                                self.__uncacheable += 1
+                                for n in range(j + tokcount):
+                                    out.append(pending.popleft())
                             elif m.variadic and len(args) < len(m.arglist)-1:
                                 if len(m.arglist) > 2:
                                     self.on_error(t.source,t.lineno,"Macro %s must have at least %d arguments" % (t.value, len(m.arglist)-1))
                                 else:
                                     self.on_error(t.source,t.lineno,"Macro %s must have at least %d argument" % (t.value, len(m.arglist)-1))
-                                i = j + tokcount
+                                self.__uncacheable += 1
+                                for n in range(j + tokcount):
+                                    out.append(pending.popleft())
                             else:
                                 if m.variadic:
                                     if len(args) == len(m.arglist)-1:
                                         args.append([])
                                     else:
-                                        args[len(m.arglist)-1] = tokens[j+positions[len(m.arglist)-1]:j+tokcount-1]
+                                        args[len(m.arglist)-1] = list(itertools.islice(pending, j+positions[len(m.arglist)-1], j+tokcount-1))
                                         del args[len(m.arglist):]
                                 else:
                                     # If we called a single arg macro with empty, fake extend args
                                     while len(args) < len(m.arglist):
                                         args.append([])
                                         
-                                # Get macro replacement text
-                                rep = self.macro_expand_args(m, args, expanding_from)
-                                ex = self.expand_macros(rep, expanding_from + [t.value])
-                                for e in ex:
-                                    e.source = t.source
-                                    e.lineno = t.lineno
-                                    if not hasattr(e, 'expanded_from'):
-                                        e.expanded_from = []
-                                    e.expanded_from.append(t.value)
+                                ex = key = None
+                                invocations = self.__invocations
+                                if self.macro_invocation_cache_size:
+                                    key = (t.value, expanding_from, tuple([tuple([(a.type, a.value, a.hideset) for a in arg]) for arg in args]))
+                                    if self.max_expansion_depth is not None:
+                                        key += (depth,)
+                                    ex = self.__cached_expansion(invocations, key, m)
+                                    if ex is not None:
+                                        invocations.move_to_end(key)
+                                        self.stats['macro_invocation_cache_hits'] += 1
+                                    else:
+                                        self.stats['macro_invocation_cache_misses'] += 1
+                                if ex is None:
+                                    uncacheable = self.__uncacheable
+                                    if key is not None:
+                                        self.__expansion_deps.append({})
+                                    # Get macro replacement text
+                                    rep = yield from self.__macro_expand_args(m, args, expanding_from, depth)
+                                    ex = yield rep, self.__hideset_add(expanding_from, t.value), depth + 1
+                                    if key is not None:
+                                        deps = self.__expansion_deps.pop()
+                                        if self.__expansion_deps:
+                                            self.__expansion_deps[-1].update(deps)
+                                        if uncacheable == self.__uncacheable:
+                                            self.__cache_expansion(invocations, key, m, deps, ex)
+                                            while len(invocations) > self.macro_invocation_cache_size:
+                                                invocations.popitem(last = False)
+                                                self.stats['macro_invocation_cache_evictions'] += 1
+                                self.__mark_expansion(ex, t)
                                 # A non-conforming extension implemented by the GCC and clang preprocessors
                                 # is that an expansion of a macro with arguments where the following token is
                                 # an identifier inserts a space between the expansion and the identifier. This
                                 # differs from Boost.Wave incidentally (see https://github.com/ned14/pcpp/issues/29)
-                                if len(tokens) > j+tokcount and tokens[j+tokcount].type in self.t_ID:
-                                    #print("*** token after expansion is", tokens[j+tokcount])
-                                    newtok = copy.copy(tokens[j+tokcount])
+                                if len(pending) > j+tokcount and pending[j+tokcount].type in self.t_ID:
+                                    #print("*** token after expansion is", pending[j+tokcount])
+                                    newtok = pending[j+tokcount].clone()
                                     newtok.type = self.t_SPACE
                                     newtok.value = ' '
                                     ex.append(newtok)
-                                #print("\nExpanding macro", m, "\n\ninto", ex, "\n\nreplacing", tokens[i:j+tokcount])
-                                tokens[i:j+tokcount] = ex
+                                #print("\nExpanding macro", m, "\n\ninto", ex, "\n\nreplacing", list(itertools.islice(pending, 0, j+tokcount)))
+                                for n in range(j + tokcount):
+                                    pending.popleft()
+                                pending.extendleft(reversed(ex))
                     self.linemacrodepth = self.linemacrodepth - 1
                     if self.linemacrodepth == 0:
                         self.linemacro = 0
@@ -649,16 +1760,20 @@ class Preprocessor(PreprocessorHooks):
                 elif self.expand_linemacro and t.value == '__LINE__':
                     t.type = self.t_INTEGER
                     t.value = self.t_INTEGER_TYPE(self.linemacro)
+                    self.__uncacheable += 1
                 elif self.expand_countermacro and t.value == '__COUNTER__':
                     t.type = self.t_INTEGER
                     t.value = self.t_INTEGER_TYPE(self.countermacro)
                     self.countermacro += 1
+                    self.__uncacheable += 1
                 
-            i += 1
+            out.append(pending.popleft())
             self.linemacrodepth = self.linemacrodepth - 1
             if self.linemacrodepth == 0:
                 self.linemacro = 0
-        return tokens
+        # Anything left after an unclosed parameter list is passed through unexpanded
+        out.extend(pending)
+        return out
 
     # ----------------------------------------------------------------------    
     # evalexpr()
@@ -688,6 +1803,8 @@ class Preprocessor(PreprocessorHooks):
                             j += 1
                             continue
                         elif tokens[j].type == self.t_ID:
+                            if self.__replay_frames:
+                                self.__replay_frames[-1].consult(tokens[j].value, self.macros)
                             if tokens[j].value in self.macros:
                                 result = "1L"
                             elif not self.passthru_expr_has_include and tokens[j].value == '__has_include':
@@ -730,26 +1847,21 @@ class Preprocessor(PreprocessorHooks):
                     if tokens[i].type == self.t_ID and tokens[i].value == '__has_include':
                         j = i + 1
                         needparen = False
-                        bracketpos = -1
                         while j < len(tokens):
                             if tokens[j].type in self.t_WS:
                                 j += 1
                                 continue
-                            elif tokens[j].type == self.t_ID:
-                                assert bracketpos >= 0
-                                # Convert the <id> into a string
-                                tokens[j].type = self.t_STRING
-                                tokens[j].value = '"' + ''.join([tokens[x].value for x in range(bracketpos, j + 1)])
-                                del tokens[bracketpos:j]
-                                j = bracketpos
                             elif tokens[j].value == '<':
-                                bracketpos = j
-                            elif tokens[j].value == '>':
-                                assert bracketpos > 0
-                                tokens[bracketpos].value += ''.join([tokens[x].value for x in range(bracketpos + 1, j + 1)]) + '"'
-                                del tokens[bracketpos + 1:j + 1]
-                                j = bracketpos
-                                bracketpos = -1
+                                # Convert the <...> into a string, whatever is between the brackets
+                                k = j + 1
+                                while k < len(tokens) and tokens[k].value != '>':
+                                    k += 1
+                                if k == len(tokens):
+                                    self.on_error(tokens[i].source,tokens[i].lineno,"Malformed __has_include()")
+                                    break
+                                tokens[j].type = self.t_STRING
+                                tokens[j].value = '"' + ''.join([tokens[x].value for x in range(j, k + 1)]) + '"'
+                                del tokens[j + 1:k + 1]
                             elif tokens[j].value == '(':
                                 needparen = True
                             elif tokens[j].value == ')':
@@ -762,50 +1874,8 @@ class Preprocessor(PreprocessorHooks):
             tokens = replace_has_include(tokens)
         if not tokens:
             return (0, None)
-        class IndirectToMacroHook(object):
-            def __init__(self, p):
-                self.__preprocessor = p
-                self.partial_expansion = False
-            def __contains__(self, key):
-                return True
-            def __getitem__(self, key):
-                if key.startswith('defined('):
-                    self.partial_expansion = True
-                    return 0
-                repl = self.__preprocessor.on_unknown_macro_in_expr(key)
-                #print("*** IndirectToMacroHook[", key, "] returns", repl, file = sys.stderr)
-                if repl is None:
-                    self.partial_expansion = True
-                    return key
-                return repl
         evalvars = IndirectToMacroHook(self)
-        class IndirectToHasInclude(object):
-            def __init__(self, p):
-                self.__preprocessor = p
-            def __call__(self, x):
-                #print("*** has_include", x, file = sys.stderr)
-                if x.startswith('"<') and x.endswith('>"'):
-                    # Undo our special handling from earlier
-                    x = x[1:-1]
-                x = self.__preprocessor.tokenize(x)
-                exists = [ p for p in self.__preprocessor.include(x, x, include_exists_only=True) ]
-                return 1 if exists[0] else 0
-        class IndirectToMacroFunctionHook(object):
-            def __init__(self, p):
-                self.__preprocessor = p
-                self.partial_expansion = False
-            def __contains__(self, key):
-                return True
-            def __getitem__(self, key):
-                if not self.__preprocessor.passthru_expr_has_include and key == '__has_include':
-                    return IndirectToHasInclude(self.__preprocessor)
-                repl = self.__preprocessor.on_unknown_macro_function_in_expr(key)
-                #print("*** IndirectToMacroFunctionHook[", key, "] returns", repl, file = sys.stderr)
-                if repl is None:
-                    self.partial_expansion = True
-                    return key
-                return repl
-        evalfuncts = IndirectToMacroFunctionHook(self)
+        evalfuncts = IndirectToMacroFunctionHook(self, self.__has_include)
         try:
             result = self.evaluator(tokens, functions = evalfuncts, identifiers = evalvars).value()
             partial_expansion = partial_expansion or evalvars.partial_expansion or evalfuncts.partial_expansion
@@ -818,6 +1888,126 @@ class Preprocessor(PreprocessorHooks):
             result = 0
         return (result, tokens) if partial_expansion else (result, None)
 
+    # ----------------------------------------------------------------------
+    # __has_include()
+    #
+    # Evaluates __has_include(x), where x is the string literal of a
+    # "name" or the <name> converted into one by evalexpr(). Whether a name
+    # can be found only depends upon the path searched for it, so the answer
+    # is remembered for that path, up to 4096 answers at a time.
+    # ----------------------------------------------------------------------
+
+    def __has_include(self,x):
+        if x.startswith('"<') and x.endswith('>"'):
+            # Undo our special handling from evalexpr()
+            x = x[1:-1]
+            path = self.path
+        else:
+            path = self.temp_path + self.path
+        key = (x, tuple(path))
+        if len(x) >= 3 and (x[0], x[-1]) in (('"', '"'), ('<', '>')):
+            self.__probe(path or [''], x[1:-1])
+        exists = self.__has_include_on(key)
+        if exists is None:
+            # Not a "name" nor a <name>, so left to include() to make sense of
+            tokens = self.tokenize(x)
+            exists = next(self.include(tokens, tokens, include_exists_only=True))
+            self.__remember_has_include(key, exists)
+            self.__cannot_replay()
+        elif self.__replay_frames:
+            self.__replay_frames[-1].has_includes.setdefault(key, exists)
+        return 1 if exists else 0
+
+    def __has_include_on(self,key):
+        # Whether the "name" or <name> x was found searching path for key (x, path),
+        # looking for it if not known, or None if x is neither
+        if self.include_cache is None or not self.include_cache.validate:
+            exists = self.__has_includes.get(key)
+            if exists is not None:
+                self.stats['has_include_cache_hits'] += 1
+                return exists
+        # Files may come and go if the include cache is validated, so look every time
+        self.stats['has_include_cache_misses'] += 1
+        x, path = key
+        if len(x) < 3 or (x[0], x[-1]) not in (('"', '"'), ('<', '>')):
+            return None
+        is_system_include = x[0] == '<'
+        fullinames = self.__include_candidates(list(path) or [''], x[1:-1], is_system_include)
+        self.stats['include_probes_avoided'] += max(len(path), 1) - len(fullinames)
+        exists = False
+        for fulliname in fullinames:
+            try:
+                self.on_file_open(is_system_include, fulliname).close()
+            except IOError:
+                continue
+            exists = True
+            break
+        self.__remember_has_include(key, exists)
+        return exists
+
+    def __remember_has_include(self,key,exists):
+        # Only so many answers are remembered, as every search path makes for more
+        if len(self.__has_includes) >= 4096:
+            self.__has_includes.clear()
+        self.__has_includes[key] = exists
+
+    def clear_include_caches(self):
+        """Forgets where files to #include were found, and what __has_include()
+        evaluated to, for after files have been added or removed"""
+        self.__has_includes.clear()
+        self.__replays_checked.clear()
+        if self.include_cache is not None:
+            self.include_cache.clear()
+
+    # ----------------------------------------------------------------------
+    # __guard_macro()
+    #
+    # The macro named by a directive which could be the start of an include
+    # guard, being #ifndef MACRO, #if !defined MACRO or #if !defined(MACRO)
+    # with nothing else in the expression, else None.
+    # ----------------------------------------------------------------------
+
+    def __guard_macro(self,name,args):
+        args = [tok for tok in args if tok.type not in self.t_WS]
+        if name == 'if' and [tok.value for tok in args[:2]] == ['!', 'defined']:
+            if len(args) == 5 and args[2].value == '(' and args[4].value == ')':
+                args = args[3:4]
+            else:
+                args = args[2:]
+        elif name != 'ifndef':
+            return None
+        if len(args) == 1 and args[0].type == self.t_ID and args[0].value != '__has_include':
+            return args[0].value
+        return None
+
+    # ----------------------------------------------------------------------
+    # __chunk_complete()
+    #
+    # Whether the lines of text gathered so far can be expanded without the
+    # line x which follows them, as no macro invocation could continue onto
+    # it. That is so if every '(' gathered is closed, and x doesn't start with
+    # a '(' which could follow the name of a function like macro.
+    # ----------------------------------------------------------------------
+
+    def __chunk_complete(self, chunk, x):
+        for tok in x:
+            if tok.type not in self.t_WS:
+                if tok.value == '(' or tok.type in self.t_COMMENT:
+                    return False
+                break
+        else:
+            return False
+        closes = 0
+        for tok in reversed(chunk):
+            value = tok.value
+            if value == ')':
+                closes += 1
+            elif value == '(':
+                if not closes:
+                    return False
+                closes -= 1
+        return True
+
     # ----------------------------------------------------------------------
     # parsegen()
     #
@@ -836,8 +2026,15 @@ class Preprocessor(PreprocessorHooks):
                         rewritten_source = rewritten_source.replace(os.sep, '/')
                     break
 
-        # Replace trigraph sequences
-        t = trigraph(input) if self.enable_trigraphs else input
+        if abssource and isinstance(input, FILE_TYPES):
+            input = self.__lexed_file(input, abssource, self.dependencies_only) or input
+        if self.read_ahead_threads:
+            if isinstance(input, LexedFile):
+                self.__read_ahead_includes(input.text)
+            elif isinstance(input, STRING_TYPES):
+                self.__read_ahead_includes(input)
+        # Replace trigraph sequences, which for a file is done as it is read
+        t = trigraph(input) if self.enable_trigraphs and isinstance(input, STRING_TYPES) else input
         lines = self.group_lines(t, rewritten_source)
 
         if not source:
@@ -854,6 +2051,7 @@ class Preprocessor(PreprocessorHooks):
 
         self.source = abssource
         chunk = []
+        flush_at = self.chunk_flush_size
         enable = True
         iftrigger = False
         ifpassthru = False
@@ -872,10 +2070,16 @@ class Preprocessor(PreprocessorHooks):
         # =(MACRO, 0) means #ifndef MACRO or #if !defined(MACRO) seen, =(MACRO,1) means #define MACRO seen
         include_guard = None
         self.on_potential_include_guard(None)
+        # For skipping later includes of this file while its include guard is defined, whatever
+        # include_guard above makes of it: 0 until anything but whitespace or comments not
+        # kept is seen, 1 within the guarding group, 2 after it, or -1 if anything else was seen
+        guard_state = 0
+        guard_macro = None
 
         for x in lines:
             all_whitespace = True
             skip_auto_pragma_once_possible_check = False
+            comment_kept = False
             # Handle comments
             for i,tok in enumerate(x):
                 if tok.type in self.t_COMMENT:
@@ -885,6 +2089,8 @@ class Preprocessor(PreprocessorHooks):
                         elif tok.type == self.t_COMMENT2:
                             tok.value = '\n'
                         tok.type = 'CPP_WS'
+                    else:
+                        comment_kept = True
             # Skip over whitespace
             for i,tok in enumerate(x):
                 if tok.type not in self.t_WS and tok.type not in self.t_COMMENT:
@@ -910,6 +2116,10 @@ class Preprocessor(PreprocessorHooks):
                             print("%d:%d:%d %s:%d #%s %s" % (enable, iftrigger, ifpassthru, dirtokens[0].source, dirtokens[0].lineno, dirtokens[0].value, "".join([tok.value for tok in args])), file = self.debugout)
                             #print(ifstack)
 
+                        if guard_state == 0 and not ifstack:
+                            guard_macro = self.__guard_macro(name, args)
+                        elif guard_state == 1 and len(ifstack) == 1 and name in ('elif', 'else'):
+                            guard_state = -1
                         handling = self.on_directive_handle(dirtokens[0],args,ifpassthru,precedingtoks)
                         assert handling == True or handling == None
                     else:
@@ -965,6 +2175,8 @@ class Preprocessor(PreprocessorHooks):
                         ifstack.append(ifstackentry(enable,iftrigger,ifpassthru,x))
                         if enable:
                             ifpassthru = False
+                            if self.__replay_frames:
+                                self.__replay_frames[-1].consult(args[0].value, self.macros)
                             if not args[0].value in self.macros and (self.passthru_expr_has_include or args[0].value != '__has_include'):
                                 res = self.on_unknown_macro_in_defined_expr(args[0])
                                 if res is None:
@@ -986,6 +2198,8 @@ class Preprocessor(PreprocessorHooks):
                         ifstack.append(ifstackentry(enable,iftrigger,ifpassthru,x))
                         if enable:
                             ifpassthru = False
+                            if self.__replay_frames:
+                                self.__replay_frames[-1].consult(args[0].value, self.macros)
                             if args[0].value in self.macros or (not self.passthru_expr_has_include and args[0].value == '__has_include'):
                                 enable = False
                                 iftrigger = False
@@ -1015,7 +2229,7 @@ class Preprocessor(PreprocessorHooks):
                             result, rewritten = self.evalexpr(args)
                             if rewritten is not None:
                                 x = x[:i+2] + rewritten + [x[-1]]
-                                x[i+1] = copy.copy(x[i+1])
+                                x[i+1] = x[i+1].clone()
                                 x[i+1].type = self.t_SPACE
                                 x[i+1].value = ' '
                                 ifpassthru = True
@@ -1039,7 +2253,7 @@ class Preprocessor(PreprocessorHooks):
                                             # This is a passthru #elif after a False #if, so convert to an #if
                                             x[i].value = 'if'
                                         x = x[:i+2] + rewritten + [x[-1]]
-                                        x[i+1] = copy.copy(x[i+1])
+                                        x[i+1] = x[i+1].clone()
                                         x[i+1].type = self.t_SPACE
                                         x[i+1].value = ' '
                                         ifpassthru = True
@@ -1048,7 +2262,7 @@ class Preprocessor(PreprocessorHooks):
                                     if ifpassthru:
                                         # If this elif can only ever be true, simulate that
                                         if result:
-                                            newtok = copy.copy(x[i+3])
+                                            newtok = x[i+3].clone()
                                             newtok.type = self.t_INTEGER
                                             newtok.value = self.t_INTEGER_TYPE(result)
                                             x = x[:i+2] + [newtok] + [x[-1]]
@@ -1094,8 +2308,13 @@ class Preprocessor(PreprocessorHooks):
                     elif name == 'pragma' and args[0].value == 'once':
                         if enable:
                             self.include_once[self.source] = None
+                            if self.__replay_frames:
+                                self.__replay_frames[-1].include_once[self.source] = None
                     elif enable:
                         # Unknown preprocessor directive
+                        if name in ('error', 'warning'):
+                            # Which must be reported every time
+                            self.__cannot_replay()
                         output_unexpanded_line = (self.on_directive_unknown(dirtokens[0], args, ifpassthru, precedingtoks) is None)
 
                 except OutputDirective as e:
@@ -1106,6 +2325,14 @@ class Preprocessor(PreprocessorHooks):
                     else:
                         assert False
 
+            # A comment kept outside the guarding group is output even while the guard is defined
+            if not all_whitespace or comment_kept:
+                if guard_state == 0:
+                    guard_state = 1 if guard_macro is not None and ifstack else -1
+                elif guard_state == 1 and not ifstack:
+                    guard_state = 2
+                elif guard_state == 2:
+                    guard_state = -1
             # If there is ever any non-whitespace output outside an include guard, auto pragma once is not possible
             if not skip_auto_pragma_once_possible_check and auto_pragma_once_possible and not ifstack and not all_whitespace:
                 auto_pragma_once_possible = False
@@ -1116,9 +2343,21 @@ class Preprocessor(PreprocessorHooks):
                 if not all_whitespace:
                     at_front_of_file = False
 
+                if self.dependencies_only:
+                    # Text is neither expanded nor output
+                    pass
                 # Normal text
-                if enable:
+                elif enable:
                     if output_and_expand_line:
+                        if len(chunk) >= flush_at:
+                            # Don't let a long run of lines without directives pile up
+                            if self.__chunk_complete(chunk, x):
+                                for tok in self.expand_macros(chunk):
+                                    yield tok
+                                chunk = []
+                                flush_at = self.chunk_flush_size
+                            elif not all_whitespace:
+                                flush_at = 2 * len(chunk)
                         chunk.extend(x)
                     elif output_unexpanded_line:
                         for tok in self.expand_macros(chunk):
@@ -1136,6 +2375,12 @@ class Preprocessor(PreprocessorHooks):
                             i += 1
                     chunk.extend(x)
 
+            if not enable and not ifpassthru and self.skip_disabled_regions:
+                # Skip the rest of this disabled group without lexing it
+                newlines = lines.send(True)
+                if newlines:
+                    chunk.append(Token(self.t_NEWLINE, '\n' * newlines, x[-1].lineno + 1, x[-1].lexpos + 1, x[-1].source))
+
         for tok in self.expand_macros(chunk):
             yield tok
         chunk = []
@@ -1145,12 +2390,20 @@ class Preprocessor(PreprocessorHooks):
             if self.debugout is not None:
                 print("%d:%d:%d %s:%d Determined that #include \"%s\" is entirely wrapped in an include guard macro called %s, auto-applying #pragma once" % (enable, iftrigger, ifpassthru, self.source, 0, self.source, include_guard[0]), file = self.debugout)
             self.include_once[self.source] = include_guard[0]
+            if self.__replay_frames:
+                self.__replay_frames[-1].include_once[self.source] = include_guard[0]
         elif self.auto_pragma_once_enabled and self.source not in self.include_once:
             if self.debugout is not None:
                 print("%d:%d:%d %s:%d Did not auto apply #pragma once to this file due to auto_pragma_once_possible=%d, include_guard=%s" % (enable, iftrigger, ifpassthru, self.source, 0, auto_pragma_once_possible, repr(include_guard)), file = self.debugout)
+        if guard_state == 2 and abssource is not None:
+            self.include_guards[abssource] = guard_macro
+            if self.__replay_frames:
+                self.__replay_frames[-1].include_guards[abssource] = guard_macro
         my_include_time_end = clock()
         self.include_times[my_include_times_idx].elapsed = my_include_time_end - my_include_time_begin
         self.include_depth -= 1
+        if self.include_depth == 0:
+            self.__close_read_ahead()
 
     # ----------------------------------------------------------------------
     # include()
@@ -1163,6 +2416,9 @@ class Preprocessor(PreprocessorHooks):
         # Try to extract the filename and then process an include file
         if not tokens:
             return
+        if include_next_is_active and not include_exists_only:
+            # Where it finds a file depends upon more than where it is
+            self.__cannot_replay()
         if tokens:
             if tokens[0].value != '<' and tokens[0].type != self.t_STRING:
                 tokens = self.tokenstrip(self.expand_macros(tokens))
@@ -1177,6 +2433,7 @@ class Preprocessor(PreprocessorHooks):
                         break
                     i += 1
                 else:
+                    self.__cannot_replay()
                     self.on_error(tokens[0].source,tokens[0].lineno,"Malformed #include <...>")
                     return
                 filename = "".join([x.value for x in tokens[1:i]])
@@ -1191,6 +2448,7 @@ class Preprocessor(PreprocessorHooks):
                 # Search from each nested include file, as well as formally specified paths
                 path = self.temp_path + self.path
             else:
+                self.__cannot_replay()
                 p = self.on_include_not_found(True,False,self.temp_path[0] if self.temp_path else '',tokens[0].value)
                 assert p is None
                 return
@@ -1198,9 +2456,12 @@ class Preprocessor(PreprocessorHooks):
             path = ['']
         while True:
             #print path
-            for p in path:
-                iname = os.path.join(p,filename)
-                fulliname = os.path.abspath(iname)
+            fullinames = self.__include_candidates(path,filename,is_system_include)
+            self.stats['include_probes_avoided'] += len(path) - len(fullinames)
+            self.__probe(path,filename)
+            for fulliname in fullinames:
+                if not include_exists_only and self.__replay_frames:
+                    self.__replay_frames[-1].see_include(fulliname, self.include_once, self.include_guards)
                 if not include_exists_only and fulliname in self.include_once:
                     if self.debugout is not None:
                         print("x:x:x x:x #include \"%s\" skipped as already seen" % (fulliname), file = self.debugout)
@@ -1208,44 +2469,359 @@ class Preprocessor(PreprocessorHooks):
                         for tok in original_line:
                             yield tok
                     return
+                guard_macro = self.include_guards.get(fulliname) if self.skip_guarded_includes else None
+                if guard_macro is not None and self.__replay_frames:
+                    self.__replay_frames[-1].consult(guard_macro, self.macros)
+                guarded = not include_exists_only and guard_macro is not None and guard_macro in self.macros
+                passthru = self.passthru_includes is not None and self.passthru_includes.match(''.join([x.value for x in tokens]))
+                newlines = None
+                if guarded:
+                    # Only the newlines the file outputs while its guard is defined would be
+                    # output, which once counted leave no need to open it
+                    newlines = 0 if passthru or self.dependencies_only or fulliname in self.include_once else self.__guarded_newlines.get(fulliname)
+                if newlines is not None:
+                    self.stats['guarded_include_opens_avoided'] += 1
+                    if self.debugout is not None:
+                        print("x:x:x x:x #include \"%s\" skipped as include guard macro %s is defined" % (fulliname, guard_macro), file = self.debugout)
+                    if passthru:
+                        for tok in original_line:
+                            yield tok
+                    elif newlines:
+                        yield Token(self.t_NEWLINE, '\n' * newlines, 1, 0, fulliname)
+                    return
                 try:
-                    ih = self.on_file_open(is_system_include,fulliname)
+                    ih = text = None
+                    if self.__read_ahead is not None and not include_exists_only:
+                        ih, text = self.__read_ahead.open(is_system_include,fulliname) or (None, None)
+                    if ih is None:
+                        ih = self.on_file_open(is_system_include,fulliname)
                     if include_exists_only:
                         ih.close()
                         yield True
                         return
-                    unique_id = self.__file_unique_id(ih)
+                    unique_id, size = self.__file_unique_id(ih, fulliname)
                     if include_next_is_active and unique_id in self.current_include_next_unique_ids:
                         ih.close()
                         continue
-                    data = ih.read()
+                    # The same file may be reached by another path, through symbolic links and the like
+                    once = self.__once_ids.get(unique_id)
+                    if once is None and self.__once_contents and (size is None or size in self.__once_sizes):
+                        if text is None:
+                            text = ih.read()
+                        once = self.__once_contents.get((size, self.__file_digest(text)))
+                except IOError:
+                    continue
+                if once is not None:
                     ih.close()
+                    self.__cannot_replay()
+                    self.stats['include_once_aliases_skipped'] += 1
+                    if self.debugout is not None:
+                        print("x:x:x x:x #include \"%s\" skipped as the same file as \"%s\" already seen" % (fulliname, once), file = self.debugout)
+                    if self.passthru_includes is not None and self.passthru_includes.match(''.join([x.value for x in tokens])):
+                        for tok in original_line:
+                            yield tok
+                    return
+                # A file too big to lex whole is read as it is preprocessed, so is only closed once done with
+                frames = len(self.__replay_frames)
+                dependencies_only, passthru_outer = self.dependencies_only, self.__passthru_outer
+                try:
                     dname = os.path.dirname(fulliname)
                     if dname:
                         self.temp_path.insert(0,dname)
                     self.current_include_next_unique_ids.append(unique_id)
-                    if self.passthru_includes is not None and self.passthru_includes.match(''.join([x.value for x in tokens])):
+                    if passthru:
                         for tok in original_line:
                             yield tok
-                        for tok in self.parsegen(data,filename,fulliname):
+                        if passthru_outer is None:
+                            self.__passthru_outer = dependencies_only
+                    if self.__passthru_outer is False:
+                        # The output of a file passed through, and of those it includes, is
+                        # thrown away, so nothing but their directives have any effect ...
+                        if self.expand_countermacro and text is None:
+                            text = ih.read()
+                        self.dependencies_only = text is None or '__COUNTER__' not in text
+                        if self.dependencies_only:
+                            self.stats['passthru_includes_directives_only'] += 1
+                        # ... except that which uses of __COUNTER__ advance it is only known
+                        # by preprocessing the whole of each file using it
+                    # A file small enough to be lexed whole is closed at once, so only the
+                    # files being streamed are kept open while the files they include are
+                    input = self.__lexed_file(ih, fulliname, self.dependencies_only, text)
+                    if input is None and text is not None:
+                        input = text
+                    if input is not None:
+                        ih.close()
+                    else:
+                        input = ih
+                    replay = key = None
+                    if self.include_replay_cache is not None and not include_next_is_active:
+                        key = self.__replay_key(fulliname)
+                    if key is not None:
+                        replay = self.__find_replay(key)
+                        self.stats['include_replay_hits' if replay is not None else 'include_replay_misses'] += 1
+                    if replay is not None:
+                        included = self.__replay(replay, filename, not passthru)
+                    elif key is not None:
+                        included = self.__recorded(key, fulliname, self.parsegen(input,filename,fulliname), not passthru)
+                    else:
+                        included = self.parsegen(input,filename,fulliname)
+                    if passthru:
+                        for tok in included:
                             pass
+                    elif guarded:
+                        # Count the newlines output, for skipping the file from now on
+                        newlines = 0
+                        for tok in included:
+                            if newlines is not None:
+                                newlines = newlines + tok.value.count('\n') if tok.type in self.t_WS else None
+                            yield tok
+                        if newlines is not None:
+                            self.__guarded_newlines[fulliname] = newlines
                     else:
-                        for tok in self.parsegen(data,filename,fulliname):
+                        for tok in included:
                             yield tok
                     self.current_include_next_unique_ids.remove(unique_id)
                     if dname:
                         del self.temp_path[0]
+                    if fulliname in self.include_once:
+                        self.__once_ids[unique_id] = fulliname
+                        if self.include_once_by_content:
+                            self.__add_once_content(is_system_include, fulliname, size)
                     return
-                except IOError:
-                    pass
+                finally:
+                    # Whatever was being recorded is abandoned if an exception was thrown
+                    del self.__replay_frames[frames:]
+                    self.dependencies_only, self.__passthru_outer = dependencies_only, passthru_outer
+                    ih.close()
             else:
                 if include_exists_only:
                     yield False
                     return
+                self.__cannot_replay()
                 p = self.on_include_not_found(False,is_system_include,self.temp_path[0] if self.temp_path else '',filename)
                 assert p is not None
                 path.append(p)
 
+    # ----------------------------------------------------------------------
+    # __include_candidates() and __probe()
+    #
+    # The absolute paths of where filename might be found in path, in the
+    # order they are to be tried, and the recording of every path where it
+    # is looked for, found or not
+    # ----------------------------------------------------------------------
+
+    def __include_candidates(self,path,filename,is_system_include):
+        # Files in directories which have been listed can be looked for without opening them,
+        # unless on_file_open() opens files some other way
+        if self.include_cache is None or getattr(self.on_file_open, '__func__', None) is not PreprocessorHooks.on_file_open:
+            return [os.path.abspath(os.path.join(p,filename)) for p in path]
+        return self.include_cache.find(path, filename, is_system_include, self.vfs)
+
+    def __probe(self,path,filename):
+        # Adds where filename is looked for in path to probed_paths, and to the IncludeReplay
+        # being recorded, as either may need to know whether any file there was created since
+        if self.probed_paths is None and not self.__replay_frames:
+            return
+        probed = [os.path.abspath(os.path.join(p,filename)) for p in path]
+        if self.probed_paths is not None:
+            self.probed_paths.update(probed)
+        if self.__replay_frames:
+            self.__replay_frames[-1].probed.update(probed)
+
+    # ----------------------------------------------------------------------
+    # __replay_key(), __find_replay(), __recorded() and __replay()
+    #
+    # Each file included is recorded as an IncludeReplay, which is replayed
+    # when the file is next included with the same macros and files which
+    # preprocessing it depended upon. What else it depended upon, such as
+    # the path searched from it and how the preprocessor is configured, is
+    # its key in include_replay_cache. Files are assumed not to change whilst
+    # a preprocessor uses them, so are only checked once for each replay.
+    # Errors, #error and #warning, include_next, a file included also under
+    # another path, and hooks returning None from on_include_replay() each
+    # stop the file being recorded, and every file including it.
+    # ----------------------------------------------------------------------
+
+    def __cannot_replay(self):
+        if self.__replay_frames:
+            self.__replay_frames[-1].uncacheable = True
+
+    def __replay_key(self,fulliname):
+        hooks = self.on_include_replay(fulliname)
+        if hooks is None:
+            self.__cannot_replay()
+            return None
+        return (fulliname, tuple(dict.fromkeys(self.temp_path)), tuple(self.path),
+                type(self).__module__ + '.' + type(self).__name__, type(self.lexer).__name__, hooks,
+                self.expand_linemacro, self.expand_filemacro, self.expand_countermacro, self.auto_pragma_once_enabled,
+                self.skip_guarded_includes, self.include_next_enabled, self.skip_disabled_regions,
+                None if self.passthru_includes is None else self.passthru_includes.pattern, self.passthru_expr_has_include,
+                self.lazy_macro_definitions, self.enable_trigraphs, self.assume_encoding, self.max_expansion_depth,
+                tuple(self.rewrite_paths), self.dependencies_only)
+
+    def __find_replay(self,key):
+        for replay in self.include_replay_cache.get(key):
+            if self.__replay_valid(replay):
+                return replay
+        return None
+
+    def __replay_valid(self,replay):
+        if replay.counter is not None and replay.counter != self.countermacro:
+            return False
+        if replay.line != (self.linemacrodepth, self.linemacro):
+            return False
+        macros = self.macros
+        refresh = False
+        for name, dep in replay.deps.items():
+            m = macros.get(name)
+            if m is not dep:
+                if m is None or dep is None or _macro_fingerprint(m) != (dep if isinstance(dep, tuple) else _macro_fingerprint(dep)):
+                    return False
+                refresh = True
+        include_once, include_guards = self.include_once, self.include_guards
+        for path, (once, guard) in replay.includes.items():
+            if (path in include_once) != once or include_guards.get(path) != guard:
+                return False
+        for key, exists in replay.has_includes.items():
+            if self.__has_include_on(key) != exists:
+                return False
+        if replay not in self.__replays_checked:
+            for path, stamp in replay.files.items():
+                if self.__file_stamp(path) != stamp:
+                    return False
+            self.__replays_checked.add(replay)
+        if refresh:
+            # The same macros by value, so next time they can be compared by identity
+            replay.deps = dict([(name, macros.get(name)) for name in replay.deps])
+        return True
+
+    def __recorded(self,key,fulliname,tokens,output):
+        # Yields tokens, the output of preprocessing the file at fulliname, recording
+        # an IncludeReplay of it which is recorded as output by any file including it
+        replay = IncludeReplay()
+        replay.files[fulliname] = self.__file_stamp(fulliname)
+        counter, return_code, times = self.countermacro, self.return_code, len(self.include_times)
+        # A macro invocation left unclosed leaves __LINE__ stuck where it was, which lasts until the end
+        replay.line = (self.linemacrodepth, self.linemacro)
+        frames = self.__replay_frames
+        frames.append(replay)
+        for tok in tokens:
+            # Tokens of files it includes are recorded by their own IncludeReplay
+            if frames[-1] is replay:
+                replay.output.append(tok.clone())
+            yield tok
+        frames.pop()
+        if self.countermacro != counter:
+            replay.counter = counter
+            replay.counted = self.countermacro - counter
+        if (self.linemacrodepth, self.linemacro) != replay.line:
+            replay.line_left = (self.linemacrodepth, self.linemacro)
+        if self.return_code != return_code:
+            replay.uncacheable = True
+        # __FILE__ is restored by whatever included it
+        replay.macros = dict([(name, self.macros.get(name)) for name in replay.macros if name != '__FILE__' or not self.expand_filemacro])
+        depth = self.include_times[times].depth
+        replay.include_times = [(x.included_path, x.included_abspath, x.depth - depth) for x in self.include_times[times:]]
+        if not replay.uncacheable:
+            self.include_replay_cache.add(key, replay)
+        if frames:
+            frames[-1].merge(replay, output)
+
+    def __file_stamp(self,path):
+        # (mtime, size) of the file at path, which on_file_open() might not have opened
+        # from the file system, so neither may be known
+        try:
+            return (self.vfs.mtime(path), self.vfs.getsize(path))
+        except OSError:
+            return (None, None)
+
+    def __replay(self,replay,filename,output):
+        # Yields the tokens output by the file replay is of, and does what it did
+        including = self.macros.get('__FILE__')
+        for included_path, included_abspath, depth in replay.include_times:
+            self.include_times.append(FileInclusionTime(including, filename if depth == 0 else included_path, included_abspath, self.include_depth + depth))
+        if self.probed_paths is not None:
+            self.probed_paths.update(replay.probed)
+        frames = self.__replay_frames
+        # Nor is its output recorded by any IncludeReplay being recorded
+        frames.append(replay)
+        for tok in replay.tokens():
+            yield tok
+        frames.pop()
+        macros = self.macros
+        for name, m in replay.macros.items():
+            if m is None:
+                macros.pop(name, None)
+            else:
+                macros[name] = m
+        self.include_once.update(replay.include_once)
+        self.include_guards.update(replay.include_guards)
+        self.countermacro += replay.counted
+        if replay.line_left is not None:
+            self.linemacrodepth, self.linemacro = replay.line_left
+        for path in replay.include_once:
+            # For the same files under other paths to be skipped
+            unique_id, size = self.__file_unique_id(None, path)
+            self.__once_ids.setdefault(unique_id, path)
+            if self.include_once_by_content:
+                self.__add_once_content(False, path, size)
+        if frames:
+            frames[-1].merge(replay, output)
+
+    # ----------------------------------------------------------------------
+    # __read_ahead_includes()
+    #
+    # Starts reading the files named by each #include "..." or #include <...>
+    # in text, as they would be found from the file about to be preprocessed.
+    # The threads reading them are ended once the parse() is done with, by
+    # __close_read_ahead().
+    # ----------------------------------------------------------------------
+
+    def __close_read_ahead(self):
+        if self.__read_ahead is not None:
+            self.__read_ahead.close()
+            self.stats.update({'read_ahead_' + k : v for k, v in self.__read_ahead.stats.items()})
+            self.__read_ahead = None
+
+    def __closing_read_ahead(self,parser):
+        # Yields the tokens of parser, ending read ahead however it is stopped, be it by
+        # an exception or by being abandoned before its end
+        try:
+            for tok in parser:
+                yield tok
+        finally:
+            self.__close_read_ahead()
+
+    __include_directive = re.compile(r'^[ \t]*#[ \t]*include[ \t]*(?:"([^"\n]+)"|<([^>\n]+)>)', re.MULTILINE)
+
+    def __read_ahead_includes(self,text):
+        if self.__read_ahead is None:
+            self.__read_ahead = IncludeReadAhead(self.on_file_open, self.read_ahead_threads, self.read_ahead_max_files)
+        read_ahead = self.__read_ahead
+        for m in self.__include_directive.finditer(text):
+            is_system_include = m.group(1) is None
+            path = (self.path if is_system_include else self.temp_path + self.path) or ['']
+            fullinames = [x for x in self.__include_candidates(path, m.group(2) or m.group(1), is_system_include) if x not in self.include_once]
+            if fullinames:
+                read_ahead.schedule(is_system_include, fullinames)
+
+    # ----------------------------------------------------------------------
+    # __add_once_content()
+    #
+    # Remembers the text of a file in include_once, so files identical to it
+    # found elsewhere can be skipped like GCC does
+    # ----------------------------------------------------------------------
+
+    def __add_once_content(self,is_system_include,fulliname,size):
+        try:
+            ih = self.on_file_open(is_system_include,fulliname)
+        except IOError:
+            return
+        with ih:
+            digest = self.__file_digest(ih.read())
+        self.__once_contents.setdefault((size, digest), fulliname)
+        self.__once_sizes.add(size)
+
     # ----------------------------------------------------------------------
     # define()
     #
@@ -1254,14 +2830,22 @@ class Preprocessor(PreprocessorHooks):
 
     def define(self,tokens):
         """Define a new macro"""
+        # Most function like macros are never used when only finding the files included, but
+        # those defined by files passed through are processed as any others
+        lazy = self.lazy_macro_definitions or (self.dependencies_only and self.__passthru_outer is not False)
         if isinstance(tokens,STRING_TYPES):
             tokens = self.tokenize(tokens)
+        elif lazy:
+            # The tokens kept are copied once a redefinition is known not to be identical
+            tokens = [as_token(tok) for tok in tokens]
         else:
-            tokens = [copy.copy(tok) for tok in tokens]
+            tokens = [as_token(tok).clone() for tok in tokens]
         def add_macro(self, name, macro):
             macro.source = name.source
             macro.lineno = name.lineno
             self.macros[name.value] = macro
+            if self.__replay_frames:
+                self.__replay_frames[-1].macros[name.value] = None
 
         linetok = tokens
         try:
@@ -1270,16 +2854,16 @@ class Preprocessor(PreprocessorHooks):
                 mtype = linetok[1]
             else:
                 mtype = None
-            if not mtype:
-                m = Macro(name.value,[])
-                add_macro(self, name, m)
-            elif mtype.type in self.t_WS:
+            if not mtype or mtype.type in self.t_WS:
                 # A normal macro
-                m = Macro(name.value,self.tokenstrip(linetok[2:]))
+                value = self.tokenstrip(linetok[2:])
+                if lazy:
+                    value = [tok.clone() for tok in value]
+                m = Macro(name.value,value)
                 add_macro(self, name, m)
             elif mtype.value == '(':
                 # A macro with arguments
-                tokcount, args, positions = self.collect_args(linetok[1:])
+                tokcount, args, positions = self.collect_args(linetok, False, 1)
                 variadic = False
                 for a in args:
                     if variadic:
@@ -1288,6 +2872,7 @@ class Preprocessor(PreprocessorHooks):
                     astr = "".join([str(_i.value) for _i in a])
                     if astr == "...":
                         variadic = True
+                        a[0] = a[0].clone()
                         a[0].type = self.t_ID
                         a[0].value = '__VA_ARGS__'
                         variadic = True
@@ -1299,6 +2884,7 @@ class Preprocessor(PreprocessorHooks):
                         # If, for some reason, "." is part of the identifier, strip off the name for the purposes
                         # of macro expansion
                         if a[0].value[-3:] == '...':
+                            a[0] = a[0].clone()
                             a[0].value = a[0].value[:-3]
                         continue
                     # Empty arguments are permitted
@@ -1308,18 +2894,24 @@ class Preprocessor(PreprocessorHooks):
                         self.on_error(a[0].source,a[0].lineno,"Invalid macro argument")
                         break
                 else:
-                    mvalue = self.tokenstrip(linetok[1+tokcount:])
-                    i = 0
-                    while i < len(mvalue):
-                        if i+1 < len(mvalue):
-                            if mvalue[i].type in self.t_WS and mvalue[i+1].value == '##':
-                                del mvalue[i]
-                                continue
-                            elif mvalue[i].value == '##' and mvalue[i+1].type in self.t_WS:
-                                del mvalue[i+1]
-                        i += 1
-                    m = Macro(name.value,mvalue,[x[0].value for x in args] if args != [[]] else [],variadic)
-                    self.macro_prescan(m)
+                    arglist = [x[0].value for x in args] if args != [[]] else []
+                    body = linetok[1+tokcount:]
+                    if lazy:
+                        # A redefinition with the very same tokens keeps the existing macro, and
+                        # with it anything done towards completing it
+                        if self.__replay_frames:
+                            self.__replay_frames[-1].consult(name.value, self.macros)
+                        existing = self.macros.get(name.value)
+                        if (isinstance(existing, LazyMacro) and existing.arglist == arglist and existing.variadic == variadic
+                                and self.__same_tokens(existing.body, body)):
+                            existing.source = name.source
+                            existing.lineno = name.lineno
+                            return
+                        # The tokens of the line may yet be changed in place by whatever passed them
+                        m = LazyMacro(name.value,[tok.clone() for tok in body],arglist,variadic,self.__complete_macro)
+                    else:
+                        m = Macro(name.value,self.__macro_value(body),arglist,variadic)
+                        self.macro_prescan(m)
                     add_macro(self, name, m)
             else:
                 self.on_error(name.source,name.lineno,"Bad macro definition")
@@ -1328,6 +2920,42 @@ class Preprocessor(PreprocessorHooks):
         except:
             raise
 
+    # ----------------------------------------------------------------------
+    # __macro_value(), __complete_macro() and __same_tokens()
+    #
+    # The replacement list of a function like macro has surrounding
+    # whitespace and any whitespace next to ## removed. With lazy macro
+    # definitions, this and macro_prescan() happen when a LazyMacro is first
+    # needed. A redefinition is the same if its tokens are, whitespace between
+    # them included, as that is output where arguments are stringized or
+    # substituted, which can be checked on the raw tokens.
+    # ----------------------------------------------------------------------
+
+    def __macro_value(self,tokens):
+        tokens = self.tokenstrip(tokens)
+        t_WS = self.t_WS
+        last = len(tokens) - 1
+        mvalue = []
+        skip = False
+        for i, tok in enumerate(tokens):
+            if skip:
+                skip = False
+            elif i < last and tok.type in t_WS and tokens[i+1].value == '##':
+                pass
+            else:
+                skip = i < last and tok.value == '##' and tokens[i+1].type in t_WS
+                mvalue.append(tok)
+        return mvalue
+
+    def __complete_macro(self,macro):
+        macro.value = self.__macro_value([tok.clone() for tok in macro.body])
+        self.macro_prescan(macro)
+
+    def __same_tokens(self,a,b):
+        def values(tokens):
+            return [(tok.type, tok.value) for tok in self.tokenstrip(list(tokens))]
+        return values(a) == values(b)
+
     # ----------------------------------------------------------------------
     # undef()
     #
@@ -1343,6 +2971,8 @@ class Preprocessor(PreprocessorHooks):
             del self.macros[id]
         except LookupError:
             pass
+        if self.__replay_frames:
+            self.__replay_frames[-1].macros[id] = None
 
     # ----------------------------------------------------------------------
     # parse()
@@ -1350,13 +2980,26 @@ class Preprocessor(PreprocessorHooks):
     # Parse input text.
     # ----------------------------------------------------------------------
     def parse(self,input,source=None,ignore={}):
-        """Parse input text."""
+        """Parse input text.
+
+        input may also be an open file. One of the file system bigger than
+        stream_block_size is read as it is preprocessed, as included files are, so
+        must be kept open until then. Any other is read now."""
+        if self.__initial_macros is None:
+            self.__initial_macros = self.__macro_fingerprints()
         if isinstance(input, FILE_TYPES):
             if source is None:
-                source = input.name
-            input = input.read()
+                source = getattr(input, 'name', None)
+            lexed = self.__lexed_file(input, os.path.abspath(source), self.dependencies_only) if source else None
+            if lexed is not None:
+                input = lexed
+            elif not self.__streamed(input):
+                input = input.read()
         self.ignore = ignore
+        del self.__replay_frames[:]
         self.parser = self.parsegen(input,source,os.path.abspath(source) if source else None)
+        if self.read_ahead_threads:
+            self.parser = self.__closing_read_ahead(self.parser)
         if source is not None:
             dname = os.path.dirname(source)
             self.temp_path.insert(0,dname)
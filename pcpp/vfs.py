@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# Python C99 conforming preprocessor virtual file system
+# (C) 2026 Niall Douglas http://www.nedproductions.biz/
+# Started: Oct 2026
+#
+# Lets files to #include be found in places other than the file system, such
+# as a dict of files held in memory, or a zip or tar archive, without first
+# writing them out to disk. Each is mounted at an absolute path, under which
+# its files then appear to be.
+
+import os, io, abc, threading, zipfile, tarfile, posixpath
+
+# ------------------------------------------------------------------
+# IndexedFileSystem
+#
+# A tree of files indexed by their paths within it, which are relative,
+# with '/' separators. The index of every file and directory is built when
+# the file system is created, so looking a file up never needs to search.
+# ------------------------------------------------------------------
+
+class IndexedFileSystem(abc.ABC):
+    """Files held somewhere other than the file system, indexed by their path within it.
+
+    Subclasses call _add() for each file when constructed, and implement _read()."""
+    def __init__(self):
+        self.__files = {}        # path => (size, what _read() needs to read it)
+        self.__dirs = {'': set()}  # path of directory => names of the files and directories in it
+        self.__lock = threading.Lock()
+
+    def _add(self, path, size, handle):
+        path = posixpath.normpath(path.replace('\\', '/')).lstrip('/')
+        if path in ('', '.') or path.startswith('../'):
+            return
+        self.__files[path] = (size, handle)
+        while path:
+            parent, name = posixpath.split(path)
+            self.__dirs.setdefault(parent, set()).add(name)
+            path = parent
+
+    @abc.abstractmethod
+    def _read(self, handle):
+        """Returns the bytes of the file which _add() was given handle for"""
+
+    def isfile(self, path):
+        return path in self.__files
+
+    def isdir(self, path):
+        return path in self.__dirs
+
+    def listdir(self, path):
+        """Returns the names in directory path"""
+        try:
+            return list(self.__dirs[path])
+        except KeyError:
+            raise FileNotFoundError(path)
+
+    def getsize(self, path):
+        try:
+            return self.__files[path][0]
+        except KeyError:
+            raise FileNotFoundError(path)
+
+    def read(self, path):
+        """Returns the bytes of the file at path"""
+        try:
+            handle = self.__files[path][1]
+        except KeyError:
+            raise FileNotFoundError(path)
+        # Archives are read through one open file, which threads must take turns with
+        with self.__lock:
+            return self._read(handle)
+
+class DictFileSystem(IndexedFileSystem):
+    """Files held in a dict of path => str or bytes. Text is encoded as UTF-8."""
+    def __init__(self, files):
+        super(DictFileSystem, self).__init__()
+        for path, data in files.items():
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            self._add(path, len(data), data)
+
+    def _read(self, data):
+        return data
+
+class ZipFileSystem(IndexedFileSystem):
+    """Files in a zip archive, which may be a path or an open binary file"""
+    def __init__(self, archive):
+        super(ZipFileSystem, self).__init__()
+        self.archive = zipfile.ZipFile(archive)
+        for info in self.archive.infolist():
+            if not info.filename.endswith('/'):
+                self._add(info.filename, info.file_size, info)
+
+    def _read(self, info):
+        return self.archive.read(info)
+
+class TarFileSystem(IndexedFileSystem):
+    """Files in a tar archive, compressed or not, which may be a path or an open binary file"""
+    def __init__(self, archive):
+        super(TarFileSystem, self).__init__()
+        if isinstance(archive, (str, bytes, os.PathLike)):
+            self.archive = tarfile.open(archive)
+        else:
+            self.archive = tarfile.open(fileobj = archive)
+        for info in self.archive.getmembers():
+            if info.isfile():
+                self._add(info.name, info.size, info)
+
+    def _read(self, info):
+        return self.archive.extractfile(info).read()
+
+# ------------------------------------------------------------------
+# VirtualFileSystem
+#
+# The file system as seen by a preprocessor: the real one, plus whatever
+# IndexedFileSystems are mounted over it.
+# ------------------------------------------------------------------
+
+class VirtualFileSystem(object):
+    """The file system, with IndexedFileSystems mounted at absolute paths within it.
+
+    A path into an archive may be given as the path of the archive, then '!',
+    then the path within it, such as sdk.zip!/include, which mounts the archive
+    at its own path with '!' appended."""
+    archive_separator = '!'
+
+    def __init__(self):
+        self.mounts = {}  # absolute path => IndexedFileSystem mounted there
+
+    def mount(self, path, file_system):
+        """Makes the files of file_system appear under path"""
+        self.mounts[os.path.abspath(path)] = file_system
+
+    def mount_archive(self, path):
+        """If path is of the form archive!/path within it, mounts the zip or tar archive
+        if not already mounted, returning whether path is within an archive"""
+        start = 0
+        while True:
+            idx = path.find(self.archive_separator, start)
+            if idx < 0:
+                return False
+            archive = os.path.abspath(path[:idx])
+            if archive + self.archive_separator in self.mounts:
+                return True
+            if os.path.isfile(archive):
+                if zipfile.is_zipfile(archive):
+                    self.mounts[archive + self.archive_separator] = ZipFileSystem(archive)
+                    return True
+                if tarfile.is_tarfile(archive):
+                    self.mounts[archive + self.archive_separator] = TarFileSystem(archive)
+                    return True
+            start = idx + 1
+
+    def resolve(self, path):
+        """Returns the IndexedFileSystem which path is within, and the path within it,
+        or None and path if it is of the real file system. Where file systems are
+        mounted within one another, the innermost is used."""
+        if self.mounts:
+            path = os.path.abspath(path)
+            for mount, file_system in sorted(self.mounts.items(), key = lambda x: len(x[0]), reverse = True):
+                if path == mount:
+                    return file_system, ''
+                if path.startswith(mount) and path[len(mount)] in (os.sep, '/'):
+                    return file_system, path[len(mount) + 1:].replace(os.sep, '/')
+        return None, path
+
+    def open(self, path, encoding = None):
+        """Opens the file at path for reading as text, raising IOError if it doesn't exist"""
+        file_system, inner = self.resolve(path)
+        if file_system is None:
+            return io.open(path, 'r', encoding = encoding)
+        data = io.BytesIO(file_system.read(inner))
+        data.name = path
+        return io.TextIOWrapper(data, encoding = encoding)
+
+    def read(self, path):
+        """Returns the bytes of the file at path, raising IOError if it doesn't exist"""
+        file_system, inner = self.resolve(path)
+        if file_system is None:
+            with io.open(path, 'rb') as ih:
+                return ih.read()
+        return file_system.read(inner)
+
+    def listdir(self, path):
+        """Returns the names in the directory at path, raising OSError if it doesn't exist"""
+        file_system, inner = self.resolve(path)
+        if file_system is None:
+            return [entry.name for entry in os.scandir(path)]
+        return file_system.listdir(inner)
+
+    def mtime(self, path):
+        """Returns st_mtime_ns of path, which never changes within an IndexedFileSystem,
+        or None if it doesn't exist"""
+        file_system, inner = self.resolve(path)
+        if file_system is None:
+            try:
+                return os.stat(path).st_mtime_ns
+            except OSError:
+                return None
+        return 0 if file_system.isdir(inner) or file_system.isfile(inner) else None
+
+    def getsize(self, path):
+        file_system, inner = self.resolve(path)
+        if file_system is None:
+            return os.stat(path).st_size
+        return file_system.getsize(inner)
@@ -0,0 +1,108 @@
+import unittest, glob
+from io import StringIO
+
+class disabled_region_skipping(unittest.TestCase):
+    def preprocess(self, input, skip, cls = None, source = 'main.c'):
+        from pcpp import Preprocessor
+        p = (cls or Preprocessor)()
+        p.skip_disabled_regions = skip
+        # Otherwise the two runs may be a second apart
+        p.define('__DATE__ "Jan  1 2000"')
+        p.define('__TIME__ "12:00:00"')
+        p.add_path('tests/test-c')
+        p.parse(input, source)
+        oh = StringIO()
+        p.write(oh)
+        return p, oh.getvalue()
+
+    def assertSameOutput(self, input, cls = None, source = 'main.c'):
+        p1, output1 = self.preprocess(input, False, cls, source)
+        p2, output2 = self.preprocess(input, True, cls, source)
+        self.assertEqual(output2, output1)
+        self.assertEqual(p2.return_code, p1.return_code)
+        return p1, p2
+
+    def test_awkward_lines(self):
+        p1, p2 = self.assertSameOutput(r"""#if 0
+int a = 1'000; /* spans
+#endif
+lines */ char *s = "a\
+#endif";
+    /* comment */ #else
+#error not reached
+// a line comment \
+#endif
+  \
+#endif
+#else
+#define B 1
+#endif
+B
+#ifdef UNDEFINED
+#  if 1
+#    error not reached
+#  elif 2
+#  else
+#  endif
+## not a directive
+#
+x // comment
+
+
+
+
+#elif 1
+y
+#endif
+#if 0
+#ifdef A
+""")
+        self.assertNotEqual(p2.stats['disabled_regions_skipped'], 0)
+        self.assertEqual(p1.stats['disabled_regions_skipped'], 0)
+
+    def test_blank_lines(self):
+        # Whether a #line directive is emitted depends on the number of blank lines
+        for n in range(4, 10):
+            input = "a\n#if 0\n" + "// c\n" * n + "#endif\nb\n#if 0\n" + "x\n" * n + "#endif\nc\n"
+            self.assertSameOutput(input)
+
+    def test_comment_hook(self):
+        from pcpp import Preprocessor
+        seen = []
+        class CommentPreprocessor(Preprocessor):
+            def on_comment(self, tok):
+                seen.append((tok.type, tok.value, tok.lineno))
+                return tok.value.startswith('/*')
+        input = "#if 0\n/* a\n*/ x // b\n#define C // c\n#if 1 /* d */\n#endif\n#endif\n"
+        self.assertSameOutput(input, CommentPreprocessor)
+        self.assertEqual(seen[:4], seen[4:])
+        self.assertEqual(len(seen), 8)
+
+    def test_nested_groups(self):
+        input = "#if 0\n" + "#ifdef A\nx\n#else\ny\n#endif\n" * 100 + "#elif 1\nz\n#endif\n"
+        p1, p2 = self.assertSameOutput(input)
+        self.assertEqual(p2.stats['disabled_regions_skipped'], 1)
+        self.assertEqual(p2.stats['disabled_lines_skipped'], 500)
+
+    def test_repeated_parses(self):
+        from pcpp import Preprocessor
+        p = Preprocessor()
+        for n in range(3):
+            p.parse("#ifndef A\nx\n#else\ny\n#endif\n")
+            p.write(StringIO())
+        self.assertEqual(p.stats['disabled_regions_skipped'], 3)
+        self.assertEqual(p.stats['conditional_index_reuses'], 2)
+        p.parse("#ifndef A\nz\n#else\ny\n#endif\n")
+        p.write(StringIO())
+        self.assertEqual(p.stats['conditional_index_reuses'], 2)
+
+    def test_same_output(self):
+        for path in sorted(glob.glob('tests/test-c/*.c')):
+            with open(path, 'rt', encoding = 'latin-1') as ih:
+                input = ih.read()
+            try:
+                self.preprocess(input, False, source = path)
+            except IndexError:
+                # A few of the malformed directive tests trip up the preprocessor
+                continue
+            self.assertSameOutput(input, source = path)
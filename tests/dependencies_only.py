@@ -0,0 +1,48 @@
+import unittest, os
+from .header_files import header_files
+
+headers = {
+    'main.c' : '#include "config.h"\n#define HEADER "feature.h"\n#include HEADER\nint a = VERSION; /* #include "commented.h"\n#include "commented.h" */\n#if VERSION > 4\n#include <new.h>\n#else\n#include "old.h"\n#endif\n#include "config.h"\n',
+    'config.h' : '#ifndef CONFIG_H\n#define CONFIG_H\n#define VERSION 5\nstatic int config(void) { return VERSION; }\n#endif\n',
+    'feature.h' : 'int feature;\n#ifndef FEATURE_H\n#define FEATURE_H\n#endif\n',
+    'inc/new.h' : '#define NEW(x, y) x ## y\nint NEW(n, ew);\n',
+}
+
+class dependencies_only(header_files, unittest.TestCase):
+    headers = headers
+    include_dirs = ('inc',)
+
+    def preprocess(self, dependencies_only):
+        p = self.preprocessor(dependencies_only = dependencies_only, line_directive = '#line')
+        path = os.path.join(self.tmpdir, 'main.c')
+        with open(path, 'rt') as ih:
+            output = self.output(p, ih, path)
+        # Text outside the guard of a file is seen, so the same files are found guarded
+        self.assertEqual(sorted(p.include_guards), [os.path.join(self.tmpdir, 'config.h')])
+        self.assertEqual(sorted(p.include_once), [os.path.join(self.tmpdir, 'config.h')])
+        return [os.path.relpath(x.included_abspath, self.tmpdir) for x in p.include_times], output
+
+    def test_included(self):
+        included, output = self.preprocess(False)
+        self.assertEqual(included, ['main.c', 'config.h', 'feature.h', os.path.join('inc', 'new.h')])
+        self.assertIn('int feature;', output)
+        # Found the same, without any text being output
+        self.assertEqual(self.preprocess(True), (included, ''))
+
+    def test_pcmd(self):
+        from pcpp import CmdPreprocessor
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            p = CmdPreprocessor(['pcpp', '-I', 'inc', '-M', '-o', 'main.d', 'main.c'])
+            self.assertEqual(p.return_code, 0)
+            with open('main.d', 'rt') as ih:
+                self.assertEqual(ih.read(), 'main.o: \\\n main.c \\\n config.h \\\n feature.h \\\n inc/new.h\n')
+            p = CmdPreprocessor(['pcpp', '-I', 'inc', '-MD', '-MF', 'deps.d', '-MT', 'a b', '-MQ', 'c $d', '-MP', '-o', 'main.i', 'main.c'])
+            self.assertEqual(p.return_code, 0)
+            with open('deps.d', 'rt') as ih:
+                self.assertEqual(ih.read(), 'a b c\\ $$d: \\\n main.c \\\n config.h \\\n feature.h \\\n inc/new.h\n\nconfig.h:\n\nfeature.h:\n\ninc/new.h:\n')
+            with open('main.i', 'rt') as ih:
+                self.assertIn('int feature;', ih.read())
+        finally:
+            os.chdir(cwd)
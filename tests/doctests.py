@@ -2,11 +2,13 @@ import unittest
 
 class pcpp_doctests(unittest.TestCase):
     def runTest(self):
-        import doctest, pcpp.preprocessor, pcpp.evaluator
+        import doctest, pcpp.preprocessor, pcpp.evaluator, pcpp.lexer
         failurecount, testcount = doctest.testmod(pcpp.evaluator)
         self.assertGreater(testcount, 0)
         self.assertEqual(failurecount, 0)
         failurecount, testcount = doctest.testmod(pcpp.preprocessor)
         #self.assertGreater(testcount, 0)
         self.assertEqual(failurecount, 0)
-
+        failurecount, testcount = doctest.testmod(pcpp.lexer)
+        self.assertGreater(testcount, 0)
+        self.assertEqual(failurecount, 0)
@@ -0,0 +1,337 @@
+import unittest
+from io import StringIO
+from .header_files import header_files
+
+class runner(object):
+    def runTest(self):
+        from pcpp import Preprocessor
+        import sys
+
+        p = Preprocessor()
+        p.parse(self.input)
+        oh = StringIO()
+        p.write(oh)
+        if oh.getvalue() != self.output:
+            print("Should be:\n" + self.output + "EOF\n", file = sys.stderr)
+            print("\nWas:\n" + oh.getvalue()+"EOF\n", file = sys.stderr)
+        self.assertEqual(p.return_code, 0)
+        self.assertEqual(oh.getvalue(), self.output)
+
+class many_invocations_on_one_line(unittest.TestCase, runner):
+    input = "#define F(x) [x]\n#define O F(o)\n" + " ".join(["F(%d) O" % n for n in range(2000)]) + "\n"
+    output = "\n\n" + " ".join(["[%d] [o]" % n for n in range(2000)]) + "\n"
+
+class invocation_spanning_expansion(unittest.TestCase, runner):
+    # The argument list of G comes partly from the expansion of H, and partly from after it
+    input = r"""#define G(x, y) <x|y>
+#define H G(1,
+H 2) H 3) tail
+"""
+    output = r"""
+
+<1|2> <1|3> tail
+"""
+
+class unclosed_invocation(unittest.TestCase, runner):
+    input = r"""#define A a
+#define F(x) f
+A F(A
+"""
+    output = r"""
+
+a F(A
+"""
+
+class collect_args_start(unittest.TestCase):
+    def runTest(self):
+        from pcpp import Preprocessor
+        import collections
+        p = Preprocessor()
+        toks = p.tokenize("F (a, (b, c)) d")
+        values = lambda args: ["".join([tok.value for tok in arg]) for arg in args]
+        for tokenlist in (toks, collections.deque(toks)):
+            tokcount, args, positions = p.collect_args(tokenlist, True, 1)
+            self.assertEqual(tokcount, 12)
+            self.assertEqual(values(args), ['a', '(b, c)'])
+            self.assertEqual(positions, [2, 4, 11])
+
+class deep_nesting(unittest.TestCase):
+    def runTest(self):
+        # Far deeper than Python's default recursion limit
+        from pcpp import Preprocessor
+        p = Preprocessor()
+        p.line_directive = None
+        p.parse("#define F0(x) [x]\n#define M0 F0(0)\n" + "".join(["#define F%d(x) F%d(x)\n#define M%d M%d\n" % (n, n - 1, n, n - 1) for n in range(1, 5001)]) + "M5000 F5000(1)\n")
+        oh = StringIO()
+        p.write(oh)
+        self.assertEqual(p.return_code, 0)
+        self.assertEqual(oh.getvalue().strip(), "[0] [1]")
+
+class max_expansion_depth(unittest.TestCase):
+    def runTest(self):
+        from pcpp import Preprocessor
+        errors = []
+        class TestPreprocessor(Preprocessor):
+            def on_error(self, file, line, msg):
+                errors.append(msg)
+                super(TestPreprocessor, self).on_error(file, line, msg)
+        p = TestPreprocessor()
+        p.max_expansion_depth = 2
+        p.parse("#define A B\n#define B F(C)\n#define F(x) x\n#define C c\nA\n")
+        oh = StringIO()
+        p.write(oh)
+        self.assertEqual(oh.getvalue(), "\n\n\n\nF(C)\n")
+        self.assertEqual(errors, ["Macro %s not expanded as it would exceed the maximum macro expansion depth of 2" % x for x in "FC"])
+        self.assertEqual(p.return_code, len(errors))
+
+class object_macro_cache(header_files, unittest.TestCase):
+    def preprocess(self, input, files = {}, **attributes):
+        for name, text in files.items():
+            self.write(name, text)
+        p = self.preprocessor(**attributes)
+        return p, [line for line in self.output(p, input, 'main.c').splitlines() if line]
+
+    def test_invalidation(self):
+        p, lines = self.preprocess(r"""#define B 1
+#define A (B + C)
+A A
+#undef B
+A
+#define B 2
+A
+#define C 3
+A
+#undef B
+#define B 2
+A A
+""")
+        self.assertEqual(lines, ["(1 + C) (1 + C)", "(B + C)", "(2 + C)", "(2 + 3)", "(2 + 3) (2 + 3)"])
+        # The second A on each of the two "A A" lines, B after C is defined
+        # and C after B is redefined are served from the cache
+        self.assertEqual(p.stats['object_macro_cache_hits'], 4)
+        self.assertEqual(p.stats['object_macro_cache_misses'], 9)
+
+    def test_magic_macros(self):
+        p, lines = self.preprocess(r"""#define L __LINE__
+#define C __COUNTER__
+#define F __FILE__
+#define LC L C F
+LC
+LC
+#include "inc.h"
+LC
+""", {'inc.h': "LC\n"})
+        self.assertEqual(lines[:2], ['5 0 "main.c"', '6 1 "main.c"'])
+        self.assertTrue(lines[2].startswith('1 2 "') and lines[2].endswith('inc.h"'))
+        self.assertEqual(lines[3], '8 3 "main.c"')
+
+    def test_eviction(self):
+        input = "#define A a\n#define B b\n#define C c\nA B C A\n"
+        p, lines = self.preprocess(input)
+        self.assertEqual(lines, ['a b c a'])
+        self.assertEqual(p.stats['object_macro_cache_hits'], 1)
+        p, lines = self.preprocess(input, object_macro_cache_size = 2)
+        self.assertEqual(lines, ['a b c a'])
+        self.assertEqual(p.stats['object_macro_cache_hits'], 0)
+        self.assertEqual(p.stats['object_macro_cache_evictions'], 2)
+
+    def test_disabled(self):
+        from pcpp import Preprocessor
+        p = Preprocessor()
+        p.cache_object_macros = False
+        p.parse("#define A 1\nA A\n")
+        oh = StringIO()
+        p.write(oh)
+        self.assertEqual(oh.getvalue(), "\n1 1\n")
+        self.assertEqual(p.stats['object_macro_cache_hits'], 0)
+
+class macro_invocation_cache(unittest.TestCase):
+    def preprocess(self, input, size = 4096):
+        from pcpp import Preprocessor
+        p = Preprocessor()
+        p.line_directive = None
+        p.macro_invocation_cache_size = size
+        p.parse(input)
+        oh = StringIO()
+        p.write(oh)
+        self.assertEqual(p.return_code, 0)
+        return p, [line for line in oh.getvalue().splitlines() if line]
+
+    def test_invalidation(self):
+        p, lines = self.preprocess(r"""#define F(x, y) #x x ## y y
+#define B 1
+F(A, B) F(A, B)
+#define A 2
+F(A, B)
+#undef B
+F(A, B)
+""")
+        self.assertEqual(lines, ['"A" AB 1 "A" AB 1', '"A" AB 1', '"A" AB B'])
+        self.assertEqual(p.stats['macro_invocation_cache_hits'], 2)
+        self.assertEqual(p.stats['macro_invocation_cache_misses'], 2)
+
+    def test_hidesets(self):
+        # The A passed to F by the expansion of A cannot be expanded again, so
+        # that invocation must not be confused with the later F(A)
+        p, lines = self.preprocess(r"""#define F(x) [x]
+#define LPAREN (
+#define A F LPAREN A )
+A F(A)
+""")
+        self.assertEqual(lines, ['[A] [[A]]'])
+        self.assertEqual(p.stats['macro_invocation_cache_hits'], 1)
+        self.assertEqual(p.stats['macro_invocation_cache_misses'], 2)
+
+    def test_eviction(self):
+        input = "#define F(x) <x>\nF(1) F(2) F(1) F(1)\n"
+        p, lines = self.preprocess(input, 1)
+        self.assertEqual(lines, ['<1> <2> <1> <1>'])
+        self.assertEqual(p.stats['macro_invocation_cache_hits'], 1)
+        self.assertEqual(p.stats['macro_invocation_cache_evictions'], 2)
+        p, lines = self.preprocess(input, 0)
+        self.assertEqual(lines, ['<1> <2> <1> <1>'])
+        self.assertEqual(p.stats['macro_invocation_cache_hits'], 0)
+        self.assertEqual(p.stats['macro_invocation_cache_misses'], 0)
+
+class expansion_templates(unittest.TestCase):
+    def preprocess(self, input):
+        from pcpp import Preprocessor
+        p = Preprocessor()
+        p.line_directive = None
+        p.macro_invocation_cache_size = 0
+        p.parse(input)
+        oh = StringIO()
+        p.write(oh)
+        self.assertEqual(p.return_code, 0)
+        return [line for line in oh.getvalue().splitlines() if line]
+
+    def test_pasting(self):
+        self.assertEqual(self.preprocess(r"""#define G(x, y) x ## y
+#define H(x, y, z) x ## y ## z
+G(a,) G(,b) G(a b, c d) G(1, .5e) G(+, +) G(x, 1 2)
+H(a,,c) H(,,) H(a,b,c) G(G, (1, 2)) G(<<, =)
+"""), ['a b a bc d 1.5e ++ x1 2', 'ac abc G(1, 2) <<='])
+
+    def test_slots(self):
+        self.assertEqual(self.preprocess(r"""#define S(x) #x x #x
+#define V(fmt, ...) f(fmt, ## __VA_ARGS__) #__VA_ARGS__
+#define E(a, b) a b a b
+S(a  b) S()
+V(a) V(a,b,c)
+E(__COUNTER__, __COUNTER__)
+"""), ['"a b" a b "a b" "" ""', 'f(a) "" f(a,b,c) "b,c"', '1 0 1 0'])
+
+    def test_pasted_types(self):
+        from pcpp import Preprocessor
+        p = Preprocessor()
+        p.define("CAT(a, b) a ## b")
+        # The second 1.5e has its type looked up rather than lexed
+        tokens = p.expand_macros(p.tokenize("CAT(1, .5e) CAT(a, 1) CAT(1, .5e) CAT(., .)"))
+        self.assertEqual([(t.type, t.value) for t in tokens if t.type not in p.t_WS],
+            [('PP_NUMBER', '1.5e'), ('CPP_ID', 'a1'), ('PP_NUMBER', '1.5e'), ('CPP_DOT', '.'), ('CPP_DOT', '.')])
+
+class lazy_definitions(unittest.TestCase):
+    def preprocessor(self, lazy):
+        from pcpp import Preprocessor
+        p = Preprocessor()
+        p.line_directive = None
+        p.lazy_macro_definitions = lazy
+        return p
+
+    def test_output(self):
+        input = r"""#define F(x, ...) #x x ## _ ## x f(x, ## __VA_ARGS__)
+#define G(a,b)   a  ##   b
+#define H(x) G(x, x) F(x)
+#define UNUSED(x) x ## ##
+H(1) F(a, b, c) G(,)
+"""
+        outputs = []
+        for lazy in (False, True):
+            p = self.preprocessor(lazy)
+            p.parse(input)
+            oh = StringIO()
+            p.write(oh)
+            self.assertEqual(p.return_code, 0)
+            outputs.append(oh.getvalue())
+            self.assertEqual(lazy, 'value' not in p.macros['UNUSED'].__dict__)
+            self.assertEqual(repr(p.macros['G']), "G(['a', 'b'])=[LexToken(CPP_ID,'a',2,71), LexToken(CPP_DPOUND,'##',2,74), LexToken(CPP_ID,'b',2,79)]")
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_redefinition(self):
+        p = self.preprocessor(True)
+        p.parse("#define F(x) ( x )\n#define O 1\n")
+        p.write(StringIO())
+        f, o = p.macros['F'], p.macros['O']
+        # Identical redefinitions of function like macros keep the existing macro
+        p.parse("#define F(x)  ( x )  \n#define F(x) ( x )\n")
+        p.write(StringIO())
+        self.assertIs(p.macros['F'], f)
+        self.assertNotIn('value', f.__dict__)
+        # Though now defined where it was last defined
+        self.assertEqual(f.lineno, 2)
+        for redefinition in ("#define F(y) ( y )\n", "#define F(x) (x)\n", "#define F(x)  (  x )\n", "#define F(x, ...) ( x )\n", "#define F ( x )\n"):
+            p.parse(redefinition)
+            p.write(StringIO())
+            self.assertIsNot(p.macros['F'], f)
+            f = p.macros['F']
+        p.parse("#define O 1\n")
+        p.write(StringIO())
+        self.assertIsNot(p.macros['O'], o)
+        self.assertEqual(p.return_code, 0)
+
+    def test_whitespace(self):
+        # Redefinitions differing only in whitespace take effect, lazily or not
+        input = "#define F(x) ( x )\n#define S(x) #x\n#define O x y\nF(1) S(a b) O\n#define F(x) (      x      )\n#define S(x)  #x\n#define O x      y\nF(1) S(a   b) O\n"
+        outputs = []
+        for lazy in (False, True):
+            p = self.preprocessor(lazy)
+            p.parse(input)
+            oh = StringIO()
+            p.write(oh)
+            outputs.append(oh.getvalue())
+        self.assertEqual(outputs[1], outputs[0])
+        self.assertIn('(      1      ) "a b" x      y', outputs[1])
+
+    def test_tokens_copied(self):
+        p = self.preprocessor(True)
+        tokens = p.tokenize('T(x) x + 1')
+        p.define(tokens)
+        tokens[-1].value = '2'
+        p.parse("T(0)\n")
+        oh = StringIO()
+        p.write(oh)
+        self.assertEqual(oh.getvalue().split(), ['0', '+', '1'])
+
+    def test_errors(self):
+        p = self.preprocessor(True)
+        errors = []
+        p.on_error = lambda file, line, msg: errors.append(msg)
+        p.parse("#define F(x, 1) x\n#define G(..., y) x\n")
+        p.write(StringIO())
+        self.assertEqual(errors, ['Invalid macro argument', 'No more arguments may follow a variadic argument'])
+        self.assertNotIn('F', p.macros)
+
+class expansion_prefilter(unittest.TestCase):
+    def test_prefilter(self):
+        from pcpp import Preprocessor
+        p = Preprocessor()
+        p.line_directive = None
+        p.parse("""int a;
+#define A 1
+int b;
+#if A
+int c = __LINE__;
+#endif
+#undef A
+int A;
+""")
+        oh = StringIO()
+        p.write(oh)
+        self.assertEqual(oh.getvalue(), "int a;\n\nint b;\n\nint c = 5;\n\n\nint A;\n")
+        # Only the expression of the #if and the chunk using __LINE__ need expanding
+        self.assertEqual(p.stats['expand_macros_calls'], 4)
+        self.assertEqual(p.stats['expand_macros_without_macros'], 2)
+        p.expand_countermacro = False
+        tokens = p.tokenize("__COUNTER__ + 1")
+        self.assertEqual(p.expand_macros(tokens), tokens)
+        self.assertEqual(p.stats['expand_macros_without_macros'], 3)
@@ -0,0 +1,53 @@
+import os, shutil, tempfile
+from io import StringIO
+
+class header_files(object):
+    """Mixin for tests preprocessing files written into a temporary directory,
+    whose include_dirs are searched for includes. headers maps the name of each
+    file to write before every test to its text."""
+    headers = {}
+    include_dirs = ('',)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name, text in self.headers.items():
+            self.write(name, text)
+        for name in self.include_dirs:
+            if not os.path.isdir(os.path.join(self.tmpdir, name)):
+                os.makedirs(os.path.join(self.tmpdir, name))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wt', encoding = 'utf-8') as oh:
+            oh.write(text)
+
+    def preprocessor(self, cls = None, **attributes):
+        """Returns a preprocessor without line directives searching include_dirs,
+        with the attributes given set"""
+        from pcpp import Preprocessor
+        p = (cls or Preprocessor)()
+        p.line_directive = None
+        for name, value in attributes.items():
+            setattr(p, name, value)
+        for name in self.include_dirs:
+            p.add_path(os.path.join(self.tmpdir, name) if name else self.tmpdir)
+        return p
+
+    def output(self, p, input, source = None, return_code = 0):
+        """Returns what p outputs for input, checking its return code unless None"""
+        p.parse(input, source)
+        oh = StringIO()
+        p.write(oh)
+        if return_code is not None:
+            self.assertEqual(p.return_code, return_code)
+        return oh.getvalue()
+
+    def preprocess(self, input, cls = None, **attributes):
+        """Returns a preprocessor() with the attributes given, and its output for input"""
+        p = self.preprocessor(cls, **attributes)
+        return p, self.output(p, input)
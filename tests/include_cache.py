@@ -0,0 +1,75 @@
+import unittest, os
+from io import StringIO
+from .header_files import header_files
+
+class include_cache(header_files, unittest.TestCase):
+    headers = {
+        'b/found.h' : 'found_in_b\n#include "sub/relative.h"\n',
+        'b/sub/relative.h' : 'relative\n#include "sibling.h"\n',
+        'b/sub/sibling.h' : 'sibling\n',
+    }
+    include_dirs = ('a', 'b')
+
+    def preprocess(self, input, cache, cls = None):
+        p = self.preprocessor(cls, include_cache = cache, include_next_enabled = True)
+        return p, self.output(p, input, return_code = None)
+
+    def test_same_includes(self):
+        from pcpp.preprocessor import IncludeCache
+        cache = IncludeCache()
+        input = '#include <found.h>\n#if __has_include("missing.h")\nmissing\n#endif\n#include <missing.h>\n'
+        p1, output1 = self.preprocess(input, None)
+        for n in range(2):
+            p2, output2 = self.preprocess(input, cache)
+            self.assertEqual(output2, output1)
+            self.assertEqual(p2.return_code, p1.return_code)
+        self.assertEqual(output1.split(), ['found_in_b', 'relative', 'sibling', '#include', '<missing.h>'])
+        self.assertEqual(p2.stats['include_probes_avoided'], 9)
+        self.assertEqual(cache.stats['hits'], 5)
+
+    def test_include_next(self):
+        from pcpp.preprocessor import IncludeCache
+        self.write('a/found.h', 'found_in_a\n#include_next <found.h>\n')
+        p, output = self.preprocess('#include <found.h>\n', IncludeCache())
+        self.assertEqual(output.split(), ['found_in_a', 'found_in_b', 'relative', 'sibling'])
+
+    def test_validate(self):
+        from pcpp.preprocessor import IncludeCache
+        input = '#if __has_include("new.h")\nnew\n#endif\n'
+        for validate in (False, True):
+            cache = IncludeCache(validate)
+            self.assertEqual(self.preprocess(input, cache)[1].split(), [])
+            self.write('a/new.h', '')
+            self.assertEqual(self.preprocess(input, cache)[1].split(), ['new'] if validate else [])
+            os.remove(os.path.join(self.tmpdir, 'a/new.h'))
+
+    def test_file_open_hook(self):
+        # Files opened some other way mean nothing can be known from listing directories
+        from pcpp import Preprocessor
+        from pcpp.preprocessor import IncludeCache
+        class VirtualPreprocessor(Preprocessor):
+            def on_file_open(self, is_system_include, includepath):
+                if includepath.endswith('virtual.h'):
+                    includepath = os.path.join(os.path.dirname(includepath), 'b', 'sub', 'sibling.h')
+                return super(VirtualPreprocessor, self).on_file_open(is_system_include, includepath)
+        cache = IncludeCache()
+        p, output = self.preprocess('#include "%s"\n' % os.path.join(self.tmpdir, 'virtual.h'), cache, VirtualPreprocessor)
+        self.assertEqual(output.split(), ['sibling'])
+        self.assertEqual(len(cache.stats), 0)
+
+    def test_has_include(self):
+        from pcpp.preprocessor import IncludeCache
+        input = '#if __has_include(<sub/relative.h>) && !__has_include(<sub/missing.h>)\nyes\n#endif\n' * 3
+        input += '#include "found.h"\n#if __has_include("sibling.h")\nsibling_reachable\n#endif\n'
+        p, output = self.preprocess(input, IncludeCache())
+        self.assertEqual(output.split(), ['yes', 'yes', 'yes', 'found_in_b', 'relative', 'sibling'])
+        self.assertEqual((p.stats['has_include_cache_hits'], p.stats['has_include_cache_misses']), (4, 3))
+        # Once a file is added, the answers must be forgotten
+        self.write('a/added.h', '')
+        p.parse('#if __has_include(<added.h>)\nadded\n#endif\n')
+        p.write(StringIO())
+        p.clear_include_caches()
+        oh = StringIO()
+        p.parse('#if __has_include(<added.h>)\nadded\n#endif\n')
+        p.write(oh)
+        self.assertEqual(oh.getvalue().split(), ['added'])
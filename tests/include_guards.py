@@ -0,0 +1,49 @@
+import unittest, os
+from .header_files import header_files
+
+class include_guards(header_files, unittest.TestCase):
+    def preprocess(self, input, skip_guarded_includes = True, **attributes):
+        return header_files.preprocess(self, input, auto_pragma_once_enabled = False, skip_guarded_includes = skip_guarded_includes, **attributes)
+
+    def test_guarded(self):
+        self.write('guarded.h', '/* comment */\n#ifndef GUARDED_H\n#define GUARDED_H 1\nguarded\n#endif /* GUARDED_H */\n\n')
+        self.write('defined.h', '#if !defined( DEFINED_H )\nnot_yet_defined\n#endif\n')
+        input = '#include "guarded.h"\n#include "guarded.h"\n#include "defined.h"\n#define DEFINED_H\n#include "defined.h"\n#include "guarded.h"\n#include "defined.h"\n#include "guarded.h"\n'
+        p1, output1 = self.preprocess(input, False)
+        p2, output2 = self.preprocess(input)
+        self.assertEqual(output2, output1)
+        self.assertEqual(output2.split(), ['guarded', 'not_yet_defined'])
+        # Each file is opened once while its guard is defined, to count the newlines it outputs
+        self.assertEqual(p2.stats['guarded_include_opens_avoided'], 3)
+        self.assertEqual(p2.include_guards[os.path.join(self.tmpdir, 'guarded.h')], 'GUARDED_H')
+        # Once the guard is undefined, the file is included again
+        self.assertEqual(self.output(p2, '#undef GUARDED_H\n#include "guarded.h"\n').split(), ['guarded'])
+
+    def test_exact(self):
+        class PassthruComments(__import__('pcpp').Preprocessor):
+            def on_comment(self, tok):
+                return True
+        self.write('commented.h', '/* license */\n#ifndef COMMENTED_H\n#define COMMENTED_H\ncommented\n#endif\n')
+        self.write('long.h', '#ifndef LONG_H\n#define LONG_H\n' + '\n' * 10 + 'long\n#endif\n' + '\n' * 10)
+        input = ''.join(['#include "%s"\nx%d\n' % (name, n) for n, name in enumerate(['commented.h', 'long.h'] * 3)])
+        for cls in (None, PassthruComments):
+            p1, output1 = self.preprocess(input, False, cls = cls, line_directive = '#line')
+            p2, output2 = self.preprocess(input, cls = cls, line_directive = '#line')
+            self.assertEqual(output2, output1)
+        # The comment kept before its guard means commented.h is not skipped
+        self.assertEqual(sorted(p2.include_guards), [os.path.join(self.tmpdir, 'long.h')])
+        self.assertEqual(output2.count('/* license */'), 3)
+
+    def test_not_guarded(self):
+        headers = {
+            'else.h' : '#ifndef ELSE_H\n#define ELSE_H\n#else\nelse\n#endif\n',
+            'after.h' : '#ifndef AFTER_H\n#define AFTER_H\n#endif\nafter\n',
+            'before.h' : 'before\n#ifndef BEFORE_H\n#define BEFORE_H\n#endif\n',
+            'expr.h' : '#if !defined(EXPR_H) || EXPR\n#define EXPR_H\n#define EXPR 1\nexpr\n#endif\n',
+            'two.h' : '#ifndef TWO_H\n#define TWO_H\n#endif\n#ifndef TWO\ntwo\n#endif\n',
+        }
+        for name, text in headers.items():
+            self.write(name, text)
+        p, output = self.preprocess(''.join(['#include "%s"\n#include "%s"\n' % (name, name) for name in headers]))
+        self.assertEqual(output.split(), ['else', 'after', 'after', 'before', 'before', 'expr', 'expr', 'two', 'two'])
+        self.assertEqual(p.include_guards, {})
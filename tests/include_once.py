@@ -0,0 +1,48 @@
+import unittest, os
+from io import StringIO
+from .header_files import header_files
+
+class include_once(header_files, unittest.TestCase):
+    headers = {
+        'a/once.h' : '#pragma once\nonce\n',
+        'a/guarded.h' : '#ifndef GUARDED_H\n#define GUARDED_H\nguarded\n#endif\n',
+        'vendored/once.h' : '#pragma once\nonce\n',
+    }
+
+    def preprocess(self, input, cls = None, include_once_by_content = False):
+        p, output = header_files.preprocess(self, input, cls, skip_guarded_includes = False, include_once_by_content = include_once_by_content)
+        return p, output.split()
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'needs symbolic links')
+    def test_same_file(self):
+        os.mkdir(os.path.join(self.tmpdir, 'b'))
+        try:
+            os.symlink(os.path.join(self.tmpdir, 'a'), os.path.join(self.tmpdir, 'b', 'linked'))
+        except OSError:
+            self.skipTest('cannot create symbolic links')
+        p, output = self.preprocess('#include "a/once.h"\n#include "b/linked/once.h"\n#include "a/guarded.h"\n#include "b/linked/guarded.h"\n')
+        self.assertEqual(output, ['once', 'guarded'])
+        self.assertEqual(p.stats['include_once_aliases_skipped'], 2)
+
+    def test_same_content(self):
+        input = '#include "a/once.h"\n#include "vendored/once.h"\n'
+        p, output = self.preprocess(input)
+        self.assertEqual(output, ['once', 'once'])
+        p, output = self.preprocess(input, include_once_by_content = True)
+        self.assertEqual(output, ['once'])
+        self.assertEqual(p.stats['include_once_aliases_skipped'], 1)
+        # Only files seen with #pragma once count
+        self.write('vendored/other.h', 'once\n')
+        p, output = self.preprocess('#include "vendored/other.h"\n#include "vendored/other.h"\n', include_once_by_content = True)
+        self.assertEqual(output, ['once', 'once'])
+
+    def test_file_open_hook(self):
+        # Files opened as something other than a file of the file system are told apart by path
+        from pcpp import Preprocessor
+        class VirtualPreprocessor(Preprocessor):
+            def on_file_open(self, is_system_include, includepath):
+                if os.path.basename(includepath) == 'virtual.h':
+                    return StringIO('#pragma once\nvirtual\n')
+                return super(VirtualPreprocessor, self).on_file_open(is_system_include, includepath)
+        p, output = self.preprocess('#include "virtual.h"\n#include "virtual.h"\n#include "a/virtual.h"\n', VirtualPreprocessor, True)
+        self.assertEqual(output, ['virtual'])
@@ -0,0 +1,61 @@
+import unittest, os
+from .header_files import header_files
+
+headers = {
+    'config.h' : '#ifdef WIDE\ntypedef long word;\n#else\ntypedef int word;\n#endif\n#define WORD_BITS (sizeof(word) * 8)\nint line = __LINE__; const char *file = __FILE__;\n#include "once.h"\n',
+    'once.h' : '#pragma once\nint once;\n',
+    'counter.h' : 'int counter = __COUNTER__;\n',
+}
+input = '#include "config.h"\n#include "config.h"\n#define WIDE\n#include "config.h"\n#undef WIDE\n#include "config.h"\n#define WIDE\n#include "config.h"\n#include "counter.h"\nWORD_BITS\n'
+
+class include_replay(header_files, unittest.TestCase):
+    headers = headers
+
+    def preprocess(self, cache, preprocessor = None):
+        return header_files.preprocess(self, input, preprocessor, include_replay_cache = cache, line_directive = '#line')
+
+    def test_replay(self):
+        from pcpp.preprocessor import IncludeReplayCache
+        p, expected = self.preprocess(None)
+        cache = IncludeReplayCache()
+        p1, output1 = self.preprocess(cache)
+        self.assertEqual(output1, expected)
+        # Included again with the same macros as the second and third times
+        self.assertEqual((p1.stats['include_replay_hits'], p1.stats['include_replay_misses']), (2, 5))
+        p2, output2 = self.preprocess(cache)
+        self.assertEqual(output2, expected)
+        self.assertEqual((p2.stats['include_replay_hits'], p2.stats['include_replay_misses']), (6, 0))
+        self.assertEqual(sorted(p2.include_once), sorted(p.include_once))
+        self.assertEqual(p2.countermacro, 1)
+        self.assertEqual([(x.included_path, x.depth) for x in p2.include_times], [(x.included_path, x.depth) for x in p.include_times])
+
+    def test_saved(self):
+        from pcpp.preprocessor import IncludeReplayCache
+        path = os.path.join(self.tmpdir, 'replays')
+        p, expected = self.preprocess(None)
+        p1, output1 = self.preprocess(IncludeReplayCache(path))
+        cache = IncludeReplayCache(path)
+        p2, output2 = self.preprocess(cache)
+        self.assertEqual(output2, expected)
+        self.assertEqual(p2.stats['include_replay_hits'], 6)
+        self.assertEqual(cache.stats['loads'], 2)
+        # Only what was made from a changed file is no longer replayed
+        self.write('once.h', '#pragma once\nint once_changed;\n')
+        p3, output3 = self.preprocess(IncludeReplayCache(path))
+        self.assertEqual((p3.stats['include_replay_hits'], p3.stats['include_replay_misses']), (5, 2))
+        self.assertIn('once_changed', output3)
+
+    def test_not_replayed(self):
+        from pcpp import Preprocessor
+        from pcpp.preprocessor import IncludeReplayCache
+        class ObservingPreprocessor(Preprocessor):
+            def on_include_replay(self, abssource):
+                return None if abssource.endswith('config.h') else super(ObservingPreprocessor, self).on_include_replay(abssource)
+        cache = IncludeReplayCache()
+        self.preprocess(cache, ObservingPreprocessor)
+        p, output = self.preprocess(cache, ObservingPreprocessor)
+        self.assertEqual(p.stats['include_replay_hits'], 2)
+        self.write('counter.h', '#warning counted\nint counter = __COUNTER__;\n')
+        self.preprocess(cache)
+        p, output = self.preprocess(cache)
+        self.assertEqual(p.stats['include_replay_hits'], 5)
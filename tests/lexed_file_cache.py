@@ -0,0 +1,96 @@
+import unittest, os
+from .header_files import header_files
+
+class lexed_file_cache(header_files, unittest.TestCase):
+    headers = {'colours.def' : 'COLOUR(red, __LINE__)\n#if 0\nCOLOUR(never, 0)\n#endif\nCOLOUR(blue, __LINE__)'}
+
+    def setUp(self):
+        from pcpp.lexer import LexedFileCache
+        super(lexed_file_cache, self).setUp()
+        self.cache = LexedFileCache()
+
+    def test_repeated_includes(self):
+        input = '#define COLOUR(name, value) name = value,\n#include "colours.def"\n#undef COLOUR\n#define COLOUR(name, value) #name\n#include "colours.def"\n'
+        p1, output1 = self.preprocess(input, lexed_file_cache = None)
+        p2, output2 = self.preprocess(input, lexed_file_cache = self.cache)
+        self.assertEqual(output2, output1)
+        self.assertIn('red = 1,', output2)
+        self.assertIn('"blue"', output2)
+        self.assertEqual((p2.stats['lexed_file_cache_hits'], p2.stats['lexed_file_cache_misses']), (1, 1))
+        # Another preprocessor gets to reuse the file too
+        p3, output3 = self.preprocess(input, lexed_file_cache = self.cache)
+        self.assertEqual(output3, output1)
+        self.assertEqual(p3.stats['lexed_file_cache_hits'], 2)
+
+    def test_not_shared(self):
+        # Each preprocessor has a cache of its own unless given one to share
+        input = '#define COLOUR(name, value) name\n#include "colours.def"\n'
+        for n in range(2):
+            p, output = self.preprocess(input)
+            self.assertEqual((p.stats['lexed_file_cache_hits'], p.stats['lexed_file_cache_misses']), (0, 1))
+
+    def test_size(self):
+        from pcpp.lexer import LexedFile, LexedFileCache
+        cache = LexedFileCache()
+        a, b = LexedFile('int a;\n' * 200), LexedFile('int b;\n')
+        cache.add('a.h', a)
+        self.assertEqual(cache.size, len(a.text))
+        # Lines lexed once cached count towards its size
+        a.line(0, 1)
+        self.assertGreater(a.size, len(a.text))
+        self.assertEqual(cache.size, a.size)
+        cache.max_size = a.size
+        cache.add('b.h', b)
+        self.assertEqual((len(cache), cache.size, cache.stats['evictions']), (1, b.size, 1))
+        # Nor does a file no longer cached count
+        a.line(7 * 100, 101)
+        self.assertEqual(cache.size, b.size)
+        cache.clear()
+        self.assertEqual(cache.size, 0)
+
+    def test_changed_file(self):
+        input = '#define COLOUR(name, value) name\n#include "colours.def"\n'
+        p, output = self.preprocess(input, lexed_file_cache = self.cache)
+        self.write('colours.def', 'COLOUR(green, 2)\n')
+        p, output = self.preprocess(input, lexed_file_cache = self.cache)
+        self.assertEqual(output.split(), ['green'])
+        self.assertEqual(p.stats['lexed_file_cache_misses'], 1)
+
+    def test_prewarm_and_clear(self):
+        from pcpp import Preprocessor
+        p = Preprocessor()
+        p.lexed_file_cache = self.cache
+        self.assertEqual(p.prewarm_lexed_file_cache([os.path.join(self.tmpdir, 'colours.def'), os.path.join(self.tmpdir, 'missing.h')]), 1)
+        stats = p.lexed_file_cache_stats()
+        self.assertEqual((stats['files'], stats['misses']), (1, 1))
+        self.assertGreater(stats['size'], 0)
+        p, output = self.preprocess('#define COLOUR(name, value) name\n#include "colours.def"\n', lexed_file_cache = self.cache)
+        self.assertEqual(p.stats['lexed_file_cache_hits'], 1)
+        p.clear_lexed_file_cache()
+        self.assertEqual(p.lexed_file_cache_stats()['files'], 0)
+
+    def test_cache_dir(self):
+        input = '#define COLOUR(name, value) name = value,\n#include "colours.def"\n'
+        p1, output1 = self.preprocess(input, lexed_file_cache = None)
+        for n in range(2):
+            p, output = self.preprocess(input, lexed_file_cache = None, cache_dir = os.path.join(self.tmpdir, 'cache'))
+            self.assertEqual(output, output1)
+            self.assertEqual(p.stats['cache_dir_hits'], n)
+        saved = os.listdir(os.path.join(self.tmpdir, 'cache'))
+        self.assertEqual(len(saved), 1)
+        # Anything not saved by pcpp is ignored
+        with open(os.path.join(self.tmpdir, 'cache', saved[0]), 'wb') as oh:
+            oh.write(b'PCPPLEX1 truncated')
+        p, output = self.preprocess(input, lexed_file_cache = None, cache_dir = os.path.join(self.tmpdir, 'cache'))
+        self.assertEqual(output, output1)
+        self.assertEqual((p.stats['cache_dir_hits'], p.stats['cache_dir_misses']), (0, 1))
+
+    def test_cache_dir_eviction(self):
+        from pcpp.lexer import DiskLexedFileCache, LexedFile
+        cache = DiskLexedFileCache(os.path.join(self.tmpdir, 'cache'), 5000)
+        texts = ['int a%d = %d;\n' % (n, n) * 10 for n in range(20)]
+        for text in texts:
+            cache.add(cache.key(text), LexedFile(text))
+        self.assertGreater(cache.stats['evictions'], 0)
+        self.assertEqual(cache.get(cache.key(texts[-1])).text, texts[-1])
+        self.assertLessEqual(sum([os.path.getsize(os.path.join(cache.path, x)) for x in os.listdir(cache.path)]), 5000)
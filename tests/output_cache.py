@@ -0,0 +1,85 @@
+import unittest, os
+from .header_files import header_files
+
+class output_cache(header_files, unittest.TestCase):
+    headers = {
+        'main.c' : '#include "config.h"\nVERSION FEATURE\n',
+        'config.h' : '#define VERSION 5\n#include "feature.h"\n',
+        'feature.h' : '#define FEATURE 1\n',
+    }
+    include_dirs = ()
+
+    def setUp(self):
+        header_files.setUp(self)
+        self.cache = os.path.join(self.tmpdir, 'cache')
+
+    def preprocess(self, name = 'main.c', options = []):
+        from pcpp import CmdPreprocessor
+        output = os.path.join(self.tmpdir, 'main.i')
+        p = CmdPreprocessor(['pcpp', '--line-directive', '--output-cache', self.cache] + options +
+                            ['-o', output, os.path.join(self.tmpdir, name)])
+        self.assertEqual(p.return_code, 0)
+        with open(output, 'rt') as ih:
+            return ih.read().split()
+
+    def totals(self):
+        from pcpp.pcmd import OutputCache
+        totals = OutputCache(self.cache).totals()
+        return (totals['hits'], totals['misses'], totals['uncacheable'])
+
+    def test_hit(self):
+        self.assertEqual(self.preprocess(), ['5', '1'])
+        self.assertEqual(self.preprocess(), ['5', '1'])
+        self.assertEqual(self.totals(), (1, 1, 0))
+        # Other options are another key
+        self.assertEqual(self.preprocess(options = ['-D', 'FEATURE=2']), ['5', '1'])
+        self.assertEqual(self.totals(), (1, 2, 0))
+
+    def test_changed(self):
+        self.preprocess()
+        self.write('feature.h', '#define FEATURE 2\n')
+        self.assertEqual(self.preprocess(), ['5', '2'])
+        self.write('feature.h', '#define FEATURE 1\n')
+        self.assertEqual(self.preprocess(), ['5', '1'])
+        self.assertEqual(self.totals(), (1, 2, 0))
+
+    def test_uncacheable(self):
+        self.write('date.c', '__DATE__ __TIME__\n')
+        self.preprocess('date.c')
+        self.write('warning.c', '#warning not saved\n')
+        self.preprocess('warning.c')
+        self.assertEqual(self.totals(), (0, 0, 2))
+        # Unless SOURCE_DATE_EPOCH fixes the date and time
+        os.environ['SOURCE_DATE_EPOCH'] = '86400'
+        try:
+            self.assertEqual(self.preprocess('date.c'), ['"Jan', '02', '1970"', '"00:00:00"'])
+            self.assertEqual(self.preprocess('date.c'), ['"Jan', '02', '1970"', '"00:00:00"'])
+        finally:
+            del os.environ['SOURCE_DATE_EPOCH']
+        self.assertEqual(self.totals(), (1, 1, 2))
+
+    def test_evict(self):
+        from pcpp.pcmd import OutputCache
+        cache = OutputCache(self.cache, 1000)
+        for n in range(10):
+            cache.add('key%d' % n, [], 'output %d ' % n * 20)
+        self.assertGreater(cache.stats['evictions'], 0)
+        self.assertLessEqual(cache.totals()['size'], 1000)
+        self.assertEqual(cache.get('key9', None), 'output 9 ' * 20)
+
+    def test_created(self):
+        # Headers looked for but not found are remembered, as creating one can change the output
+        self.write('angled.c', '#include <config.h>\nVERSION FEATURE\n')
+        self.write('has.c', '#if __has_include("extra.h")\n#include "extra.h"\n#endif\nVERSION EXTRA\n')
+        first = os.path.join(self.tmpdir, 'first')
+        os.mkdir(first)
+        options = ['-I', first, '-I', self.tmpdir]
+        self.assertEqual(self.preprocess('angled.c', options), ['5', '1'])
+        self.assertEqual(self.preprocess('has.c'), ['VERSION', 'EXTRA'])
+        self.assertEqual(self.preprocess('angled.c', options), ['5', '1'])
+        self.assertEqual(self.totals(), (1, 2, 0))
+        self.write(os.path.join('first', 'config.h'), '#define VERSION 6\n#include "feature.h"\n')
+        self.write('extra.h', '#include "config.h"\n#define EXTRA 2\n')
+        self.assertEqual(self.preprocess('angled.c', options), ['6', '1'])
+        self.assertEqual(self.preprocess('has.c'), ['5', '2'])
+        self.assertEqual(self.totals(), (1, 4, 0))
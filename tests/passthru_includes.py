@@ -0,0 +1,48 @@
+import unittest, os, re
+from .header_files import header_files
+
+headers = {
+    'sys.h' : '#ifndef SYS_H\n#define SYS_H\n#include "once.h"\n#define SYS_CALL(x, ...) sys_##x(__VA_ARGS__)\n#define SYS_VERSION 3\nint sys_a = SYS_CALL(a, 1, 2);\n#if SYS_VERSION > 2\n#define SYS_NEW SYS_CALL(new)\n#undef SYS_OLD\n#else\n#define SYS_OLD 1\n#endif\n#endif\n',
+    'once.h' : '#pragma once\n#define ONCE 1\nint once;\n',
+    'loose.h' : 'int loose;\n#ifndef LOOSE_H\n#define LOOSE_H\n#define LOOSE 1\n#endif\n',
+    'counter.h' : 'int a = __COUNTER__;\n#if 1\nint b = __COUNTER__;\n#endif\n#if 0\nint c = __COUNTER__;\n#endif\n',
+    'nested.h' : '#include "counter.h"\n',
+    'redefine.h' : '#define O x      y\n#define F(a) #a   a\n',
+}
+input = '#define SYS_OLD 0\n#define O x y\n#define F(a) #a a\n#include "sys.h"\n#include "loose.h"\n#include "loose.h"\n#include "redefine.h"\nSYS_NEW ONCE LOOSE O F(1)\n'
+
+class passthru_includes(header_files, unittest.TestCase):
+    headers = headers
+
+    def preprocess(self, passthru_includes, input = input):
+        return header_files.preprocess(self, input, passthru_includes = passthru_includes)
+
+    def test_macros(self):
+        def state(p):
+            macros = dict([(name, (m.arglist, m.variadic, ''.join([tok.value for tok in m.value]))) for name, m in p.macros.items() if name not in p._unsaved_macros])
+            return macros, p.include_once, p.include_guards
+        full, output = self.preprocess(None)
+        self.assertEqual(output.split(), ['int', 'once;', 'int', 'sys_a', '=', 'sys_a(', '1,', '2);', 'int', 'loose;', 'int', 'loose;', 'sys_new()', '1', '1', 'x', 'y', '"1"', '1'])
+        self.assertIn('x      y "1"   1', output)
+        passthru, output = self.preprocess(re.compile('.*'))
+        self.assertEqual(output.split(), ['#include', '"sys.h"', '#include', '"loose.h"', '#include', '"loose.h"', '#include', '"redefine.h"', 'sys_new()', '1', '1', 'x', 'y', '"1"', '1'])
+        # Executing only the directives of the files passed through leaves the same macros,
+        # redefinitions differing only in whitespace included
+        self.assertIn('x      y "1"   1', output)
+        self.assertEqual(state(passthru), state(full))
+        self.assertNotIn(os.path.join(self.tmpdir, 'loose.h'), passthru.include_once)
+        self.assertFalse(passthru.dependencies_only)
+        self.assertEqual(passthru.stats['passthru_includes_directives_only'], 5)
+
+    def test_counter(self):
+        # Uses of __COUNTER__ in text passed through still advance it
+        counted = '#include "counter.h"\n__COUNTER__\n'
+        p, output = self.preprocess(None, counted)
+        self.assertEqual(output.split(), ['int', 'a', '=', '0;', 'int', 'b', '=', '1;', '2'])
+        p, output = self.preprocess(re.compile('.*'), counted)
+        self.assertEqual(output.split(), ['#include', '"counter.h"', '2'])
+        self.assertEqual(p.stats['passthru_includes_directives_only'], 0)
+        # As do those in files included by text passed through
+        p, output = self.preprocess(re.compile('"nested.h"'), '#include "nested.h"\n__COUNTER__\n')
+        self.assertEqual(output.split(), ['#include', '"nested.h"', '2'])
+        self.assertEqual(p.stats['passthru_includes_directives_only'], 1)
@@ -0,0 +1,67 @@
+import unittest, time
+from .header_files import header_files
+
+class read_ahead(header_files, unittest.TestCase):
+    headers = {
+        'first.h' : '\ufefffirst\n#include "sub/nested.h"\n',
+        'sub/nested.h' : 'nested\n#include "sibling.h"\n',
+        'sub/sibling.h' : '#pragma once\nsibling\n',
+        'second.h' : '  #  include <sub/sibling.h>\nsecond\n',
+    }
+    headers.update([('many%d.h' % n, 'many%d\n' % n) for n in range(10)])
+
+    def preprocess(self, input, read_ahead_threads, cls = None, read_ahead_max_files = 32):
+        return header_files.preprocess(self, input, cls, assume_encoding = 'utf-8', read_ahead_threads = read_ahead_threads, read_ahead_max_files = read_ahead_max_files)
+
+    def tracking(self, opened):
+        # A Preprocessor appending each file it opens to opened, with how many times it was read
+        from pcpp import Preprocessor
+        class TrackingPreprocessor(Preprocessor):
+            def on_file_open(self, is_system_include, includepath):
+                ih = super(TrackingPreprocessor, self).on_file_open(is_system_include, includepath)
+                reads = [ih, 0]
+                read = ih.read
+                def counted(*args):
+                    reads[1] += 1
+                    return read(*args)
+                ih.read = counted
+                opened.append(reads)
+                return ih
+        return TrackingPreprocessor
+
+    def test_same_output(self):
+        input = '#include "first.h"\n#if 0\n#include "missing.h"\n#endif\n#include "second.h"\n#include <sub/sibling.h>\n'
+        p1, output1 = self.preprocess(input, 0)
+        opened = []
+        p2, output2 = self.preprocess(input, 2, self.tracking(opened))
+        self.assertEqual(output2, output1)
+        self.assertEqual(output2.split(), ['first', 'nested', 'sibling', 'second'])
+        self.assertEqual(p2.stats['read_ahead_hits'], 4)
+        # The text read ahead is used, rather than reading the file again
+        self.assertEqual([reads for ih, reads in opened], [1] * len(opened))
+
+    def test_bounded(self):
+        # Files read ahead but never #included must be closed
+        opened = []
+        input = '#if 0\n' + ''.join(['#include "many%d.h"\n' % n for n in range(10)]) + '#endif\n#include "many9.h"\n'
+        p, output = self.preprocess(input, 2, self.tracking(opened), 4)
+        self.assertEqual(output.split(), ['many9'])
+        self.assertGreater(p.stats['read_ahead_discarded'], 0)
+        self.assertClosed(opened)
+
+    def test_abandoned(self):
+        # The threads are ended, and the files read ahead closed, when parsing stops early
+        opened = []
+        p = self.preprocessor(self.tracking(opened), read_ahead_threads = 2)
+        p.parse('first\n' + ''.join(['#include "many%d.h"\n' % n for n in range(10)]))
+        self.assertEqual(p.token().value, 'first')
+        p.parser.close()
+        self.assertEqual(p.stats['read_ahead_scheduled'], 10)
+        self.assertClosed(opened)
+
+    def assertClosed(self, opened):
+        for n in range(100):
+            if all([ih.closed for ih, reads in opened]):
+                break
+            time.sleep(0.05)
+        self.assertTrue(all([ih.closed for ih, reads in opened]))
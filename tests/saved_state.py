@@ -0,0 +1,63 @@
+import unittest, os
+from .header_files import header_files
+
+class saved_state(header_files, unittest.TestCase):
+    headers = {
+        'prefix.h' : '#include "config.h"\n#include "config.h"\n#include "once.h"\n#define STRINGIZE(x, ...) #x __VA_ARGS__\n#define COUNT __COUNTER__\nint a = COUNT;\n#undef UNWANTED\n',
+        'config.h' : '#ifndef CONFIG_H\n#define CONFIG_H 1\n#define VERSION 5\n#endif\n',
+        'once.h' : '#pragma once\nonce\n',
+    }
+
+    def setUp(self):
+        header_files.setUp(self)
+        self.state = os.path.join(self.tmpdir, 'prefix.pcpps')
+
+    def preprocessor(self, defines = ['UNWANTED 1'], **attributes):
+        p = header_files.preprocessor(self, **attributes)
+        for define in defines:
+            p.define(define)
+        return p
+
+    def output(self, p, input):
+        return header_files.output(self, p, input).split()
+
+    def save(self, defines = ['UNWANTED 1'], **attributes):
+        p = self.preprocessor(defines, **attributes)
+        with open(os.path.join(self.tmpdir, 'prefix.h'), 'rt') as ih:
+            self.assertEqual(self.output(p, ih), ['once', 'int', 'a', '=', '0;'])
+        p.save_state(self.state)
+
+    main = '#include "config.h"\n#include "once.h"\nSTRINGIZE(VERSION, CONFIG_H) COUNT UNWANTED\n'
+
+    def test_load(self):
+        self.save()
+        p = self.preprocessor()
+        self.assertTrue(p.load_state(self.state))
+        self.assertEqual(self.output(p, self.main), ['"VERSION"', '1', '1', 'UNWANTED'])
+        self.assertEqual(p.stats['guarded_include_opens_avoided'], 1)
+        # Touched but not changed
+        os.utime(os.path.join(self.tmpdir, 'config.h'), (0, 0))
+        self.assertTrue(self.preprocessor().load_state(self.state))
+
+    def test_changed(self):
+        self.save()
+        self.write('config.h', '#define VERSION 6\n')
+        p = self.preprocessor()
+        self.assertFalse(p.load_state(self.state))
+        self.assertEqual(p.macros['VERSION'].value[0].value, '6')
+        self.assertEqual(self.output(p, self.main), ['"VERSION"', 'CONFIG_H', '1', 'UNWANTED'])
+        # Nor can it be loaded if the macros defined beforehand differ
+        self.save()
+        self.assertFalse(self.preprocessor(['UNWANTED 2']).load_state(self.state, False))
+
+    def test_untouched(self):
+        # Macros defined beforehand, lazily or not, are left be unless the files changed them
+        defines = ['UNWANTED 1', 'KEPT(x) #x', 'VERSION 4']
+        self.save(defines, lazy_macro_definitions = True)
+        p = self.preprocessor(defines, lazy_macro_definitions = True)
+        kept = p.macros['KEPT']
+        self.assertTrue(p.load_state(self.state))
+        self.assertIs(p.macros['KEPT'], kept)
+        self.assertIn('_LazyMacro__complete', kept.__dict__)
+        self.assertNotIn('UNWANTED', p.macros)
+        self.assertEqual(self.output(p, 'KEPT(a) VERSION\n'), ['"a"', '5'])
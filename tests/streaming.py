@@ -0,0 +1,118 @@
+import unittest, os, shutil, tempfile
+from io import StringIO
+
+class streamed_input(unittest.TestCase):
+    def preprocess(self, input, block_size = None, trigraphs = False):
+        from pcpp import Preprocessor
+        class StreamedPreprocessor(Preprocessor):
+            def on_file_open(self, is_system_include, includepath):
+                # An included file not on disk is read as it is preprocessed
+                return StringIO(input, newline = '')
+        p = StreamedPreprocessor()
+        p.enable_trigraphs = trigraphs
+        p.line_directive = '#line'
+        if block_size is not None:
+            # Read the input a few characters at a time, and flush after every line
+            p.stream_block_size = block_size
+            p.chunk_flush_size = 1
+        p.parse('#include "main.c"\n', 'outer.c')
+        oh = StringIO()
+        p.write(oh)
+        return oh.getvalue()
+
+    def assertSameOutput(self, input, trigraphs = False):
+        expected = self.preprocess(input, trigraphs = trigraphs)
+        for block_size in (1, 2, 3, 7, 64):
+            self.assertEqual(self.preprocess(input, block_size, trigraphs), expected)
+        return expected
+
+    def test_block_comments(self):
+        self.assertSameOutput("int a; /* a comment\nspanning\n\nlines */ int b;\n/**/ int c; /* x */\n// d /* e\n#define F f /* g\n*/ F\n")
+
+    def test_continued_lines(self):
+        output = self.assertSameOutput("#define F(x) \\\n  (x + \\\n   1)\nF(\n2\n)\nint s = \"a\\\nb\";\nF\n\n(3)\n")
+        self.assertIn('(2 + 1)', output)
+        self.assertIn('(3 + 1)', output)
+
+    def test_disabled_groups(self):
+        self.assertSameOutput("a\n#if 0\n/* spans\n#endif\n*/\nb\n#else\nc\n#endif\n#ifdef X\n" + "d\n" * 20 + "#endif\ne\n")
+
+    def test_line_endings(self):
+        self.assertSameOutput("a\r\nb\rc\r\n\r\n#define D \\\r\n  d\r\nD\r\n")
+
+    def test_trigraphs(self):
+        output = self.assertSameOutput("??=define A(x) x ??/\n+ 1\nA(2) ??' ?\n", trigraphs = True)
+        self.assertIn('2 + 1 ^ ?', output)
+
+    def test_file_input(self):
+        from pcpp import Preprocessor
+        outputs = []
+        for stream in (False, True):
+            p = Preprocessor()
+            p.lexed_file_cache = None
+            if stream:
+                p.stream_block_size = 4
+            p.parse('#include "tests/issue0051.c"\n', 'main.c')
+            oh = StringIO()
+            p.write(oh)
+            outputs.append(oh.getvalue())
+        self.assertEqual(outputs[1], outputs[0])
+
+    def test_closed_file(self):
+        from pcpp import Preprocessor
+        from pcpp.lexer import LexedFileCache
+        outputs = []
+        for cache in (None, LexedFileCache()):
+            p = Preprocessor()
+            p.lexed_file_cache = cache
+            # A file passed to parse() no bigger than stream_block_size is read whole,
+            # so may be closed before it is preprocessed
+            with open('tests/issue0051.c', 'rt') as ih:
+                p.parse(ih)
+            oh = StringIO()
+            p.write(oh)
+            self.assertEqual(p.return_code, 0)
+            outputs.append(oh.getvalue())
+        self.assertEqual(outputs[1], outputs[0])
+        self.assertIn('issue0051', outputs[0])
+
+    def test_parsed_file(self):
+        # A bigger file passed to parse() is read as it is preprocessed, as it is by pcpp
+        from pcpp import Preprocessor, CmdPreprocessor
+        reads = []
+        def streamed(p, input, source = None, ignore = {}):
+            p.stream_block_size = 16
+            read = input.read
+            def counted(*args):
+                reads.append(args)
+                return read(*args)
+            input.read = counted
+            return Preprocessor.parse(p, input, source, ignore)
+        class StreamedCmdPreprocessor(CmdPreprocessor):
+            parse = streamed
+        p = Preprocessor()
+        p.line_directive = '#line'
+        with open('tests/issue0051.c', 'rt') as ih:
+            p.parse(ih.read(), 'tests/issue0051.c')
+        oh = StringIO()
+        p.write(oh)
+        expected = oh.getvalue()
+        p = Preprocessor()
+        p.line_directive = '#line'
+        with open('tests/issue0051.c', 'rt') as ih:
+            streamed(p, ih)
+            oh = StringIO()
+            p.write(oh)
+        self.assertEqual(oh.getvalue(), expected)
+        self.assertNotIn((), reads)
+        self.assertGreater(len(reads), 1)
+        del reads[:]
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output = os.path.join(tmpdir, 'issue0051.i')
+        p = StreamedCmdPreprocessor(['pcpp', '-o', output, 'tests/issue0051.c'])
+        self.assertEqual(p.return_code, 0)
+        with open(output, 'rt') as ih:
+            self.assertEqual(ih.read(), expected)
+        self.assertNotIn((), reads)
+        self.assertGreater(len(reads), 1)
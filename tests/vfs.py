@@ -0,0 +1,80 @@
+import unittest, os, io, zipfile, tarfile
+from .header_files import header_files
+
+headers = {
+    'include/sdk.h' : '#pragma once\n#include "detail/impl.h"\n#if __has_include(<sdk/missing.h>) || !__has_include(<detail/impl.h>)\n#error\n#endif\nsdk\n',
+    'include/detail/impl.h' : '#include "config.h"\nimpl\n',
+    'include/detail/config.h' : '\ufeffconfig\n',
+    'README' : 'not a header\n',
+}
+
+class vfs(header_files, unittest.TestCase):
+    include_dirs = ()
+
+    def preprocess(self, path, p = None):
+        if p is None:
+            p = self.preprocessor()
+        p.line_directive = None
+        p.add_path(path)
+        output = self.output(p, '#include <sdk.h>\n#include <sdk.h>\n#include <../README>\n')
+        self.assertEqual(output.split(), ['config', 'impl', 'sdk', 'not', 'a', 'header'])
+        return p
+
+    def test_dict(self):
+        from pcpp.vfs import DictFileSystem
+        p = self.preprocessor()
+        p.vfs.mount(os.path.join(self.tmpdir, 'memory'), DictFileSystem(headers))
+        self.preprocess(os.path.join(self.tmpdir, 'memory', 'include'), p)
+
+    def test_nested(self):
+        # A file system mounted within another hides what is beneath it, whichever was mounted first
+        from pcpp.vfs import DictFileSystem
+        inner = dict([(name[len('include/'):], text) for name, text in headers.items() if name.startswith('include/')])
+        inner['detail/config.h'] = 'inner\n'
+        for order in (1, -1):
+            p = self.preprocessor()
+            for path, files in [('memory', headers), (os.path.join('memory', 'include'), inner)][::order]:
+                p.vfs.mount(os.path.join(self.tmpdir, path), DictFileSystem(files))
+            p.add_path(os.path.join(self.tmpdir, 'memory', 'include'))
+            self.assertEqual(self.output(p, '#include <sdk.h>\n#include <../README>\n').split(), ['inner', 'impl', 'sdk', 'not', 'a', 'header'])
+
+    def test_abstract(self):
+        from pcpp.vfs import IndexedFileSystem
+        self.assertRaises(TypeError, IndexedFileSystem)
+
+    def test_zip(self):
+        archive = os.path.join(self.tmpdir, 'sdk.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for name, text in headers.items():
+                zf.writestr(name, text.encode('utf-8'))
+        p = self.preprocess(archive + '!/include')
+        self.assertEqual(list(p.vfs.mounts), [archive + '!'])
+        self.assertIn(os.path.join(archive + '!', 'include', 'detail', 'impl.h'), [x.included_abspath for x in p.include_times])
+
+    def test_tar(self):
+        archive = os.path.join(self.tmpdir, 'sdk.tar.gz')
+        with tarfile.open(archive, 'w:gz') as tf:
+            for name, text in headers.items():
+                data = text.encode('utf-8')
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+        self.preprocess(archive + '!/include')
+
+    def test_pcmd(self):
+        from pcpp import CmdPreprocessor
+        archive = os.path.join(self.tmpdir, 'sdk.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for name, text in headers.items():
+                zf.writestr(name, text.encode('utf-8'))
+        self.write('main.c', '#include <sdk.h>\n')
+        p = CmdPreprocessor(['pcpp', '-I', archive + '!/include', '--line-directive',
+                             '-o', os.path.join(self.tmpdir, 'main.i'),
+                             '--filetimes', os.path.join(self.tmpdir, 'times.csv'),
+                             os.path.join(self.tmpdir, 'main.c')])
+        self.assertEqual(p.return_code, 0)
+        p.args.filetimes.close()
+        with open(os.path.join(self.tmpdir, 'main.i'), 'rt') as ih:
+            self.assertEqual(ih.read().split(), ['config', 'impl', 'sdk'])
+        with open(os.path.join(self.tmpdir, 'times.csv'), 'rt') as ih:
+            self.assertIn(',%d,"%s"' % (len(headers['include/sdk.h']), os.path.join(archive + '!', 'include', 'sdk.h')), ih.read())